@@ -0,0 +1,128 @@
+"""Benchmark the event-loop latency of AsyncChpipManager under concurrent load.
+
+Each level launches that many operations on one event loop, a hundred per
+loop iteration, mixing catalog queries (revalidated against a local HTTP server), index reads
+and index changes, while a ticker coroutine measures how late the loop
+wakes it up. The same mix run through a plain ChpipManager from the loop
+shows the stalls the async manager avoids.
+
+Usage: python benchmarks/bench_aio.py [--loads 0,100,1000,5000] [--interval-ms 1]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chpip import core  # noqa: E402
+from chpip.aio import AsyncChpipManager  # noqa: E402
+from chpip.utils import timer  # noqa: E402
+
+from bench_core import make_catalog, start_server  # noqa: E402
+
+INDEXES = 10
+BATCH_SIZE = 100
+HEADER = '{:<6} {:>6} {:>8} {:>9} {:>9} {:>9} {:>9}'.format(
+    'mode', 'load', 'wall_s', 'ops/s', 'p50_ms', 'p99_ms', 'max_ms')
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+async def ticker(interval, lags, stop):
+    while not stop.is_set():
+        start = timer()
+        await asyncio.sleep(interval)
+        lags.append((timer() - start - interval) * 1000)
+
+
+def operations(manager, load):
+    """Return ``load`` calls of ``manager``: one third catalog queries, index reads and index changes each."""
+    calls = []
+    for i in range(load):
+        if i % 3 == 0:
+            calls.append(lambda: manager.list(max_age=0))
+        elif i % 3 == 1:
+            calls.append(manager.current_index)
+        else:
+            calls.append(lambda name='index{}'.format(i % INDEXES): manager.change_index(name))
+    return calls
+
+
+async def measure(mode, manager, load, interval):
+    lags, stop = [], asyncio.Event()
+    tick = asyncio.ensure_future(ticker(interval, lags, stop))
+    await asyncio.sleep(interval * 10)
+    start = timer()
+    if mode == 'async':
+        # Operations arrive in batches, as requests would, rather than all in one loop iteration.
+        tasks = []
+        for i, call in enumerate(operations(manager, load)):
+            tasks.append(asyncio.ensure_future(call()))
+            if i % BATCH_SIZE == BATCH_SIZE - 1:
+                await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+    else:
+        for call in operations(manager, load):
+            call()
+            # Give the ticker a chance between calls, as a well-behaved caller would.
+            await asyncio.sleep(0)
+    wall = timer() - start
+    await asyncio.sleep(interval * 10)
+    stop.set()
+    await tick
+    return wall, lags
+
+
+def run(loads, interval):
+    tmp_dirname = tempfile.mkdtemp(prefix='chpip-bench-')
+    proc = None
+    try:
+        serve_dirname = os.path.join(tmp_dirname, 'serve')
+        os.makedirs(serve_dirname)
+        with open(os.path.join(serve_dirname, 'pip.yml'), 'w') as f:
+            f.write(make_catalog(100))
+        proc, url = start_server(serve_dirname)
+        os.environ[core.CATALOG_SOURCES_ENV] = url + '/pip.yml'
+
+        sync_manager = core.ChpipManager(pip_dirname=os.path.join(tmp_dirname, 'pip'), cache=True,
+                                         fingerprint=lambda: None)
+        sync_manager.set_indexes(dict(('index{}'.format(i), 'https://mirror{}.example.com/pypi/simple'.format(i))
+                                      for i in range(INDEXES)))
+        async_manager = AsyncChpipManager(manager=sync_manager)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            for mode, manager in (('async', async_manager), ('sync', sync_manager)):
+                for load in loads:
+                    wall, lags = loop.run_until_complete(measure(mode, manager, load, interval))
+                    print('{:<6} {:>6} {:>8.2f} {:>9.0f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+                        mode, load, wall, load / wall if wall else 0, percentile(lags, 0.5),
+                        percentile(lags, 0.99), max(lags or [0])))
+        finally:
+            async_manager.close()
+            loop.close()
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        shutil.rmtree(tmp_dirname, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--loads', default='0,100,1000,5000')
+    parser.add_argument('--interval-ms', type=float, default=1.0, help='Period of the ticker.')
+    args = parser.parse_args()
+
+    print(HEADER)
+    run([int(load) for load in args.loads.split(',')], args.interval_ms / 1000.0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+"""Benchmark the core ChpipManager operations against large states and catalogs.
+
+Every operation is measured for each size on a generated state with that
+many indexes, a pre-existing pip.conf with that many options and a catalog
+with that many entries served by a local HTTP server. Wall time is the best
+of ``--repeat`` runs; peak allocations (tracemalloc), read/write syscalls
+(Linux only) and atomic file writes come from one extra run each.
+
+Usage: python benchmarks/bench_core.py [--sizes 10,1000,100000] [--repeat 3]
+                                       [--baseline benchmarks/baseline.json] [--save-baseline PATH]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from collections import OrderedDict, namedtuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chpip import catalog, core  # noqa: E402
+from chpip.utils import STATE_FORMATS, ordered_dump, timer  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+PROC_IO_PATH = '/proc/self/io'
+# A metric regresses when it grows past its baseline by both the factor and
+# the absolute slack, so that tiny operations do not flag noise.
+TOLERANCES = OrderedDict([
+    ('ms', (1.5, 2.0)),
+    ('peak_kib', (1.25, 64)),
+    ('syscalls', (1.25, 16)),
+    ('writes', (1.0, 0)),
+])
+
+Result = namedtuple('Result', ['op', 'size'] + list(TOLERANCES))
+Operation = namedtuple('Operation', ['name', 'setup', 'run'])
+
+
+def make_state(size):
+    indexes = OrderedDict(
+        ('index{}'.format(i), {'index_url': 'https://mirror{}.example.com/pypi/simple'.format(i)})
+        for i in range(size)
+    )
+    return OrderedDict([
+        ('indexes', indexes),
+        ('current_index_name', 'index0'),
+        ('last_index_name', 'index1' if size > 1 else 'index0'),
+    ])
+
+
+def make_pip_config(size):
+    lines = ['[global]', 'index-url = https://mirror0.example.com/pypi/simple', '[bench]']
+    lines.extend('option{} = value{}'.format(i, i) for i in range(size))
+    return '\n'.join(lines) + '\n'
+
+
+def make_catalog(size):
+    indexes = OrderedDict(
+        ('mirror{}'.format(i), 'https://mirror{}.example.com/pypi/simple'.format(i)) for i in range(size)
+    )
+    return ordered_dump(OrderedDict([('indexes', indexes)]), default_flow_style=False)
+
+
+def start_server(dirname):
+    """Serve ``dirname`` from a separate process so that it does not count towards our syscalls."""
+    proc = subprocess.Popen(
+        [sys.executable, '-u', '-m', 'http.server', '0', '--bind', '127.0.0.1'],
+        cwd=dirname, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+    line = proc.stdout.readline().decode('utf-8')
+    port = int(line.split(' port ')[1].split()[0])
+    return proc, 'http://127.0.0.1:{}'.format(port)
+
+
+def read_syscalls():
+    try:
+        with open(PROC_IO_PATH, 'r') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+    except (IOError, OSError):
+        return None
+    return int(counters['syscr']) + int(counters['syscw'])
+
+
+class WriteCounter(object):
+    """Count the atomic file writes done by chpip while installed."""
+
+    MODULES = (core, catalog)
+
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        self._originals = [module.atomic_write for module in self.MODULES]
+        for module, original in zip(self.MODULES, self._originals):
+            module.atomic_write = self._wrap(original)
+        return self
+
+    def _wrap(self, original):
+        def atomic_write(path, data):
+            self.count += 1
+            return original(path, data)
+        return atomic_write
+
+    def __exit__(self, *exc_info):
+        for module, original in zip(self.MODULES, self._originals):
+            module.atomic_write = original
+
+
+def measure(operation, repeat):
+    best = None
+    for _ in range(repeat):
+        operation.setup()
+        start = timer()
+        operation.run()
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    operation.setup()
+    tracemalloc.start()
+    try:
+        operation.run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    operation.setup()
+    with WriteCounter() as writes:
+        before = read_syscalls()
+        operation.run()
+        after = read_syscalls()
+    syscalls = after - before if before is not None else None
+    return best * 1000, peak / 1024.0, syscalls, writes.count
+
+
+def operations(manager, size):
+    state = make_state(size)
+    state_text = manager.state_format.dumps(state)
+    pip_config_text = make_pip_config(size)
+    names = ['index0', 'index1' if size > 1 else 'index0']
+
+    def reset():
+        with open(manager.chpip_path, 'w') as f:
+            f.write(state_text)
+        with open(manager.pip_path, 'w') as f:
+            f.write(pip_config_text)
+
+    def reset_catalog():
+        if os.path.exists(manager.catalog_path):
+            os.remove(manager.catalog_path)
+
+    def noop():
+        pass
+
+    def change_index():
+        names.reverse()
+        manager.change_index(names[0])
+
+    return [
+        Operation('set_index', reset, lambda: manager.set_index('new', 'https://new.example.com/simple')),
+        Operation('change_index', reset, change_index),
+        Operation('show', reset, manager.show),
+        Operation('list-cold', reset_catalog, manager.list),
+        Operation('list-revalidate', noop, lambda: manager.list(refresh=True)),
+        Operation('list-cached', noop, manager.list),
+    ]
+
+
+def run(sizes, repeat, state_format):
+    results = []
+    for size in sizes:
+        tmp_dirname = tempfile.mkdtemp(prefix='chpip-bench-')
+        server_dirname = os.path.join(tmp_dirname, 'server')
+        os.makedirs(server_dirname)
+        with open(os.path.join(server_dirname, 'pip.yml'), 'w') as f:
+            f.write(make_catalog(size))
+        proc, url = start_server(server_dirname)
+        core.SOURCE_PIP_CONFIG_URL = url + '/pip.yml'
+        try:
+            manager = core.ChpipManager(pip_dirname=os.path.join(tmp_dirname, 'pip'), state_format=state_format)
+            manager._ensure_pip_dirname()
+            for operation in operations(manager, size):
+                results.append(Result(operation.name, size, *measure(operation, repeat)))
+                print(format_row(results[-1]))
+        finally:
+            proc.terminate()
+            proc.wait()
+            shutil.rmtree(tmp_dirname)
+    return results
+
+
+HEADER = '{:<16} {:>8} {:>12} {:>12} {:>10} {:>8}'.format('operation', 'indexes', 'time(ms)', 'peak(KiB)',
+                                                            'syscalls', 'writes')
+
+
+def format_row(result):
+    return '{:<16} {:>8} {:>12.2f} {:>12.1f} {:>10} {:>8}'.format(
+        result.op, result.size, result.ms, result.peak_kib,
+        '-' if result.syscalls is None else result.syscalls, result.writes)
+
+
+def result_key(result):
+    return '{}/{}'.format(result.op, result.size)
+
+
+def compare(results, baseline):
+    """Return a line for every metric of ``results`` that regressed against ``baseline``."""
+    regressions = []
+    for result in results:
+        base = baseline.get(result_key(result))
+        if not base:
+            continue
+        for metric, (factor, slack) in TOLERANCES.items():
+            value = getattr(result, metric)
+            if value is None or base.get(metric) is None:
+                continue
+            if value > base[metric] * factor and value - base[metric] > slack:
+                regressions.append('{} {}: {:.2f} -> {:.2f}'.format(result_key(result), metric, base[metric], value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10,1000,100000')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--state-format', choices=list(STATE_FORMATS), default=core.DEFAULT_STATE_FORMAT)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline to compare with if it exists.')
+    parser.add_argument('--save-baseline', metavar='PATH', help='Store the results as a new baseline.')
+    args = parser.parse_args()
+
+    print(HEADER)
+    results = run([int(size) for size in args.sizes.split(',')], args.repeat, args.state_format)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(OrderedDict((result_key(r), OrderedDict((m, getattr(r, m)) for m in TOLERANCES))
+                                  for r in results), f, indent=2)
+            f.write('\n')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            regressions = compare(results, json.load(f))
+        if regressions:
+            print('\nRegressions against {}:'.format(args.baseline))
+            print('\n'.join(regressions))
+            sys.exit(1)
+        print('\nNo regressions against {}.'.format(args.baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Benchmark loading and dumping the chpip state with every state format.
+
+Usage: python benchmarks/bench_state.py [--sizes 10,1000,100000] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yaml  # noqa: E402
+
+from chpip.utils import STATE_FORMATS, ordered_dump, ordered_load, timer  # noqa: E402
+
+
+def make_state(size):
+    indexes = OrderedDict(
+        ('index{}'.format(i), {'index_url': 'https://mirror{}.example.com/pypi/simple'.format(i)})
+        for i in range(size)
+    )
+    return OrderedDict([
+        ('indexes', indexes),
+        ('current_index_name', 'index0'),
+        ('last_index_name', 'index1'),
+    ])
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        start = timer()
+        func(*args)
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def run(sizes, repeat):
+    codecs = OrderedDict()
+    codecs['yaml-pure'] = (
+        lambda text: ordered_load(text, Loader=yaml.SafeLoader),
+        lambda data: ordered_dump(data, Dumper=yaml.SafeDumper),
+    )
+    for name, state_format in STATE_FORMATS.items():
+        codecs[name] = (state_format.loads, state_format.dumps)
+
+    print('{:<10} {:>8} {:>12} {:>12} {:>12}'.format('format', 'indexes', 'load(ms)', 'dump(ms)', 'size(KiB)'))
+    for size in sizes:
+        data = make_state(size)
+        for name, (loads, dumps) in codecs.items():
+            text = dumps(data)
+            print('{:<10} {:>8} {:>12.2f} {:>12.2f} {:>12.1f}'.format(
+                name, size, best_of(repeat, loads, text), best_of(repeat, dumps, data), len(text) / 1024.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10,1000,100000')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run([int(size) for size in args.sizes.split(',')], args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1,6 @@
+import time as _time
+
 __version__ = '0.3.0'
+
+# Lets `--trace` report how long importing chpip took.
+IMPORT_STARTED_AT = getattr(_time, 'perf_counter', _time.time)()
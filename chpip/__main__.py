@@ -1,22 +1,60 @@
 import sys
+import time
 
 import click
 
-from chpip import exception
-from chpip.core import ChpipManager
-
-pip_manager = ChpipManager()
+import chpip
+from chpip import exception, trace
+from chpip.bench import (DEFAULT_PROJECT, DEFAULT_SAMPLES, DEFAULT_STREAMS, DEFAULT_THROUGHPUT_PROJECT,
+                         DEFAULT_THROUGHPUT_TIMEOUT, DEFAULT_TIMEOUT, DEFAULT_WINDOW, format_ms, format_results,
+                         format_throughput)
+from chpip.catalog import CATALOG_FORMATS, DEFAULT_DEADLINE as DEFAULT_CATALOG_DEADLINE
+from chpip.core import (AUTO_INDEX_NAME, CONFLICT_POLICIES, DEFAULT_CONFLICT_POLICY, DEFAULT_INDEX_NAME,
+                        DEFAULT_LATENCY_TTL, DEFAULT_MONITOR_INTERVAL, DEFAULT_MONITOR_SAMPLES, DEFAULT_NETWORK_TTL,
+                        DEFAULT_PROBE_TIMEOUT, DEFAULT_PROJECTS_TIMEOUT, DEFAULT_PROXY_HOST, DEFAULT_PROXY_MAX_SIZE,
+                        DEFAULT_PROXY_PAGE_MAX_AGE, DEFAULT_PROXY_PORT, DEFAULT_RANK_BY, DEFAULT_WARM_WORKERS,
+                        PROBE_FAMILIES, RANK_BY, SERVE_INDEX_NAME, SHELL_HOOK, ChpipManager)
+from chpip.fleet import DEFAULT_WORKERS, apply_to_roots, discover_roots, read_roots
+from chpip.fleet import format_results as format_apply_results
+from chpip.freshness import DEFAULT_MAX_LAG, DEFAULT_SENTINELS, format_results as format_freshness
+from chpip.history import format_stats
 
 
 @click.group(
     help='A tool to manage the base URL of the Python package index.',
     invoke_without_command=True)
-@click.option('-n', '--name', help='Use the Python package index with the specified name.')
+@click.option('-n', '--name', help='Use the Python package index with the specified name. '
+                                   'Use `auto` to pick the one with the lowest latency.')
+@click.option('-f', '--failover', type=int,
+              help='Number of latency-ranked fallback indexes written as `extra-index-url`, '
+                   'together with timeouts derived from their latency. Use 0 to turn it off.')
+@click.option('--max-lag', type=int,
+              help='With `-n auto`, skip indexes lagging behind PyPI by more than this many serials.')
+@click.option('--by', type=click.Choice(RANK_BY), default=DEFAULT_RANK_BY, show_default=True,
+              help='With `-n auto`, rank indexes by latency or by download throughput.')
+@click.option('-r', '--requirements', type=click.Path(dir_okay=False),
+              help='With `-n auto`, only pick an index serving every pinned version of this requirements '
+                   'or lock file.')
+@click.option('--trace', 'trace_', is_flag=True,
+              help='Write timing spans of the command as JSON lines to stderr. '
+                   'Set `CHPIP_TRACE` to 1 or to a file path to do the same.')
 @click.pass_context
-def cli(ctx, name=None):
+def cli(ctx, name=None, failover=None, max_lag=None, by=DEFAULT_RANK_BY, requirements=None, trace_=False):
+    hook = trace.JsonLinesHook(sys.stderr) if trace_ else trace.hook_from_env()
+    if hook:
+        trace.add_hook(hook)
+        ctx.call_on_close(lambda: trace.remove_hook(hook))
+        trace.record('import', trace.timer() - chpip.IMPORT_STARTED_AT)
+        command_span = trace.span('command', command=ctx.invoked_subcommand)
+        ctx.call_on_close(command_span.finish)
+    try:
+        ctx.obj = ChpipManager()
+    except exception.ChpipException as e:
+        click.echo(str(e))
+        ctx.exit(1)
     if ctx.invoked_subcommand is None:
         try:
-            name = pip_manager.change_index(name)
+            name = ctx.obj.change_index(name, failover=failover, max_lag=max_lag, by=by, requirements=requirements)
             click.echo('Change Python package index to `{}` successful.'.format(name))
         except exception.ChpipException as e:
             click.echo(str(e))
@@ -33,19 +71,109 @@ def cli(ctx, name=None):
 @click.pass_context
 def set(ctx, name, index_url):
     try:
-        name = pip_manager.set_index(name, index_url)
+        name = ctx.obj.set_index(name, index_url)
         click.echo('Set Python package index with name `{}` successful.'.format(name))
     except exception.ChpipException as e:
         click.echo(str(e))
         ctx.exit(1)
 
 
+@cli.command(name='import',
+             help='Merge a catalog of Python package indexes in the pip.yml format or JSON, '
+                  'read from a file, a URL or `-` for stdin, with a single write.')
+@click.argument('source')
+@click.option('--on-conflict', type=click.Choice(CONFLICT_POLICIES), default=DEFAULT_CONFLICT_POLICY,
+              show_default=True,
+              help='What to do with a name already set to another URL: keep it, overwrite it, '
+                   'or store the new URL as `<name>-<n>`.')
+@click.pass_context
+def import_(ctx, source, on_conflict):
+    try:
+        results = ctx.obj.import_indexes(source, on_conflict=on_conflict)
+    except exception.ChpipException as e:
+        click.echo(str(e))
+        ctx.exit(1)
+    counts = {}
+    for name, (stored_name, action) in results.items():
+        counts[action] = counts.get(action, 0) + 1
+        if action == 'renamed':
+            click.echo('  {} {} -> {}'.format(action, name, stored_name))
+        elif action != 'added':
+            click.echo('  {} {}'.format(action, name))
+    click.echo('Import {} indexes successful: {}.'.format(
+        len(results), ', '.join('{} {}'.format(counts[action], action) for action in sorted(counts))))
+
+
+@cli.command(help='Export the Python package indexes as a catalog that `chpip import` accepts.')
+@click.option('-o', '--output', type=click.File('w'), default='-', help='File to write instead of stdout.')
+@click.option('--format', 'format_', type=click.Choice(CATALOG_FORMATS), default='yaml', show_default=True,
+              help='Format of the catalog.')
+@click.pass_context
+def export(ctx, output, format_):
+    output.write(ctx.obj.export_indexes(format=format_))
+
+
+@cli.command(help='Change the Python package index of many config roots, '
+                  'such as home directories or virtualenvs, in one run.')
+@click.option('-n', '--name', required=True, help='Name of the Python package index.')
+@click.option('-i', '--index-url', help='Base URL to set for the index in every root before changing to it.')
+@click.option('--roots-from', type=click.Path(exists=True, dir_okay=False),
+              help='File listing one config root per line.')
+@click.option('-g', '--glob', 'patterns', multiple=True,
+              help='Glob matching pip.conf/pip.ini files, directories holding them or virtualenvs. '
+                   'Can be repeated.')
+@click.option('-w', '--workers', type=int, default=DEFAULT_WORKERS, show_default=True,
+              help='Number of roots processed concurrently.')
+@click.option('--dry-run', is_flag=True, help='Show the pip config diff of every root without writing.')
+@click.option('--fail-fast', is_flag=True, help='Skip the remaining roots after the first error.')
+@click.option('--json', 'as_json', is_flag=True, help='Output results as JSON.')
+@click.pass_context
+def apply(ctx, name, index_url, roots_from, patterns, workers, dry_run, fail_fast, as_json):
+    try:
+        roots = read_roots(roots_from) if roots_from else []
+        roots.extend(root for root in discover_roots(patterns) if root not in roots)
+        if not roots:
+            raise exception.NoRootsFound()
+        results = apply_to_roots(roots, name, index_url=index_url, dry_run=dry_run, workers=workers,
+                                 continue_on_error=not fail_fast)
+        click.echo(format_apply_results(results, as_json=as_json))
+        if any(result.status == 'error' for result in results):
+            ctx.exit(1)
+    except exception.ChpipException as e:
+        click.echo(str(e))
+        ctx.exit(1)
+
+
+@cli.command(help='Print shell commands pointing pip at the index with name for the current shell only, '
+                  'e.g. `eval "$(chpip env -n NAME)"`. Nothing is written to pip.conf.')
+@click.option('-n', '--name', help='Name of the Python package index.')
+@click.option('-e', '--extra', 'extra_names', multiple=True,
+              help='Name of an index used as `PIP_EXTRA_INDEX_URL`. Can be repeated.')
+@click.option('-u', '--unset', is_flag=True, help='Print commands removing the variables instead.')
+@click.pass_context
+def env(ctx, name, extra_names, unset):
+    if not name and not unset:
+        raise click.UsageError('Missing option "-n" / "--name".')
+    try:
+        click.echo(ctx.obj.env(name, extra_names=extra_names, unset=unset))
+    except exception.ChpipException as e:
+        click.echo(str(e), err=True)
+        ctx.exit(1)
+
+
+@cli.command(help='Print the shell hook defining `chpip use`, which applies `chpip env` to the current shell. '
+                  'Add `eval "$(chpip init bash)"` to your shell startup file.')
+@click.argument('shell', type=click.Choice(['bash', 'zsh']))
+def init(shell):
+    click.echo(SHELL_HOOK)
+
+
 @cli.command(help='Show all base URLs of the Python package index. '
-                  'Current index is marked with *.')
+                  'Current index is marked with * and fallback indexes with their rank.')
 @click.pass_context
 def show(ctx):
     try:
-        message = pip_manager.show()
+        message = ctx.obj.show()
         click.echo(message)
     except exception.ChpipException as e:
         click.echo(str(e))
@@ -54,15 +182,282 @@ def show(ctx):
 
 @cli.command(help='List the commonly used URLs of the Python package index, '
                   'which can be set by executing the `chpip set` command.')
+@click.option('--refresh', is_flag=True, help='Revalidate the cached list even if it is still fresh.')
+@click.option('--max-age', type=int, help='Seconds for which the cached list is fresh.')
+@click.option('-s', '--source', 'sources', multiple=True,
+              help='URL or local file of a catalog in the pip.yml format. Can be repeated. '
+                   'Defaults to `CHPIP_CATALOG_SOURCES` or the catalog of chpip.')
+@click.option('--merge', is_flag=True,
+              help='Merge the catalogs of all sources instead of using the first one to answer.')
+@click.option('-d', '--deadline', type=float, default=DEFAULT_CATALOG_DEADLINE, show_default=True,
+              help='Seconds after which pending sources are given up on.')
 @click.pass_context
-def list(ctx):
+def list(ctx, refresh, max_age, sources, merge, deadline):
     try:
-        message = pip_manager.list()
+        message = ctx.obj.list(refresh=refresh, max_age=max_age, sources=sources, merge=merge, deadline=deadline)
         click.echo(message)
     except exception.ChpipException as e:
         click.echo(str(e))
         ctx.exit(1)
 
 
+@cli.command(help='Change to the Python package index with the lowest latency. '
+                  'Same as `chpip -n auto`.')
+@click.option('--ttl', type=int, default=DEFAULT_LATENCY_TTL, show_default=True,
+              help='Seconds for which measured latencies are reused.')
+@click.option('--refresh', is_flag=True, help='Measure latencies again even if they are still fresh.')
+@click.option('-f', '--failover', type=int, help='Number of latency-ranked fallback indexes.')
+@click.option('--max-lag', type=int, help='Skip indexes lagging behind PyPI by more than this many serials.')
+@click.option('--by', type=click.Choice(RANK_BY), default=DEFAULT_RANK_BY, show_default=True,
+              help='Rank indexes by latency or by download throughput.')
+@click.option('--network-ttl', type=int, default=DEFAULT_NETWORK_TTL, show_default=True,
+              help='Seconds for which the index last picked on the current network is reused without probing.')
+@click.option('-r', '--requirements', type=click.Path(dir_okay=False),
+              help='Only pick an index serving every pinned version of this requirements or lock file.')
+@click.pass_context
+def fastest(ctx, ttl, refresh, failover, max_lag, by, network_ttl, requirements):
+    try:
+        name = ctx.obj.change_index(AUTO_INDEX_NAME, ttl=ttl, refresh=refresh, failover=failover,
+                                    max_lag=max_lag, by=by, network_ttl=network_ttl, requirements=requirements)
+        click.echo('Change Python package index to `{}` successful.'.format(name))
+    except exception.ChpipException as e:
+        click.echo(str(e))
+        ctx.exit(1)
+
+
+@cli.command(help='Show the fingerprint of the current network and the index `auto` last picked on it. '
+                  'Set `CHPIP_NETWORK_HOOK` to a shell command printing a network name to override detection.')
+@click.pass_context
+def network(ctx):
+    fingerprint = ctx.obj.network_fingerprint()
+    if fingerprint is None:
+        click.echo('The current network cannot be identified.')
+        return
+    entry = (ctx.obj.get_chpip_data().get('networks') or {}).get(fingerprint)
+    click.echo('Network: {}'.format(fingerprint))
+    click.echo('Last picked index: {}'.format(entry['index_name'] if entry else '-'))
+
+
+@cli.command(help='Measure the latency of every configured Python package index concurrently, '
+                  'or with `--throughput` how fast each one delivers a large artifact.')
+@click.option('-s', '--samples', type=int, default=DEFAULT_SAMPLES, show_default=True,
+              help='Number of requests sent to each index.')
+@click.option('-t', '--timeout', type=float,
+              help='Timeout in seconds of each request. '
+                   '[default: {}, {} with --throughput]'.format(DEFAULT_TIMEOUT, DEFAULT_THROUGHPUT_TIMEOUT))
+@click.option('-p', '--project',
+              help='Project whose simple page is requested. '
+                   '[default: {}, {} with --throughput]'.format(DEFAULT_PROJECT, DEFAULT_THROUGHPUT_PROJECT))
+@click.option('-d', '--deadline', type=float, help='Stop probing after this many seconds.')
+@click.option('--catalog', is_flag=True, help='Also probe the commonly used indexes from `chpip list`.')
+@click.option('--throughput', is_flag=True,
+              help='Download a byte window of an artifact of the project with parallel Range requests '
+                   'and report MB/s. Indexes are measured one after another.')
+@click.option('--window', type=int, default=DEFAULT_WINDOW // 1048576, show_default=True,
+              help='MiB downloaded from each index with --throughput.')
+@click.option('--streams', type=int, default=DEFAULT_STREAMS, show_default=True,
+              help='Parallel Range requests with --throughput.')
+@click.option('--json', 'as_json', is_flag=True, help='Output results as JSON.')
+@click.pass_context
+def bench(ctx, samples, timeout, project, deadline, catalog, throughput, window, streams, as_json):
+    try:
+        results = ctx.obj.bench(samples=samples, timeout=timeout, project=project, deadline=deadline,
+                                catalog=catalog, throughput=throughput, window=window * 1048576,
+                                streams=streams)
+        if throughput:
+            click.echo(format_throughput(results, as_json=as_json))
+        else:
+            click.echo(format_results(results, as_json=as_json))
+    except exception.ChpipException as e:
+        click.echo(str(e))
+        ctx.exit(1)
+
+
+@cli.command(name='rewrite-lock',
+             help='Point the index and file URLs of other indexes in a lock or requirements file at the current '
+                  'index. The file is streamed line by line and replaced atomically.')
+@click.argument('path', type=click.Path(dir_okay=False))
+@click.option('-o', '--output', type=click.Path(dir_okay=False), help='File to write instead of rewriting PATH.')
+@click.option('--from', 'from_names', multiple=True,
+              help='Name of an index whose URLs are rewritten. Can be repeated.  [default: all other indexes]')
+@click.option('--to', 'to_name', help='Name of the index to point the URLs at.  [default: the current one]')
+@click.option('--check', is_flag=True,
+              help='Resolve every rewritten URL with a HEAD request and leave the file unchanged if any fails.')
+@click.pass_context
+def rewrite_lock(ctx, path, output, from_names, to_name, check):
+    try:
+        result = ctx.obj.rewrite_lock(path, output=output, from_names=from_names, to_name=to_name, check=check)
+    except exception.ChpipException as e:
+        click.echo(str(e))
+        ctx.exit(1)
+    message = 'Rewrite {} URLs on {} of {} lines of `{}` successful.'.format(
+        result.rewritten_urls, result.rewritten_lines, result.lines, output or path)
+    if check:
+        message += ' {} URLs checked.'.format(result.checked_urls)
+    click.echo(message)
+
+
+@cli.command(help='Check how far each configured Python package index lags behind PyPI.')
+@click.option('-p', '--project', 'projects', multiple=True,
+              help='Sentinel project to compare. Can be repeated.  [default: {}]'.format(
+                  ', '.join(DEFAULT_SENTINELS)))
+@click.option('--max-lag', type=int, default=DEFAULT_MAX_LAG, show_default=True,
+              help='Number of serials an index may lag behind before it is reported as stale.')
+@click.option('--json', 'as_json', is_flag=True, help='Output results as JSON.')
+@click.pass_context
+def freshness(ctx, projects, max_lag, as_json):
+    try:
+        results = ctx.obj.freshness(sentinels=projects or DEFAULT_SENTINELS)
+        click.echo(format_freshness(results, max_lag=max_lag, as_json=as_json))
+    except exception.ChpipException as e:
+        click.echo(str(e))
+        ctx.exit(1)
+
+
+@cli.command(help='Show which configured Python package indexes serve a project. '
+                  'The answer comes from local project lists, which `--refresh` downloads.')
+@click.argument('project', required=False)
+@click.option('--refresh', is_flag=True,
+              help='Update the project lists first; unchanged lists are not downloaded again.')
+@click.option('-t', '--timeout', type=float, default=DEFAULT_PROJECTS_TIMEOUT, show_default=True,
+              help='Seconds to wait for the project list of an index.')
+@click.option('--json', 'as_json', is_flag=True, help='Output results as JSON.')
+@click.pass_context
+def which(ctx, project, refresh, timeout, as_json):
+    from chpip.projects import format_availability, format_refresh
+
+    if not project and not refresh:
+        raise click.UsageError('Missing argument PROJECT.')
+    try:
+        if refresh:
+            results = ctx.obj.refresh_projects(timeout=timeout)
+            if not project or not as_json:
+                click.echo(format_refresh(results, as_json=as_json))
+        if project:
+            availability = ctx.obj.which(project)
+            click.echo(format_availability(availability, as_json=as_json))
+            if not availability.serving:
+                ctx.exit(1)
+    except exception.ChpipException as e:
+        click.echo(str(e))
+        ctx.exit(1)
+
+
+@cli.command(help='Time the DNS lookup, TCP connect, TLS handshake and time to first byte of requests '
+                  'to a configured Python package index, over IPv4 and IPv6, on a cold connection, '
+                  'a kept-alive one and a new one resuming the TLS session.')
+@click.argument('name')
+@click.option('-f', '--family', 'families', type=click.Choice(PROBE_FAMILIES), multiple=True,
+              help='Address family to probe; can be repeated. Defaults to both.')
+@click.option('-t', '--timeout', type=float, default=DEFAULT_PROBE_TIMEOUT, show_default=True,
+              help='Seconds to wait for each phase.')
+@click.option('-p', '--project', help='Project whose page is requested. Defaults to the one of `chpip bench`.')
+@click.option('--json', 'as_json', is_flag=True, help='Output results as JSON.')
+@click.pass_context
+def probe(ctx, name, families, timeout, project, as_json):
+    from chpip.probe import format_probe
+
+    try:
+        results = ctx.obj.probe(name, families=families or PROBE_FAMILIES, timeout=timeout, project=project)
+    except exception.ChpipException as e:
+        click.echo(str(e))
+        ctx.exit(1)
+    click.echo(format_probe(results, as_json=as_json))
+    if not any(r.status is not None and r.status < 400 for r in results):
+        ctx.exit(1)
+
+
+@cli.command(help='Run a local caching proxy implementing the simple repository API (PEP 503) '
+                  'in front of the configured Python package indexes.')
+@click.option('-h', '--host', default=DEFAULT_PROXY_HOST, show_default=True, help='Address to listen on.')
+@click.option('-p', '--port', type=int, default=DEFAULT_PROXY_PORT, show_default=True, help='Port to listen on.')
+@click.option('--max-size', type=int, default=DEFAULT_PROXY_MAX_SIZE // (1024 * 1024), show_default=True,
+              help='Size in MiB of the file cache; least recently used files are evicted first.')
+@click.option('--page-max-age', type=int, default=DEFAULT_PROXY_PAGE_MAX_AGE, show_default=True,
+              help='Seconds before a cached simple page is revalidated.')
+@click.option('--use', is_flag=True,
+              help='Point pip at the proxy while it runs and switch back to the previous index on exit.')
+@click.pass_context
+def serve(ctx, host, port, max_size, page_max_age, use):
+    try:
+        server = ctx.obj.create_proxy_server(host=host, port=port, max_size=max_size * 1024 * 1024,
+                                             page_max_age=page_max_age)
+        previous_index_name = ctx.obj.get_chpip_data().get('current_index_name')
+        if previous_index_name == SERVE_INDEX_NAME:
+            # Left behind by a proxy that did not shut down.
+            previous_index_name = None
+        if use:
+            ctx.obj.set_index(SERVE_INDEX_NAME, server.index_url)
+            ctx.obj.change_index(SERVE_INDEX_NAME)
+        click.echo('Serving {} from {}'.format(server.index_url, ', '.join(server.proxy.upstreams)))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if use:
+                ctx.obj.change_index(previous_index_name or DEFAULT_INDEX_NAME)
+                ctx.obj.remove_index(SERVE_INDEX_NAME)
+    except exception.ChpipException as e:
+        click.echo(str(e))
+        ctx.exit(1)
+
+
+@cli.command(help='Prefetch the simple pages and matching files of a requirements file from the current index '
+                  'into the cache of `chpip serve`, so that later installs through it are served locally.')
+@click.option('-r', '--requirements', required=True, type=click.Path(dir_okay=False),
+              help='Requirements or lock file whose pinned files are prefetched.')
+@click.option('-w', '--workers', type=int, default=DEFAULT_WARM_WORKERS, show_default=True,
+              help='Number of requirements prefetched concurrently.')
+@click.option('--max-size', type=int, default=DEFAULT_PROXY_MAX_SIZE // (1024 * 1024), show_default=True,
+              help='Size in MiB of the file cache; least recently used files are evicted first.')
+@click.option('--platform', help='Platform to pick wheels for, such as `linux-x86_64`.  [default: this one]')
+@click.option('--json', 'as_json', is_flag=True, help='Output results as JSON.')
+@click.pass_context
+def warm(ctx, requirements, workers, max_size, platform, as_json):
+    from chpip.warm import format_results as format_warm
+
+    try:
+        results = ctx.obj.warm(requirements, workers=workers, max_size=max_size * 1024 * 1024, platform=platform)
+        click.echo(format_warm(results, as_json=as_json))
+        if any(result.status in ('error', 'missing') for result in results):
+            ctx.exit(1)
+    except exception.ChpipException as e:
+        click.echo(str(e))
+        ctx.exit(1)
+
+
+@cli.command(help='Probe the configured Python package indexes periodically and record their latency.')
+@click.option('-i', '--interval', type=float, default=DEFAULT_MONITOR_INTERVAL, show_default=True,
+              help='Seconds between two rounds of probes.')
+@click.option('-s', '--samples', type=int, default=DEFAULT_MONITOR_SAMPLES, show_default=True,
+              help='Number of requests sent to each index per round.')
+@click.option('--once', is_flag=True, help='Probe once and exit, e.g. when run from cron.')
+@click.pass_context
+def monitor(ctx, interval, samples, once):
+    def echo_results(results):
+        for result in results:
+            click.echo('{} {} {}'.format(time.strftime('%Y-%m-%d %H:%M:%S'), result.name, format_ms(result.p50)))
+
+    try:
+        ctx.obj.monitor(interval=interval, samples=samples, iterations=1 if once else None,
+                        callback=echo_results)
+    except exception.ChpipException as e:
+        click.echo(str(e))
+        ctx.exit(1)
+
+
+@cli.command(help='Show the latency statistics recorded by `chpip monitor`.')
+@click.option('--json', 'as_json', is_flag=True, help='Output statistics as JSON.')
+@click.pass_context
+def stats(ctx, as_json):
+    try:
+        click.echo(format_stats(ctx.obj.stats(), as_json=as_json))
+    except exception.ChpipException as e:
+        click.echo(str(e))
+        ctx.exit(1)
+
+
 if __name__ == '__main__':
     cli()
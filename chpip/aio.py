@@ -0,0 +1,136 @@
+"""An asyncio interface to ``ChpipManager`` for event-loop based services (Python 3.5+).
+
+``AsyncChpipManager`` shares its state handling with a ``ChpipManager``:
+every call runs the synchronous implementation on a thread pool, so file
+I/O, locks and HTTP requests never block the event loop. Catalog fetches
+and benchmarks go through pooled sessions of ``chpip.http`` kept by the
+manager, so that connections to the indexes are reused across calls.
+Updates are serialized on the loop instead of in worker threads, and
+identical queries in flight at the same time share a single run.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from chpip.catalog import DEFAULT_BACKOFF_FACTOR, DEFAULT_RETRIES
+from chpip.core import DEFAULT_CONFLICT_POLICY, ChpipManager
+from chpip.http import new_session
+
+DEFAULT_MAX_WORKERS = 32
+
+
+class AsyncChpipManager(object):
+    """Run the operations of ``manager`` without blocking the event loop.
+
+    ``manager`` defaults to a ``ChpipManager(cache=True, **kwargs)``, so that
+    high rates of reads are answered from memory. The calls run on
+    ``executor``, by default a pool of ``max_workers`` threads closed by
+    ``close()``, which also closes the sessions keeping up to
+    ``max_workers`` connections per host.
+    """
+
+    def __init__(self, manager=None, executor=None, max_workers=DEFAULT_MAX_WORKERS, **kwargs):
+        if manager is None:
+            kwargs.setdefault('cache', True)
+            manager = ChpipManager(**kwargs)
+        self.manager = manager
+        self._own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_workers)
+        self._update_lock = None
+        self._in_flight = {}
+        self.session = new_session(pool_size=max_workers)
+        # Catalog fetches retry failed requests, as ``fetch_catalogs`` does on its own session.
+        self.catalog_session = new_session(pool_size=max_workers, retries=DEFAULT_RETRIES,
+                                           backoff_factor=DEFAULT_BACKOFF_FACTOR)
+
+    def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def _update(self, func, *args, **kwargs):
+        # Waiting on the loop rather than on the file lock keeps the pool free
+        # for queries while updates queue up.
+        if self._update_lock is None:
+            self._update_lock = asyncio.Lock()
+        async with self._update_lock:
+            try:
+                return await self._run(func, *args, **kwargs)
+            finally:
+                # Queries started before the update must not answer those made after it.
+                self._in_flight.clear()
+
+    def _query(self, func, *args, **kwargs):
+        try:
+            key = (func.__name__, args, tuple(sorted(kwargs.items())))
+            hash(key)
+        except TypeError:
+            return self._run(func, *args, **kwargs)
+        future = self._in_flight.get(key)
+        if future is None:
+            future = self._in_flight[key] = asyncio.ensure_future(self._run(func, *args, **kwargs))
+            future.add_done_callback(functools.partial(self._forget, key))
+        # Callers cancelling their wait must not cancel the run the others share.
+        return asyncio.shield(future)
+
+    def _forget(self, key, future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+
+    async def change_index(self, name=None, **kwargs):
+        """See ``ChpipManager.change_index``."""
+        return await self._update(self.manager.change_index, name, **kwargs)
+
+    async def set_index(self, name, index_url):
+        return await self._update(self.manager.set_index, name, index_url)
+
+    async def set_indexes(self, indexes, on_conflict=DEFAULT_CONFLICT_POLICY):
+        return await self._update(self.manager.set_indexes, indexes, on_conflict=on_conflict)
+
+    async def import_indexes(self, source, on_conflict=DEFAULT_CONFLICT_POLICY):
+        return await self._update(self.manager.import_indexes, source, on_conflict=on_conflict)
+
+    async def current_index(self):
+        return await self._query(self.manager.current_index)
+
+    async def indexes(self):
+        return await self._query(self.manager.indexes)
+
+    async def show(self):
+        return await self._query(self.manager.show)
+
+    async def env(self, name, extra_names=(), unset=False):
+        return await self._query(self.manager.env, name, extra_names=tuple(extra_names), unset=unset)
+
+    async def fetch_catalog(self, **kwargs):
+        """See ``ChpipManager.fetch_catalog``."""
+        kwargs.setdefault('session', self.catalog_session)
+        return await self._query(self.manager.fetch_catalog, **kwargs)
+
+    async def list(self, **kwargs):
+        kwargs.setdefault('session', self.catalog_session)
+        return await self._query(self.manager.list, **kwargs)
+
+    async def bench(self, **kwargs):
+        """See ``ChpipManager.bench``."""
+        kwargs.setdefault('session', self.session)
+        return await self._query(self.manager.bench, **kwargs)
+
+    async def which(self, project):
+        return await self._query(self.manager.which, project)
+
+    async def refresh_projects(self, **kwargs):
+        return await self._query(self.manager.refresh_projects, **kwargs)
+
+    def close(self):
+        """Shut down the thread pool when it was created by this manager and close the sessions."""
+        if self._own_executor:
+            self.executor.shutdown(wait=True)
+        self.session.close()
+        self.catalog_session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        # Waiting for the pool to drain must not block the loop either.
+        await asyncio.get_event_loop().run_in_executor(None, self.close)
@@ -0,0 +1,245 @@
+import json
+import math
+from collections import namedtuple
+
+from chpip.utils import timer
+
+DEFAULT_SAMPLES = 5
+DEFAULT_TIMEOUT = 5.0
+DEFAULT_PROJECT = 'pip'
+DEFAULT_THROUGHPUT_PROJECT = 'numpy'
+DEFAULT_THROUGHPUT_TIMEOUT = 30.0
+DEFAULT_WINDOW = 8 * 1024 * 1024
+DEFAULT_STREAMS = 4
+MAX_WORKERS = 32
+CHUNK_SIZE = 16 * 1024
+
+ProbeResult = namedtuple('ProbeResult', [
+    'name', 'index_url', 'samples', 'errors', 'error_rate',
+    'p50', 'p95', 'ttfb_p50', 'ttfb_p95',
+])
+ThroughputResult = namedtuple('ThroughputResult', [
+    'name', 'index_url', 'artifact_url', 'bytes', 'seconds', 'mbps', 'error',
+])
+
+
+def percentile(values, pct):
+    """Return the nearest-rank percentile of ``values`` or None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(ordered))) - 1
+    return ordered[max(0, min(rank, len(ordered) - 1))]
+
+
+def probe_index(name, index_url, samples=DEFAULT_SAMPLES, timeout=DEFAULT_TIMEOUT,
+                project=DEFAULT_PROJECT, deadline=None, session=None):
+    """Fetch the simple page of ``project`` ``samples`` times from one index.
+
+    Latencies are reported in milliseconds. A sample counts as an error when
+    the request fails, times out, runs past ``deadline`` (an absolute
+    ``timer()`` value) or does not answer with 200. Requests go through
+    ``session`` when given, which is left open, else through a new one.
+    """
+    import requests
+    from chpip.http import new_session, project_url
+
+    url = project_url(index_url, project)
+    latencies, ttfbs = [], []
+    errors = 0
+    own_session = session is None
+    if own_session:
+        session = new_session(pool_size=1)
+    try:
+        for _ in range(samples):
+            request_timeout = timeout
+            if deadline is not None:
+                request_timeout = min(timeout, deadline - timer())
+                if request_timeout <= 0:
+                    errors += 1
+                    continue
+            start = timer()
+            try:
+                resp = session.get(url, timeout=request_timeout, stream=True)
+                ttfb = timer() - start
+                try:
+                    for _ in resp.iter_content(CHUNK_SIZE):
+                        if timer() - start > request_timeout:
+                            raise requests.Timeout()
+                finally:
+                    resp.close()
+            except requests.RequestException:
+                errors += 1
+                continue
+            if resp.status_code != 200:
+                errors += 1
+                continue
+            latencies.append((timer() - start) * 1000)
+            ttfbs.append(ttfb * 1000)
+    finally:
+        if own_session:
+            session.close()
+
+    return ProbeResult(
+        name=name,
+        index_url=index_url,
+        samples=samples,
+        errors=errors,
+        error_rate=float(errors) / samples if samples else 0.0,
+        p50=percentile(latencies, 50),
+        p95=percentile(latencies, 95),
+        ttfb_p50=percentile(ttfbs, 50),
+        ttfb_p95=percentile(ttfbs, 95),
+    )
+
+
+def bench_indexes(indexes, samples=DEFAULT_SAMPLES, timeout=DEFAULT_TIMEOUT,
+                  project=DEFAULT_PROJECT, deadline=None, session=None):
+    """Probe every ``name -> index_url`` in ``indexes`` concurrently.
+
+    Every index gets its own worker, so the run takes as long as the slowest
+    index, which is bounded by ``samples * timeout`` or by ``deadline``
+    seconds when given.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    if not indexes:
+        return []
+    abs_deadline = timer() + deadline if deadline else None
+    jobs = [(name, indexes[name]) for name in indexes]
+
+    def run(job):
+        return probe_index(job[0], job[1], samples=samples, timeout=timeout,
+                           project=project, deadline=abs_deadline, session=session)
+
+    pool = ThreadPool(min(len(jobs), MAX_WORKERS))
+    try:
+        return pool.map(run, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def pick_artifact(files):
+    """Return the file to download for a throughput probe: the last wheel listed, else the last file."""
+    wheels = [f for f in files if f.filename.endswith('.whl')]
+    return (wheels or files)[-1] if files else None
+
+
+def _download_range(session, url, start, end, timeout, deadline):
+    """Download bytes ``start`` to ``end`` of ``url``, discarding them, and return how many arrived."""
+    size = end - start + 1
+    received = 0
+    resp = session.get(url, headers={'Range': 'bytes={}-{}'.format(start, end)}, stream=True, timeout=timeout)
+    try:
+        resp.raise_for_status()
+        for chunk in resp.iter_content(CHUNK_SIZE):
+            received += len(chunk)
+            # Servers ignoring Range send the whole file.
+            if received >= size or timer() > deadline:
+                break
+    finally:
+        resp.close()
+    return min(received, size)
+
+
+def measure_throughput(name, index_url, project=DEFAULT_THROUGHPUT_PROJECT, window=DEFAULT_WINDOW,
+                       streams=DEFAULT_STREAMS, timeout=DEFAULT_THROUGHPUT_TIMEOUT, session=None):
+    """Download the first ``window`` bytes of an artifact of ``project`` from one index.
+
+    The window is split into ``streams`` HTTP Range requests running in
+    parallel; the data is discarded as it arrives. Downloads still running
+    after ``timeout`` seconds are cut short and only count what arrived.
+    ``session``, when given, is used as in ``probe_index``.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    import requests
+    from chpip.http import new_session
+    from chpip.simple import fetch_project
+
+    def result(artifact_url=None, received=0, seconds=None, error=None):
+        mbps = received / seconds / 1e6 if received and seconds else None
+        return ThroughputResult(name, index_url, artifact_url, received, seconds, mbps, error)
+
+    own_session = session is None
+    if own_session:
+        session = new_session(pool_size=streams)
+    try:
+        try:
+            found = fetch_project(session, index_url, project, timeout=timeout)
+        except (requests.RequestException, ValueError) as e:
+            return result(error=str(e))
+        artifact = pick_artifact(found.files if found else [])
+        if artifact is None:
+            return result(error='No artifact of `{}`'.format(project))
+
+        segment = int(math.ceil(window / float(streams)))
+        ranges = [(start, min(start + segment, window) - 1) for start in range(0, window, segment)]
+        pool = ThreadPool(len(ranges))
+        start = timer()
+        deadline = start + timeout
+        try:
+            sizes = pool.map(lambda r: _download_range(session, artifact.url, r[0], r[1], timeout, deadline),
+                             ranges)
+        except requests.RequestException as e:
+            return result(artifact.url, error=str(e))
+        finally:
+            pool.close()
+            pool.join()
+        return result(artifact.url, sum(sizes), timer() - start)
+    finally:
+        if own_session:
+            session.close()
+
+
+def bench_throughput(indexes, project=DEFAULT_THROUGHPUT_PROJECT, window=DEFAULT_WINDOW,
+                     streams=DEFAULT_STREAMS, timeout=DEFAULT_THROUGHPUT_TIMEOUT, session=None):
+    """Measure the throughput of every ``name -> index_url`` in ``indexes``.
+
+    Indexes are measured one after another so that they do not compete for
+    the local bandwidth.
+    """
+    return [measure_throughput(name, indexes[name], project=project, window=window, streams=streams,
+                               timeout=timeout, session=session) for name in indexes]
+
+
+def format_ms(value):
+    return '-' if value is None else '{:.1f}'.format(value)
+
+
+def format_results(results, as_json=False):
+    if as_json:
+        return json.dumps([r._asdict() for r in results], indent=2)
+
+    rows = [('name', 'p50(ms)', 'p95(ms)', 'ttfb(ms)', 'errors', 'index_url')]
+    for r in results:
+        rows.append((
+            r.name, format_ms(r.p50), format_ms(r.p95), format_ms(r.ttfb_p50),
+            '{:.0%}'.format(r.error_rate), r.index_url,
+        ))
+    return format_table(rows)
+
+
+def format_throughput(results, as_json=False):
+    if as_json:
+        return json.dumps([r._asdict() for r in results], indent=2)
+
+    rows = [('name', 'MB/s', 'MiB', 'seconds', 'artifact', 'index_url')]
+    for r in results:
+        rows.append((
+            r.name, '-' if r.mbps is None else '{:.2f}'.format(r.mbps), '{:.1f}'.format(r.bytes / 1048576.0),
+            '-' if r.seconds is None else '{:.2f}'.format(r.seconds),
+            r.error or r.artifact_url.rsplit('/', 1)[-1], r.index_url,
+        ))
+    return format_table(rows)
+
+
+def format_table(rows):
+    """Left-align ``rows`` of strings in columns; the last column is not padded."""
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]) - 1)]
+    lines = []
+    for row in rows:
+        cells = [cell.ljust(width) for cell, width in zip(row, widths)]
+        lines.append('  '.join(cells + [row[-1]]))
+    return '\n'.join(lines)
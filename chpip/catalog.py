@@ -0,0 +1,266 @@
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from chpip import exception, trace
+from chpip.utils import atomic_write, ordered_dump, ordered_load, timer
+
+try:
+    string_types = basestring  # noqa: F821
+except NameError:
+    string_types = str
+
+DEFAULT_MAX_AGE = 24 * 60 * 60
+DEFAULT_TIMEOUT = 10
+CATALOG_FORMATS = ('yaml', 'json')
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF_FACTOR = 0.5
+DEFAULT_DEADLINE = 30
+
+_MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+
+def _is_url(source):
+    return source.startswith(('http://', 'https://'))
+
+
+def parse_max_age(cache_control):
+    """Return the max-age of a Cache-Control header value, 0 when it asks for revalidation or None."""
+    if not cache_control:
+        return None
+    if 'no-cache' in cache_control or 'no-store' in cache_control:
+        return 0
+    match = _MAX_AGE_RE.search(cache_control)
+    return int(match.group(1)) if match else None
+
+
+def parse_catalog(text, source='<string>'):
+    """Return the ``name -> index URL`` mapping of a catalog in the ``pip.yml`` format.
+
+    JSON is a subset of YAML, so both formats are accepted. Every index may
+    be given as a URL or as a mapping with an ``index_url`` key, as in the
+    chpip state.
+    """
+    import yaml
+
+    try:
+        with trace.span('parse', path=source, bytes=len(text)):
+            data = ordered_load(text) or {}
+    except yaml.YAMLError as e:
+        raise exception.InvalidCatalog(source=source, reason=e)
+    indexes = data.get('indexes') if isinstance(data, dict) else None
+    if not isinstance(indexes, dict):
+        raise exception.InvalidCatalog(source=source, reason='no `indexes` mapping')
+    catalog = OrderedDict()
+    for name, value in indexes.items():
+        if isinstance(value, dict):
+            value = value.get('index_url')
+        if not isinstance(value, string_types):
+            raise exception.InvalidCatalog(source=source, reason='no index URL for `{}`'.format(name))
+        catalog[str(name)] = value
+    return catalog
+
+
+def read_catalog(source, timeout=DEFAULT_TIMEOUT):
+    """Read and parse the catalog at ``source``, a URL, a file path or ``-`` for stdin."""
+    if _is_url(source):
+        import requests
+        from chpip.http import new_session
+
+        session = new_session(pool_size=1)
+        try:
+            resp = session.get(source, timeout=timeout)
+            resp.raise_for_status()
+        except requests.RequestException as e:
+            raise exception.RequestError(url=source, reason=e)
+        finally:
+            session.close()
+        text = resp.text
+    elif source == '-':
+        text = sys.stdin.read()
+    else:
+        try:
+            with io.open(os.path.expanduser(source), 'r', encoding='utf-8') as f:
+                text = f.read()
+        except (IOError, OSError) as e:
+            raise exception.InvalidCatalog(source=source, reason=e.strerror)
+    return parse_catalog(text, source=source)
+
+
+def dump_catalog(indexes, format='yaml'):
+    """Return the ``name -> index URL`` mapping ``indexes`` as a catalog in the ``pip.yml`` format."""
+    data = OrderedDict([('indexes', OrderedDict(indexes))])
+    if format == 'json':
+        return json.dumps(data, indent=2)
+    return ordered_dump(data, default_flow_style=False)
+
+
+class CatalogCache(object):
+    """On-disk cache of catalog documents keyed by URL.
+
+    Each entry keeps the body together with its ETag and Last-Modified
+    validators, the time it was fetched and how long it stays fresh.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with trace.span('read', path=self.path) as span:
+            try:
+                with open(self.path, 'r') as f:
+                    text = f.read()
+                span.set(bytes=len(text))
+                return json.loads(text)
+            except ValueError:
+                return {}
+
+    def save(self, entries):
+        atomic_write(self.path, json.dumps(entries))
+
+    def fetch(self, url, refresh=False, max_age=None, timeout=DEFAULT_TIMEOUT, session=None):
+        """Return the body of ``url``, going to the network only when needed.
+
+        A fresh entry is served without any request unless ``refresh`` is set.
+        A stale entry is revalidated with a conditional request and served as
+        is when the network is down, times out or answers with an error.
+        Several URLs may be fetched from concurrent threads.
+        """
+        entries = self.load()
+        entry = entries.get(url)
+        now = time.time()
+        if entry and not refresh:
+            entry_max_age = entry['max_age'] if max_age is None else max_age
+            if now - entry['fetched_at'] < entry_max_age:
+                return entry['body']
+
+        import requests
+        from chpip.http import new_session
+
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        own_session = session is None
+        if own_session:
+            session = new_session(pool_size=1)
+        try:
+            resp = session.get(url, headers=headers, timeout=timeout)
+        except requests.RequestException as e:
+            if entry:
+                return entry['body']
+            raise exception.RequestError(url=url, reason=e)
+        finally:
+            if own_session:
+                session.close()
+
+        if resp.status_code == 304 and entry:
+            entry['fetched_at'] = now
+            server_max_age = parse_max_age(resp.headers.get('Cache-Control'))
+            if server_max_age is not None:
+                entry['max_age'] = server_max_age
+        elif resp.status_code == 200:
+            server_max_age = parse_max_age(resp.headers.get('Cache-Control'))
+            entry = {
+                'body': resp.text,
+                'etag': resp.headers.get('ETag'),
+                'last_modified': resp.headers.get('Last-Modified'),
+                'fetched_at': now,
+                'max_age': DEFAULT_MAX_AGE if server_max_age is None else server_max_age,
+            }
+        elif entry:
+            return entry['body']
+        else:
+            raise exception.RequestError(url=url, reason=resp.reason)
+
+        with self._lock:
+            # Reload so that entries saved by concurrent fetches are kept.
+            entries = self.load()
+            entries[url] = entry
+            self.save(entries)
+        return entry['body']
+
+
+def fetch_catalogs(cache, sources, merge=False, refresh=False, max_age=None, deadline=DEFAULT_DEADLINE,
+                   timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_TIMEOUT), retries=DEFAULT_RETRIES,
+                   backoff_factor=DEFAULT_BACKOFF_FACTOR, session=None):
+    """Fetch the catalogs of ``sources``, URLs or local files, concurrently.
+
+    URLs go through ``cache`` over one pooled session retrying failed
+    requests ``retries`` times with exponential backoff, or over ``session``
+    when given, which is left open. Without ``merge``
+    the first catalog to arrive is returned; with it the catalogs received
+    are merged, earlier sources winning on name conflicts. Sources still
+    pending after ``deadline`` seconds are given up on.
+    """
+    from chpip.http import new_session
+
+    try:
+        from queue import Empty, Queue
+    except ImportError:
+        from Queue import Empty, Queue
+
+    own_session = session is None
+    if own_session:
+        session = new_session(pool_size=len(sources), retries=retries, backoff_factor=backoff_factor)
+    results = Queue()
+
+    parent_id = trace.current_id()
+
+    def fetch(source):
+        try:
+            with trace.span('fetch_source', source=source, parent_id=parent_id):
+                if _is_url(source):
+                    body = cache.fetch(source, refresh=refresh, max_age=max_age, timeout=timeout, session=session)
+                    catalog = parse_catalog(body, source=source)
+                else:
+                    catalog = read_catalog(source)
+            results.put((source, catalog, None))
+        except Exception as e:
+            # Also covers errors of abandoned fetches, e.g. the cache going
+            # away after the command returned.
+            results.put((source, None, e))
+
+    # Daemon threads rather than a pool, so that a hung source is abandoned
+    # at the deadline instead of being joined.
+    for source in sources:
+        thread = threading.Thread(target=fetch, args=(source,))
+        thread.daemon = True
+        thread.start()
+
+    end = timer() + deadline
+    catalogs = {}
+    errors = {}
+    while len(catalogs) + len(errors) < len(sources):
+        try:
+            source, catalog, error = results.get(timeout=max(0, end - timer()))
+        except Empty:
+            break
+        if error:
+            errors[source] = error
+            continue
+        catalogs[source] = catalog
+        if not merge:
+            break
+    if own_session and len(catalogs) + len(errors) == len(sources):
+        session.close()
+
+    if not catalogs:
+        if len(sources) == 1 and sources[0] in errors:
+            raise errors[sources[0]]
+        raise exception.NoCatalogAvailable(sources=', '.join(sources))
+    merged = OrderedDict()
+    for source in sources:
+        for name, index_url in catalogs.get(source, {}).items():
+            merged.setdefault(name, index_url)
+    return merged
@@ -1,22 +1,97 @@
+import copy
+import io
+import math
 import os
 import sys
+import time
 import configparser
-import yaml
-import requests
+from collections import OrderedDict, namedtuple
 
-from chpip import exception
-from chpip.utils import ordered_load, ordered_dump
+from chpip import exception, trace
+from chpip.bench import (DEFAULT_PROJECT, DEFAULT_SAMPLES, DEFAULT_STREAMS, DEFAULT_THROUGHPUT_PROJECT,
+                         DEFAULT_THROUGHPUT_TIMEOUT, DEFAULT_TIMEOUT, DEFAULT_WINDOW, bench_indexes, bench_throughput)
+from chpip.catalog import DEFAULT_DEADLINE as DEFAULT_CATALOG_DEADLINE
+from chpip.catalog import CatalogCache, dump_catalog, fetch_catalogs, read_catalog
+from chpip.freshness import DEFAULT_SENTINELS, DEFAULT_TIMEOUT as DEFAULT_FRESHNESS_TIMEOUT, check_freshness, is_stale
+from chpip.history import LatencyHistory
+from chpip.network import fingerprint as network_fingerprint
+from chpip.utils import STATE_FORMATS, atomic_write, file_lock, safe_filename, shell_quote
 
 PY2 = sys.version_info[0] == 2
 WIN = sys.platform == 'win32'
 DEFAULT_INDEX_NAME = 'default'
 DEFAULT_INDEX_URL = 'https://pypi.org/simple'
+AUTO_INDEX_NAME = 'auto'
+SERVE_INDEX_NAME = 'chpip-serve'
+DEFAULT_LATENCY_TTL = 3600
+DEFAULT_NETWORK_TTL = 7 * 24 * 3600
+NETWORK_HOOK_ENV = 'CHPIP_NETWORK_HOOK'
+MAX_NETWORKS = 64
+RANK_BY = ('latency', 'throughput')
+DEFAULT_RANK_BY = 'latency'
+DEFAULT_STATE_FORMAT = 'yaml'
+DEFAULT_MONITOR_INTERVAL = 300
+DEFAULT_MONITOR_SAMPLES = 3
+DEFAULT_PROXY_HOST = '127.0.0.1'
+DEFAULT_PROXY_PORT = 3141
+DEFAULT_PROXY_MAX_SIZE = 10 * 1024 * 1024 * 1024
+DEFAULT_PROXY_PAGE_MAX_AGE = 600
+DEFAULT_PROJECTS_TIMEOUT = 60.0
+DEFAULT_WARM_WORKERS = 8
+DEFAULT_PROBE_TIMEOUT = 10.0
+PROBE_FAMILIES = ('ipv4', 'ipv6')
 SOURCE_PIP_CONFIG_URL = 'https://raw.githubusercontent.com/Prodesire/chpip/main/pip.yml'
+CATALOG_SOURCES_ENV = 'CHPIP_CATALOG_SOURCES'
+SHELL_HOOK = '''chpip() {
+    if [ "$1" = "use" ]; then
+        shift
+        eval "$(command chpip env "$@")"
+    else
+        command chpip "$@"
+    fi
+}'''
+CONFLICT_POLICIES = ('skip', 'overwrite', 'rename')
+DEFAULT_CONFLICT_POLICY = 'skip'
+FAILOVER_OPTIONS = ('extra-index-url', 'timeout', 'retries')
+FAILOVER_TIMEOUT_FACTOR = 10
+FAILOVER_MIN_TIMEOUT = 3
+FAILOVER_MAX_TIMEOUT = 60
+FAILOVER_RETRY_BUDGET = 30
+FAILOVER_MAX_RETRIES = 5
+
+Index = namedtuple('Index', ['name', 'index_url'])
+
+
+def _stat_key(st):
+    return getattr(st, 'st_mtime_ns', st.st_mtime), st.st_ino, st.st_size
+
+
+def derive_timeouts(latency):
+    """Derive pip's ``timeout`` and ``retries`` from a latency in milliseconds.
+
+    The timeout allows for ``FAILOVER_TIMEOUT_FACTOR`` times the measured
+    latency, and the retries are chosen so that a stalled index gives up
+    within roughly ``FAILOVER_RETRY_BUDGET`` seconds.
+    """
+    if latency is None:
+        timeout = FAILOVER_MAX_TIMEOUT
+    else:
+        timeout = int(math.ceil(latency * FAILOVER_TIMEOUT_FACTOR / 1000.0))
+        timeout = max(FAILOVER_MIN_TIMEOUT, min(timeout, FAILOVER_MAX_TIMEOUT))
+    retries = max(1, min(FAILOVER_RETRY_BUDGET // timeout - 1, FAILOVER_MAX_RETRIES))
+    return timeout, retries
 
 
 class ChpipManager(object):
+    """Manage the pip config and the chpip state of ``pip_dirname``.
+
+    With ``cache`` the parsed files are kept in memory and reused as long as
+    their mtime, inode and size are unchanged, which suits long-running
+    processes reading the state at high rates. ``fingerprint`` is a callable
+    identifying the current network, see ``chpip.network.fingerprint``.
+    """
 
-    def __init__(self, pip_dirname=None):
+    def __init__(self, pip_dirname=None, state_format=None, cache=False, fingerprint=None):
         if WIN:
             appdata_path = os.getenv('APPDATA')
             self.pip_dirname = os.path.join(appdata_path, 'pip') if not pip_dirname else pip_dirname
@@ -24,19 +99,100 @@ class ChpipManager(object):
         else:
             self.pip_dirname = os.path.expanduser('~/.config/pip') if not pip_dirname else pip_dirname
             self.pip_path = os.path.join(self.pip_dirname, 'pip.conf')
-        self.chpip_path = os.path.join(self.pip_dirname, '.chpip.yml')
+        state_format = state_format or os.getenv('CHPIP_STATE_FORMAT') or DEFAULT_STATE_FORMAT
+        if state_format not in STATE_FORMATS:
+            raise exception.InvalidStateFormat(format=state_format, choices=', '.join(STATE_FORMATS))
+        self.state_format = STATE_FORMATS[state_format]
+        self.chpip_path = self._get_chpip_path(self.state_format)
+        self.lock_path = os.path.join(self.pip_dirname, '.chpip.lock')
+        self.catalog_path = os.path.join(self.pip_dirname, '.chpip-catalog.json')
+        self.history_dirname = os.path.join(self.pip_dirname, '.chpip-history')
+        self.serve_dirname = os.path.join(self.pip_dirname, '.chpip-serve')
+        self.env_path = os.path.join(self.pip_dirname, '.chpip-env')
+        self.projects_dirname = os.path.join(self.pip_dirname, '.chpip-projects')
+        self.cache = cache
+        self._cache = {}
+        self._fingerprint = fingerprint
+
+    def _get_chpip_path(self, state_format):
+        return os.path.join(self.pip_dirname, '.chpip' + state_format.extension)
 
     def _ensure_pip_dirname(self):
         if not os.path.exists(self.pip_dirname):
             os.makedirs(self.pip_dirname)
 
-    def change_index(self, name=None):
+    def _lock(self):
+        self._ensure_pip_dirname()
+        return file_lock(self.lock_path)
+
+    def network_fingerprint(self):
+        if self._fingerprint:
+            return self._fingerprint()
+        return network_fingerprint(hook=os.getenv(NETWORK_HOOK_ENV))
+
+    @trace.traced('change_index')
+    def change_index(self, name=None, ttl=DEFAULT_LATENCY_TTL, refresh=False, failover=None, max_lag=None,
+                     by=DEFAULT_RANK_BY, network_ttl=DEFAULT_NETWORK_TTL, requirements=None):
+        """Change to the index ``name``, or to the fastest suitable one when it is ``auto``.
+
+        With ``requirements``, the path of a requirements or lock file, ``auto``
+        only considers the indexes serving every pinned version of it.
+        """
+        started_at = time.time()
+        # Probing the indexes and identifying the network may take long, so it
+        # is done on a snapshot of the state before taking the lock.
+        measured = self.get_chpip_data()
+        indexes = measured.get('indexes')
+        if not indexes:
+            raise exception.NoAvailableIndex()
+        if name and name != AUTO_INDEX_NAME and name not in indexes:
+            raise exception.IndexNameNotFound(name=name)
+
+        network = selected = None
+        picked = False
+        if name == AUTO_INDEX_NAME:
+            network = self.network_fingerprint()
+            # The memory only stands for a plain latency-based pick: the requirements,
+            # a lag limit, another ranking or its ttl may call for another index.
+            use_memory = not (refresh or requirements or max_lag is not None or by != DEFAULT_RANK_BY or
+                              ttl != DEFAULT_LATENCY_TTL)
+            selected = self._recall_index(measured, network, network_ttl) if use_memory else None
+            if not selected:
+                # Rankings measured on another network say nothing about this one.
+                new_network = network is not None and network not in (measured.get('networks') or {})
+                selected = self._select_fastest(measured, ttl=ttl, refresh=refresh or new_network, max_lag=max_lag,
+                                                by=by, requirements=requirements)
+                # A pick restricted to some requirements is no pick for the network.
+                picked = not requirements
+        if name != SERVE_INDEX_NAME and (measured.get('failover') if failover is None else failover):
+            # ``auto`` may have measured the latency already.
+            measured_at = (measured.get('latency') or {}).get('measured_at') or 0
+            self._get_ranking(measured, ttl=ttl, refresh=refresh and measured_at < started_at)
+
+        # pip.conf and the chpip state are updated as one transaction; readers
+        # never take the lock since both files are replaced atomically.
+        with self._lock():
+            return self._change_index(name, measured, selected=selected, failover=failover, network=network,
+                                      picked=picked)
+
+    def _change_index(self, name, measured, selected=None, failover=None, network=None, picked=False):
         chpip_data = self.get_chpip_data()
         indexes = chpip_data.get('indexes')
         if not indexes:
             raise exception.NoAvailableIndex()
+        # Keep the rankings measured without the lock unless newer ones were stored meanwhile.
+        for key in ('latency', 'throughput'):
+            measured_at = (measured.get(key) or {}).get('measured_at') or 0
+            if measured_at > ((chpip_data.get(key) or {}).get('measured_at') or 0):
+                chpip_data[key] = measured[key]
 
-        if name:
+        if selected:
+            candidates = self._get_candidates(chpip_data)
+            if selected not in candidates:
+                # Removed while the indexes were probed.
+                raise exception.IndexNameNotFound(name=selected)
+            name, next_index_url = selected, candidates[selected]
+        elif name:
             if name not in indexes:
                 raise exception.IndexNameNotFound(name=name)
             next_index_url = indexes[name]['index_url']
@@ -53,57 +209,413 @@ class ChpipManager(object):
         else:
             current_index_url = indexes[current_index_name]['index_url']
 
-        self._ensure_pip_dirname()
+        if failover is not None:
+            chpip_data['failover'] = failover
         config = self.get_pip_config()
         if not config.has_section('global'):
             config.add_section('global')
         config.set('global', 'index-url', next_index_url)
-        with open(self.pip_path, 'w') as f:
-            config.write(f)
+        self._configure_failover(config, chpip_data, name)
+        self._write_pip_config(config)
 
-        with open(self.chpip_path, 'w') as f:
-            chpip_data['last_index_name'] = current_index_name
-            chpip_data['current_index_name'] = name
-            indexes = chpip_data['indexes']
-            if current_index_name not in indexes:
-                indexes[current_index_name] = {'index_url': current_index_url}
-            f.write(ordered_dump(chpip_data))
+        chpip_data['last_index_name'] = current_index_name
+        chpip_data['current_index_name'] = name
+        indexes = chpip_data['indexes']
+        if current_index_name not in indexes:
+            indexes[current_index_name] = {'index_url': current_index_url}
+        if name not in indexes:
+            indexes[name] = {'index_url': next_index_url}
+        if picked:
+            self._remember_index(chpip_data, network, name)
+        self._write_chpip_data(chpip_data)
         return name
 
-    def set_index(self, name, index_url):
-        if name == DEFAULT_INDEX_NAME:
+    def _recall_index(self, chpip_data, network, network_ttl=DEFAULT_NETWORK_TTL):
+        """Return the index ``auto`` last picked on ``network`` unless it is unknown, expired or removed."""
+        entry = (chpip_data.get('networks') or {}).get(network)
+        if not entry or time.time() - entry['updated_at'] >= network_ttl:
+            return None
+        if entry['index_name'] not in self._get_candidates(chpip_data):
+            return None
+        return entry['index_name']
+
+    @staticmethod
+    def _remember_index(chpip_data, network, name):
+        if network is None:
+            return
+        networks = chpip_data.setdefault('networks', OrderedDict())
+        networks.pop(network, None)
+        networks[network] = OrderedDict([('index_name', name), ('updated_at', time.time())])
+        # Most recently used last; forget the oldest networks.
+        for old in list(networks)[:-MAX_NETWORKS]:
+            del networks[old]
+
+    def _get_candidates(self, chpip_data):
+        candidates = self._get_index_urls(chpip_data)
+        # A proxy left behind by `chpip serve --use` may no longer be running.
+        candidates.pop(SERVE_INDEX_NAME, None)
+        candidates.setdefault(DEFAULT_INDEX_NAME, DEFAULT_INDEX_URL)
+        return candidates
+
+    def _get_ranking(self, chpip_data, ttl=DEFAULT_LATENCY_TTL, refresh=False):
+        """Return an ``OrderedDict`` of candidate names to latency, fastest first.
+
+        Unreachable indexes come last with a latency of None. The ranking is
+        cached in the chpip state and measured again once ``ttl`` expires.
+        """
+        candidates = self._get_candidates(chpip_data)
+        latency = chpip_data.get('latency') or {}
+        ranking = latency.get('ranking') or {}
+        measured_at = latency.get('measured_at') or 0
+        fresh = time.time() - measured_at < ttl and set(ranking) == set(candidates)
+        if refresh or not fresh:
+            ranking = self._store_ranking(chpip_data, bench_indexes(candidates))
+        return ranking
+
+    @staticmethod
+    def _store_ranking(chpip_data, results, measured_at=None):
+        results = sorted(results, key=lambda r: (r.p50 is None, r.error_rate, r.p50))
+        ranking = OrderedDict((r.name, r.p50) for r in results)
+        chpip_data['latency'] = OrderedDict([
+            ('measured_at', time.time() if measured_at is None else measured_at),
+            ('ranking', ranking),
+        ])
+        return ranking
+
+    def _get_throughput_ranking(self, chpip_data, ttl=DEFAULT_LATENCY_TTL, refresh=False):
+        """Return an ``OrderedDict`` of candidate names to MB/s, highest first.
+
+        Like the latency ranking, it is cached in the chpip state for ``ttl``
+        seconds and failed indexes come last with None.
+        """
+        candidates = self._get_candidates(chpip_data)
+        throughput = chpip_data.get('throughput') or {}
+        ranking = throughput.get('ranking') or {}
+        measured_at = throughput.get('measured_at') or 0
+        if refresh or time.time() - measured_at >= ttl or set(ranking) != set(candidates):
+            results = sorted(bench_throughput(candidates), key=lambda r: (r.mbps is None, -(r.mbps or 0)))
+            ranking = OrderedDict((r.name, r.mbps) for r in results)
+            chpip_data['throughput'] = OrderedDict([('measured_at', time.time()), ('ranking', ranking)])
+        return ranking
+
+    def _select_fastest(self, chpip_data, ttl=DEFAULT_LATENCY_TTL, refresh=False, max_lag=None,
+                        by=DEFAULT_RANK_BY, requirements=None):
+        if by not in RANK_BY:
+            raise exception.InvalidRankBy(by=by, choices=', '.join(RANK_BY))
+        required = None
+        if requirements:
+            from chpip.requirements import check_requirements, read_requirements
+
+            # Read the file first so that a bad path fails before any probe.
+            required = read_requirements(requirements)
+        if by == 'throughput':
+            ranking = self._get_throughput_ranking(chpip_data, ttl=ttl, refresh=refresh)
+        else:
+            ranking = self._get_ranking(chpip_data, ttl=ttl, refresh=refresh)
+        reachable = [name for name in ranking if ranking[name] is not None]
+        if not reachable:
+            raise exception.NoReachableIndex()
+
+        candidates = self._get_candidates(chpip_data)
+        if required:
+            results = check_requirements(OrderedDict((name, candidates[name]) for name in reachable), required)
+            unsatisfied = OrderedDict((r.name, r) for r in results if r.missing or r.errors)
+            if len(unsatisfied) == len(reachable):
+                raise exception.NoSatisfyingIndex(path=requirements, details='\n'.join(
+                    self._format_unsatisfied(r) for r in unsatisfied.values()))
+            reachable = [name for name in reachable if name not in unsatisfied]
+        if max_lag is None:
+            return reachable[0]
+
+        results = check_freshness(OrderedDict((name, candidates[name]) for name in reachable),
+                                  DEFAULT_INDEX_URL)
+        stale = set(r.name for r in results if is_stale(r, max_lag))
+        for name in reachable:
+            if name not in stale:
+                return name
+        raise exception.NoFreshIndex(max_lag=max_lag)
+
+    @staticmethod
+    def _format_unsatisfied(result, limit=5):
+        problems = ['misses {}'.format(r) for r in result.missing[:limit]]
+        problems.extend('could not fetch {}'.format(p) for p in result.errors[:limit])
+        more = len(result.missing) + len(result.errors) - len(problems)
+        if more > 0:
+            problems.append('{} more'.format(more))
+        return '  {}: {}'.format(result.name, ', '.join(problems))
+
+    def _configure_failover(self, config, chpip_data, name):
+        """Write the latency-ranked fallbacks of ``name`` and derived timeouts into ``config``.
+
+        The number of fallbacks is kept in the chpip state, so the options are
+        recomputed on every switch until failover is turned off with 0. The
+        cached ranking is used as is; callers measure it beforehand.
+        """
+        failover = chpip_data.get('failover') or 0
+        # The proxy of `chpip serve` fails over itself; fallbacks would let pip go around it.
+        if not failover or name == SERVE_INDEX_NAME:
+            if chpip_data.pop('fallback_index_names', None) is not None:
+                for option in FAILOVER_OPTIONS:
+                    config.remove_option('global', option)
+            return
+
+        candidates = self._get_candidates(chpip_data)
+        ranking = (chpip_data.get('latency') or {}).get('ranking') or {}
+        # Skip the indexes removed since the ranking was measured.
+        ranking = OrderedDict((fallback, ranking[fallback]) for fallback in ranking if fallback in candidates)
+        index_url = candidates.get(name)
+        fallbacks = [
+            fallback for fallback in ranking
+            if ranking[fallback] is not None and fallback != name and candidates[fallback] != index_url
+        ][:failover]
+        if fallbacks:
+            config.set('global', 'extra-index-url', '\n'.join(candidates[fallback] for fallback in fallbacks))
+        else:
+            config.remove_option('global', 'extra-index-url')
+
+        latencies = [ranking[n] for n in [name] + fallbacks if ranking.get(n) is not None]
+        timeout, retries = derive_timeouts(max(latencies) if latencies else None)
+        config.set('global', 'timeout', str(timeout))
+        config.set('global', 'retries', str(retries))
+        chpip_data['fallback_index_names'] = fallbacks
+
+    @staticmethod
+    def _validate_index(name, index_url):
+        if name in (DEFAULT_INDEX_NAME, AUTO_INDEX_NAME):
             raise exception.InvalidIndexName(name=name)
 
         if not index_url.startswith(('http://', 'https://')):
             raise exception.InvalidIndexURL(url=index_url)
 
-        chpip_data = self.get_chpip_data()
-        self._ensure_pip_dirname()
-        with open(self.chpip_path, 'w') as f:
+    @trace.traced('set_index')
+    def set_index(self, name, index_url):
+        self._validate_index(name, index_url)
+
+        with self._lock():
+            chpip_data = self.get_chpip_data()
             indexes = chpip_data.setdefault('indexes', {})
             indexes[name] = {'index_url': index_url}
-            f.write(ordered_dump(chpip_data))
+            self._write_chpip_data(chpip_data)
         return name
 
-    def get_pip_config(self):
+    def remove_index(self, name):
+        """Remove the index ``name``, which must not be the current one."""
+        with self._lock():
+            chpip_data = self.get_chpip_data()
+            indexes = chpip_data.get('indexes') or {}
+            if name not in indexes:
+                raise exception.IndexNameNotFound(name=name)
+            if name == chpip_data.get('current_index_name'):
+                raise exception.IndexInUse(name=name)
+            del indexes[name]
+            if chpip_data.get('last_index_name') == name:
+                del chpip_data['last_index_name']
+            self._write_chpip_data(chpip_data)
+
+    def _read_file(self, path, parse):
+        """Return ``parse`` applied to the content of ``path`` or None if it does not exist.
+
+        The result is shared between calls when caching is enabled, so it
+        must not be modified.
+        """
+        with trace.span('read', path=path) as span:
+            if self.cache:
+                try:
+                    key = _stat_key(os.stat(path))
+                except OSError:
+                    self._cache.pop(path, None)
+                    return None
+                cached = self._cache.get(path)
+                if cached and cached[0] == key:
+                    span.set(cached=True)
+                    return cached[1]
+            try:
+                f = io.open(path, 'r', encoding='utf-8')
+            except (IOError, OSError):
+                return None
+            with f:
+                # The key comes from the opened file so that a replacement
+                # between stat and read is picked up on the next call.
+                key = _stat_key(os.fstat(f.fileno()))
+                text = f.read()
+            span.set(bytes=len(text))
+            with trace.span('parse', path=path):
+                parsed = parse(text)
+        if self.cache:
+            self._cache[path] = (key, parsed)
+        return parsed
+
+    def _write_file(self, path, text, parsed):
+        atomic_write(path, text)
+        if self.cache:
+            self._cache[path] = (_stat_key(os.stat(path)), parsed)
+
+    @staticmethod
+    def _parse_pip_config(text):
         config = configparser.ConfigParser()
-        config.read(self.pip_path)
+        config.read_string(text)
+        return config
+
+    def _load_pip_config(self):
+        config = self._read_file(self.pip_path, self._parse_pip_config)
+        return configparser.ConfigParser() if config is None else config
+
+    @trace.traced('set_indexes')
+    def set_indexes(self, indexes, on_conflict=DEFAULT_CONFLICT_POLICY):
+        """Merge the ``name -> index URL`` mapping ``indexes`` into the state with a single write.
+
+        Every index is validated before anything is written. A name already
+        set to another URL is kept (``skip``), replaced (``overwrite``) or the
+        new URL is stored as ``<name>-<n>`` (``rename``). Returns an
+        OrderedDict mapping each name to ``(stored name, action)``.
+        """
+        if on_conflict not in CONFLICT_POLICIES:
+            raise exception.InvalidConflictPolicy(policy=on_conflict, choices=', '.join(CONFLICT_POLICIES))
+        for name, index_url in indexes.items():
+            self._validate_index(name, index_url)
+
+        results = OrderedDict()
+        with self._lock():
+            chpip_data = self.get_chpip_data()
+            stored = chpip_data.setdefault('indexes', OrderedDict())
+            for name, index_url in indexes.items():
+                stored_name, action = name, 'added'
+                if name in stored:
+                    if stored[name]['index_url'] == index_url:
+                        action = 'unchanged'
+                    elif on_conflict == 'skip':
+                        action = 'skipped'
+                    elif on_conflict == 'overwrite':
+                        action = 'overwritten'
+                    else:
+                        n = 2
+                        while '{}-{}'.format(name, n) in stored and \
+                                stored['{}-{}'.format(name, n)]['index_url'] != index_url:
+                            n += 1
+                        stored_name = '{}-{}'.format(name, n)
+                        action = 'unchanged' if stored_name in stored else 'renamed'
+                if action in ('added', 'overwritten', 'renamed'):
+                    stored[stored_name] = {'index_url': index_url}
+                results[name] = (stored_name, action)
+            if any(action in ('added', 'overwritten', 'renamed') for _, action in results.values()):
+                self._write_chpip_data(chpip_data)
+        return results
+
+    @trace.traced('import_indexes')
+    def import_indexes(self, source, on_conflict=DEFAULT_CONFLICT_POLICY):
+        """Merge the catalog at ``source``, a URL, a file path or ``-`` for stdin, see ``set_indexes``."""
+        return self.set_indexes(read_catalog(source), on_conflict=on_conflict)
+
+    @trace.traced('export_indexes')
+    def export_indexes(self, format='yaml'):
+        """Return the configured indexes as a catalog that ``import_indexes`` accepts."""
+        index_urls = self._get_index_urls(self._load_chpip_data())
+        index_urls.pop(DEFAULT_INDEX_NAME, None)
+        return dump_catalog(index_urls, format=format)
+
+    def get_pip_config(self):
+        config = self._load_pip_config()
+        if self.cache:
+            f = io.StringIO()
+            config.write(f)
+            config = self._parse_pip_config(f.getvalue())
         return config
 
+    def _write_pip_config(self, config):
+        f = io.StringIO()
+        config.write(f)
+        self._write_file(self.pip_path, f.getvalue(), config)
+
+    def _load_chpip_data(self):
+        # Fall back to the state file of another format so that switching
+        # formats migrates the existing state on the next write.
+        for state_format in [self.state_format] + list(STATE_FORMATS.values()):
+            chpip_data = self._read_file(self._get_chpip_path(state_format), state_format.loads)
+            if chpip_data is not None:
+                return chpip_data
+        return {}
+
     def get_chpip_data(self):
-        if os.path.exists(self.chpip_path):
-            with open(self.chpip_path, 'r') as f:
-                chpip_data = ordered_load(f.read()) or {}
+        chpip_data = self._load_chpip_data()
+        return copy.deepcopy(chpip_data) if self.cache else chpip_data
+
+    def _write_chpip_data(self, chpip_data):
+        with trace.span('dump', path=self.chpip_path):
+            text = self.state_format.dumps(chpip_data)
+        self._write_file(self.chpip_path, text, chpip_data)
+        for state_format in STATE_FORMATS.values():
+            chpip_path = self._get_chpip_path(state_format)
+            if chpip_path != self.chpip_path and os.path.exists(chpip_path):
+                os.remove(chpip_path)
+        self._write_env_lookup(chpip_data)
+
+    def _write_env_lookup(self, chpip_data):
+        # A tab separated `name url` file read by `chpip env`, so that the
+        # shell hook never has to parse the state file.
+        index_urls = OrderedDict([(DEFAULT_INDEX_NAME, DEFAULT_INDEX_URL)])
+        index_urls.update(self._get_index_urls(chpip_data))
+        atomic_write(self.env_path, u''.join(u'{}\t{}\n'.format(name, url) for name, url in index_urls.items()))
+
+    def _read_env_lookup(self):
+        if not os.path.exists(self.env_path):
+            # State written before the lookup file existed.
+            with self._lock():
+                self._write_env_lookup(self.get_chpip_data())
+        index_urls = {}
+        with io.open(self.env_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                name, _, url = line.rstrip('\n').partition('\t')
+                if url:
+                    index_urls[name] = url
+        return index_urls
+
+    @trace.traced('env')
+    def env(self, name, extra_names=(), unset=False):
+        """Return shell commands pointing pip at the index ``name`` through environment variables.
+
+        Unlike ``change_index`` nothing is written, so the change only applies
+        to the shell evaluating the commands.
+        """
+        if unset:
+            return 'unset PIP_INDEX_URL PIP_EXTRA_INDEX_URL'
+
+        index_urls = self._read_env_lookup()
+        for index_name in (name,) + tuple(extra_names):
+            if index_name not in index_urls:
+                raise exception.IndexNameNotFound(name=index_name)
+        lines = ['export PIP_INDEX_URL={}'.format(shell_quote(index_urls[name]))]
+        if extra_names:
+            extra_index_urls = ' '.join(index_urls[index_name] for index_name in extra_names)
+            lines.append('export PIP_EXTRA_INDEX_URL={}'.format(shell_quote(extra_index_urls)))
         else:
-            chpip_data = {}
-        return chpip_data
+            lines.append('unset PIP_EXTRA_INDEX_URL')
+        return '\n'.join(lines)
 
+    @staticmethod
+    def _get_index_urls(chpip_data):
+        indexes = chpip_data.get('indexes') or {}
+        return OrderedDict((name, indexes[name]['index_url']) for name in indexes)
+
+    def current_index(self):
+        """Return the ``Index`` pip currently uses or None when chpip has not changed it yet."""
+        chpip_data = self._load_chpip_data()
+        name = chpip_data.get('current_index_name')
+        if not name:
+            return None
+        return Index(name, chpip_data['indexes'][name]['index_url'])
+
+    def indexes(self):
+        """Return the list of every configured ``Index``."""
+        return [Index(name, index_url) for name, index_url in self._get_index_urls(self._load_chpip_data()).items()]
+
+    @trace.traced('show')
     def show(self):
-        chpip_data = self.get_chpip_data()
+        chpip_data = self._load_chpip_data()
         if not chpip_data:
             return ''
 
         current_index_name = chpip_data.get('current_index_name')
+        fallback_index_names = chpip_data.get('fallback_index_names') or []
         indexes = chpip_data.get('indexes') or {}
         lines = []
         for name in indexes:
@@ -111,21 +623,212 @@ class ChpipManager(object):
             index_url = index_data.get('index_url')
             if name == current_index_name:
                 line = '* {} ({})'.format(name, index_url)
+            elif name in fallback_index_names:
+                line = '{} {} ({})'.format(fallback_index_names.index(name) + 1, name, index_url)
             else:
                 line = '  {} ({})'.format(name, index_url)
+            summary = self.get_history(name).summary()
+            if summary and summary.ewma is not None:
+                line += ' ~{:.0f}ms'.format(summary.ewma)
             lines.append(line)
         return '\n'.join(lines)
 
-    def list(self):
-        resp = requests.get(SOURCE_PIP_CONFIG_URL)
-        if resp.status_code != 200:
-            raise exception.RequestError(url=SOURCE_PIP_CONFIG_URL, reason=resp.reason)
+    def get_history(self, name):
+        return LatencyHistory(os.path.join(self.history_dirname, safe_filename(name) + '.ring'))
+
+    def monitor(self, interval=DEFAULT_MONITOR_INTERVAL, samples=DEFAULT_MONITOR_SAMPLES,
+                timeout=DEFAULT_TIMEOUT, iterations=None, callback=None):
+        """Probe the configured indexes every ``interval`` seconds and record the results.
+
+        Runs forever unless ``iterations`` is given. ``callback`` is called
+        with the probe results of every round.
+        """
+        iteration = 0
+        while iterations is None or iteration < iterations:
+            started_at = time.time()
+            chpip_data = self.get_chpip_data()
+            if not chpip_data.get('indexes'):
+                raise exception.NoAvailableIndex()
+            # The candidates of ``auto``, so that the round can replace its ranking.
+            results = bench_indexes(self._get_candidates(chpip_data), samples=samples, timeout=timeout)
+            for result in results:
+                self.get_history(result.name).record(result.p50, timestamp=started_at)
+            self._update_ranking(results, measured_at=started_at)
+            if callback:
+                callback(results)
+            iteration += 1
+            if iterations is None or iteration < iterations:
+                time.sleep(max(0, started_at + interval - time.time()))
+
+    def _update_ranking(self, results, measured_at=None):
+        # Keep the cached ranking and the failover options in pip.conf in
+        # line with the latest measurements.
+        with self._lock():
+            chpip_data = self.get_chpip_data()
+            if set(self._get_candidates(chpip_data)) != set(r.name for r in results):
+                return
+            self._store_ranking(chpip_data, results, measured_at=measured_at)
+            name = chpip_data.get('current_index_name')
+            if name and chpip_data.get('failover'):
+                config = self.get_pip_config()
+                if not config.has_section('global'):
+                    config.add_section('global')
+                self._configure_failover(config, chpip_data, name)
+                self._write_pip_config(config)
+            self._write_chpip_data(chpip_data)
+
+    def get_upstream_urls(self):
+        """Return the URLs of the candidate indexes, current first and then by latency."""
+        chpip_data = self.get_chpip_data()
+        candidates = self._get_candidates(chpip_data)
+        names = []
+        current_index_name = chpip_data.get('current_index_name')
+        if current_index_name == SERVE_INDEX_NAME:
+            current_index_name = chpip_data.get('last_index_name')
+        if current_index_name in candidates:
+            names.append(current_index_name)
+        ranking = (chpip_data.get('latency') or {}).get('ranking') or {}
+        names.extend(name for name in ranking if ranking[name] is not None)
+        names.extend(candidates)
+        urls = []
+        for name in names:
+            if name in candidates and candidates[name] not in urls:
+                urls.append(candidates[name])
+        return urls
+
+    def create_proxy_server(self, host=DEFAULT_PROXY_HOST, port=DEFAULT_PROXY_PORT,
+                            max_size=DEFAULT_PROXY_MAX_SIZE, page_max_age=DEFAULT_PROXY_PAGE_MAX_AGE):
+        from chpip.proxy import CachingProxy, ProxyServer
+
+        proxy = CachingProxy(self.get_upstream_urls(), self.serve_dirname,
+                             max_size=max_size, page_max_age=page_max_age)
+        server = ProxyServer(proxy, host=host, port=port)
+        if server.index_url in proxy.upstreams:
+            proxy.upstreams.remove(server.index_url)
+        return server
+
+    @trace.traced('warm')
+    def warm(self, requirements, workers=DEFAULT_WARM_WORKERS, max_size=DEFAULT_PROXY_MAX_SIZE, platform=None):
+        """Prefetch the pages and files of the requirements file ``requirements`` into the cache of `chpip serve`.
 
-        pip_conf = yaml.safe_load(resp.text)
-        indexes = pip_conf.get('indexes') or {}
+        Pages come from the current index first, like the proxy would fetch
+        them, so that a later install through the proxy is served locally.
+        """
+        from chpip.proxy import CachingProxy
+        from chpip.requirements import read_requirements
+        from chpip.warm import warm_cache
+
+        required = read_requirements(requirements)
+        proxy = CachingProxy(self.get_upstream_urls(), self.serve_dirname, max_size=max_size,
+                             page_max_age=DEFAULT_PROXY_PAGE_MAX_AGE)
+        return warm_cache(proxy, required, workers=workers, platform=platform)
+
+    @trace.traced('rewrite_lock')
+    def rewrite_lock(self, path, output=None, from_names=(), to_name=None, check=False):
+        """Point the URLs of other indexes in the lock or requirements file ``path`` at ``to_name``.
+
+        ``to_name`` defaults to the current index and ``from_names`` to every
+        other index, including the default one.
+        """
+        from chpip.lockfile import build_mapping, rewrite_file
+
+        chpip_data = self._load_chpip_data()
+        candidates = self._get_candidates(chpip_data)
+        to_name = to_name or chpip_data.get('current_index_name') or DEFAULT_INDEX_NAME
+        for name in (to_name,) + tuple(from_names):
+            if name not in candidates:
+                raise exception.IndexNameNotFound(name=name)
+        source_urls = [candidates[name] for name in (from_names or candidates) if name != to_name]
+        return rewrite_file(path, build_mapping(source_urls, candidates[to_name]), output=output, check=check)
+
+    @trace.traced('freshness')
+    def freshness(self, sentinels=DEFAULT_SENTINELS, timeout=DEFAULT_FRESHNESS_TIMEOUT):
+        indexes = self._get_index_urls(self.get_chpip_data())
+        if not indexes:
+            raise exception.NoAvailableIndex()
+        return check_freshness(indexes, DEFAULT_INDEX_URL, sentinels=sentinels, timeout=timeout)
+
+    @trace.traced('refresh_projects')
+    def refresh_projects(self, timeout=DEFAULT_PROJECTS_TIMEOUT):
+        """Update the local project list of every index, downloading only the changed ones."""
+        from chpip.projects import refresh_indexes
+
+        indexes = self._get_index_urls(self.get_chpip_data())
+        if not indexes:
+            raise exception.NoAvailableIndex()
+        return refresh_indexes(self.projects_dirname, indexes, timeout=timeout)
+
+    @trace.traced('which')
+    def which(self, project):
+        """Tell which indexes serve ``project`` from the local project lists, without any request."""
+        from chpip.projects import find_project
+
+        indexes = self._get_index_urls(self._load_chpip_data())
+        if not indexes:
+            raise exception.NoAvailableIndex()
+        return find_project(self.projects_dirname, indexes, project)
+
+    @trace.traced('probe')
+    def probe(self, name, families=PROBE_FAMILIES, timeout=DEFAULT_PROBE_TIMEOUT, project=None):
+        """Time the DNS, connect, TLS and first byte phases of requests to the index ``name``, see ``probe_index``."""
+        from chpip.probe import probe_index
+
+        index_urls = self._get_index_urls(self.get_chpip_data())
+        if name not in index_urls:
+            raise exception.IndexNameNotFound(name=name)
+        return probe_index(index_urls[name], families=families, project=project or DEFAULT_PROJECT,
+                           timeout=timeout)
+
+    @trace.traced('stats')
+    def stats(self):
+        indexes = self._get_index_urls(self.get_chpip_data())
+        return [self.get_history(name).stats(name) for name in indexes]
+
+    def get_catalog_sources(self):
+        """Return the catalog sources from ``CHPIP_CATALOG_SOURCES``, comma or space separated."""
+        sources = os.getenv(CATALOG_SOURCES_ENV, '').replace(',', ' ').split()
+        return sources or [SOURCE_PIP_CONFIG_URL]
+
+    @trace.traced('fetch_catalog')
+    def fetch_catalog(self, refresh=False, max_age=None, sources=None, merge=False,
+                      deadline=DEFAULT_CATALOG_DEADLINE, session=None):
+        self._ensure_pip_dirname()
+        return fetch_catalogs(CatalogCache(self.catalog_path), sources or self.get_catalog_sources(), merge=merge,
+                              refresh=refresh, max_age=max_age, deadline=deadline, session=session)
+
+    @trace.traced('list')
+    def list(self, refresh=False, max_age=None, sources=None, merge=False, deadline=DEFAULT_CATALOG_DEADLINE,
+             session=None):
+        indexes = self.fetch_catalog(refresh=refresh, max_age=max_age, sources=sources, merge=merge,
+                                     deadline=deadline, session=session)
         lines = []
         for name in indexes:
             index_url = indexes[name]
             line = '  {} ({})'.format(name, index_url)
             lines.append(line)
         return '\n'.join(lines)
+
+    @trace.traced('bench')
+    def bench(self, samples=DEFAULT_SAMPLES, timeout=None,
+              project=None, deadline=None, catalog=False, throughput=False,
+              window=DEFAULT_WINDOW, streams=DEFAULT_STREAMS, session=None):
+        """Measure the latency of every index, or its throughput with ``throughput``.
+
+        ``project`` and ``timeout`` default to a small project and a short
+        timeout for latency, to a project with large artifacts and a longer
+        timeout for throughput. The indexes are probed over ``session`` when
+        given.
+        """
+        indexes = self._get_index_urls(self.get_chpip_data())
+        if catalog:
+            known_urls = set(indexes.values())
+            for name, index_url in self.fetch_catalog().items():
+                if name not in indexes and index_url not in known_urls:
+                    indexes[name] = index_url
+        if not indexes:
+            raise exception.NoAvailableIndex()
+        if throughput:
+            return bench_throughput(indexes, project=project or DEFAULT_THROUGHPUT_PROJECT, window=window,
+                                    streams=streams, timeout=timeout or DEFAULT_THROUGHPUT_TIMEOUT, session=session)
+        return bench_indexes(indexes, samples=samples, timeout=timeout or DEFAULT_TIMEOUT,
+                             project=project or DEFAULT_PROJECT, deadline=deadline, session=session)
@@ -10,10 +10,27 @@ class NoAvailableIndex(ChpipException):
     msg_fmt = 'There is no available index to change. Please use `chpip set` to set one.'
 
 
+class NoReachableIndex(ChpipException):
+    msg_fmt = 'None of the indexes is reachable. Please use `chpip bench` to check them.'
+
+
+class NoFreshIndex(ChpipException):
+    msg_fmt = 'None of the reachable indexes lags behind PyPI by at most {max_lag} serials. ' \
+              'Please use `chpip freshness` to check them.'
+
+
+class CanonicalIndexError(ChpipException):
+    msg_fmt = 'Cannot check the freshness of the indexes against `{url}`. Reason: {reason}.'
+
+
 class IndexNameNotFound(ChpipException):
     msg_fmt = 'There is no index with name {name}. Please use `chpip set` to set one.'
 
 
+class IndexInUse(ChpipException):
+    msg_fmt = 'The index with name {name} is the current one. Please change to another one first.'
+
+
 class InvalidIndexName(ChpipException):
     msg_fmt = 'Invalid index name `{name}`. Cannot use revered name.'
 
@@ -24,3 +41,55 @@ class InvalidIndexURL(ChpipException):
 
 class RequestError(ChpipException):
     msg_fmt = 'Request to `{url}` error. Reason: {reason}.'
+
+
+class UpstreamUnavailable(ChpipException):
+    msg_fmt = 'No upstream index could be reached for `{name}`. Reason: {reason}.'
+
+
+class InvalidStateFormat(ChpipException):
+    msg_fmt = 'Invalid state format `{format}`. Choose from {choices}.'
+
+
+class ChecksumMismatch(ChpipException):
+    msg_fmt = 'Downloaded data does not match `{key}`.'
+
+
+class RootNotFound(ChpipException):
+    msg_fmt = 'Config root `{root}` does not exist.'
+
+
+class NoRootsFound(ChpipException):
+    msg_fmt = 'No config roots found. Please use `--roots-from` or `--glob` to specify them.'
+
+
+class InvalidCatalog(ChpipException):
+    msg_fmt = 'Invalid index catalog `{source}`. Reason: {reason}.'
+
+
+class InvalidConflictPolicy(ChpipException):
+    msg_fmt = 'Invalid conflict policy `{policy}`. Choose from {choices}.'
+
+
+class NoCatalogAvailable(ChpipException):
+    msg_fmt = 'None of the catalog sources {sources} could be fetched in time.'
+
+
+class InvalidRankBy(ChpipException):
+    msg_fmt = 'Invalid ranking `{by}`. Choose from {choices}.'
+
+
+class InvalidRequirements(ChpipException):
+    msg_fmt = 'Invalid requirements file `{path}`. Reason: {reason}.'
+
+
+class NoSatisfyingIndex(ChpipException):
+    msg_fmt = 'None of the reachable indexes serves every requirement of `{path}`:\n{details}'
+
+
+class InvalidLockFile(ChpipException):
+    msg_fmt = 'Cannot read `{path}`. Reason: {reason}.'
+
+
+class UnresolvedURLs(ChpipException):
+    msg_fmt = '{count} rewritten URLs do not resolve, so `{path}` was left unchanged:\n{details}'
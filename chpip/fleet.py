@@ -0,0 +1,133 @@
+import glob
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import namedtuple
+
+from chpip import exception
+from chpip.bench import format_table
+from chpip.core import ChpipManager
+from chpip.utils import STATE_FORMATS
+
+DEFAULT_WORKERS = 16
+PIP_CONFIG_FILENAMES = ('pip.conf', 'pip.ini')
+VENV_MARKER = 'pyvenv.cfg'
+
+RootResult = namedtuple('RootResult', ['root', 'status', 'message', 'diff'])
+
+
+def read_roots(path):
+    """Read one config root per line from ``path``, skipping blank lines and comments."""
+    with open(path, 'r') as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+
+
+def discover_roots(patterns):
+    """Return the config roots matching the glob ``patterns``.
+
+    A match is a root when it is a ``pip.conf``/``pip.ini`` file (its
+    directory is the root), a directory holding one, or a virtualenv.
+    """
+    roots = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(os.path.expanduser(pattern))):
+            if os.path.isfile(path) and os.path.basename(path) in PIP_CONFIG_FILENAMES:
+                root = os.path.dirname(path)
+            elif os.path.isdir(path) and any(
+                    os.path.exists(os.path.join(path, filename))
+                    for filename in PIP_CONFIG_FILENAMES + (VENV_MARKER,)):
+                root = path
+            else:
+                continue
+            if root not in roots:
+                roots.append(root)
+    return roots
+
+
+def _apply(manager, name, index_url):
+    if index_url:
+        manager.set_index(name, index_url)
+    return manager.change_index(name)
+
+
+def _read(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return f.readlines()
+
+
+def _dry_run(root, name, index_url):
+    import difflib
+
+    manager = ChpipManager(pip_dirname=root)
+    tmp_dirname = tempfile.mkdtemp(prefix='chpip-')
+    try:
+        filenames = PIP_CONFIG_FILENAMES + tuple('.chpip' + f.extension for f in STATE_FORMATS.values())
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            if os.path.exists(path):
+                shutil.copy2(path, tmp_dirname)
+        copy = ChpipManager(pip_dirname=tmp_dirname)
+        name = _apply(copy, name, index_url)
+        diff = ''.join(difflib.unified_diff(
+            _read(manager.pip_path), _read(copy.pip_path), fromfile=manager.pip_path, tofile=manager.pip_path))
+    finally:
+        shutil.rmtree(tmp_dirname)
+    return name, diff
+
+
+def apply_to_roots(roots, name, index_url=None, dry_run=False, workers=DEFAULT_WORKERS,
+                   continue_on_error=True):
+    """Switch every config root in ``roots`` to the index ``name`` using a pool of threads.
+
+    The index is registered first when ``index_url`` is given. With
+    ``dry_run`` the changes are made on a copy and only the pip config diff
+    is reported. Without ``continue_on_error`` roots not started yet after
+    the first failure are skipped.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    failed = threading.Event()
+
+    def run(root):
+        if failed.is_set() and not continue_on_error:
+            return RootResult(root, 'skipped', 'Skipped after an earlier error.', '')
+        try:
+            if not os.path.isdir(root):
+                raise exception.RootNotFound(root=root)
+            if dry_run:
+                changed_name, diff = _dry_run(root, name, index_url)
+                status = 'changed' if diff else 'unchanged'
+                return RootResult(root, status, 'Would change index to `{}`.'.format(changed_name), diff)
+            changed_name = _apply(ChpipManager(pip_dirname=root), name, index_url)
+            return RootResult(root, 'ok', 'Changed index to `{}`.'.format(changed_name), '')
+        except (exception.ChpipException, EnvironmentError) as e:
+            failed.set()
+            return RootResult(root, 'error', str(e), '')
+
+    if not roots:
+        return []
+    pool = ThreadPool(min(len(roots), workers))
+    try:
+        return pool.map(run, roots)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def format_results(results, as_json=False):
+    if as_json:
+        return json.dumps([r._asdict() for r in results], indent=2)
+
+    lines = [r.diff.rstrip('\n') for r in results if r.diff]
+    rows = [('status', 'root', 'message')]
+    rows.extend((r.status, r.root, r.message) for r in results)
+    lines.append(format_table(rows))
+    counts = {}
+    for r in results:
+        counts[r.status] = counts.get(r.status, 0) + 1
+    lines.append(', '.join('{} {}'.format(counts[status], status) for status in sorted(counts)))
+    return '\n'.join(lines)
@@ -0,0 +1,108 @@
+import json
+from collections import namedtuple
+
+from chpip import exception
+from chpip.bench import format_table
+
+DEFAULT_SENTINELS = ('pip', 'setuptools', 'wheel')
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_MAX_LAG = 0
+MAX_WORKERS = 32
+
+FreshnessResult = namedtuple('FreshnessResult', [
+    'name', 'index_url', 'serial_lag', 'missing_files', 'errors',
+])
+
+
+def is_stale(result, max_lag=DEFAULT_MAX_LAG):
+    """Tell whether ``result`` is behind the canonical index by more than ``max_lag`` serials.
+
+    Without serials to compare, a mirror is stale when it misses any file of
+    the canonical index. A mirror that could not be checked is stale too.
+    """
+    if result.errors:
+        return True
+    if result.serial_lag is not None:
+        return result.serial_lag > max_lag
+    return bool(result.missing_files)
+
+
+def check_freshness(indexes, canonical_url, sentinels=DEFAULT_SENTINELS, timeout=DEFAULT_TIMEOUT):
+    """Compare the sentinel projects of every index in ``indexes`` with ``canonical_url``.
+
+    All ``(index, project)`` pairs are fetched concurrently; requests to one
+    index share a session pooling up to one connection per project, and each
+    project costs a single round trip. Raises ``CanonicalIndexError`` when a
+    project cannot be fetched from ``canonical_url``, since the indexes could
+    not be told apart from fresh ones.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    import requests
+    from chpip.http import new_session, project_url
+    from chpip.simple import fetch_project
+
+    urls = dict(indexes)
+    urls[None] = canonical_url
+    sessions = dict((name, new_session(pool_size=len(sentinels))) for name in urls)
+
+    def fetch(job):
+        name, project = job
+        try:
+            return job, fetch_project(sessions[name], urls[name], project, timeout=timeout)
+        except (requests.RequestException, ValueError) as e:
+            return job, e
+
+    jobs = [(name, project) for name in urls for project in sentinels]
+    pool = ThreadPool(min(len(jobs), MAX_WORKERS))
+    try:
+        projects = dict(pool.map(fetch, jobs))
+    finally:
+        pool.close()
+        pool.join()
+        for session in sessions.values():
+            session.close()
+
+    for project in sentinels:
+        error = projects[(None, project)]
+        if isinstance(error, Exception):
+            raise exception.CanonicalIndexError(url=project_url(canonical_url, project), reason=error)
+
+    results = []
+    for name in indexes:
+        serial_lags = []
+        missing_files = 0
+        errors = 0
+        for project in sentinels:
+            canonical = projects[(None, project)]
+            mirror = projects[(name, project)]
+            if not canonical:
+                continue
+            if isinstance(mirror, Exception):
+                errors += 1
+                continue
+            mirror_files = set(f.filename for f in mirror.files) if mirror else set()
+            missing_files += len(set(f.filename for f in canonical.files) - mirror_files)
+            if canonical.serial is not None and mirror and mirror.serial is not None:
+                serial_lags.append(max(0, canonical.serial - mirror.serial))
+        results.append(FreshnessResult(
+            name=name,
+            index_url=indexes[name],
+            serial_lag=max(serial_lags) if serial_lags else None,
+            missing_files=missing_files,
+            errors=errors,
+        ))
+    return results
+
+
+def format_results(results, max_lag=DEFAULT_MAX_LAG, as_json=False):
+    if as_json:
+        return json.dumps([dict(r._asdict(), stale=is_stale(r, max_lag)) for r in results], indent=2)
+
+    rows = [('name', 'serial lag', 'missing files', 'errors', 'status', 'index_url')]
+    for r in results:
+        rows.append((
+            r.name, '-' if r.serial_lag is None else str(r.serial_lag), str(r.missing_files),
+            str(r.errors), 'stale' if is_stale(r, max_lag) else 'fresh', r.index_url,
+        ))
+    return format_table(rows)
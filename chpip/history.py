@@ -0,0 +1,137 @@
+import json
+import math
+import os
+import struct
+import time
+from collections import namedtuple
+
+from chpip.bench import format_ms, format_table, percentile
+from chpip.utils import file_lock, makedirs
+
+MAGIC = b'CHPH'
+VERSION = 1
+DEFAULT_CAPACITY = 4096
+DEFAULT_ALPHA = 0.2
+
+# magic, version, capacity, count, head, ewma, last latency, last timestamp
+HEADER = struct.Struct('<4sHIIIddd')
+# timestamp, latency in milliseconds (NaN for a failed probe)
+RECORD = struct.Struct('<dd')
+
+Summary = namedtuple('Summary', ['count', 'ewma', 'last_latency', 'last_at'])
+Stats = namedtuple('Stats', [
+    'name', 'samples', 'errors', 'error_rate', 'ewma', 'p50', 'p95', 'first_at', 'last_at',
+])
+
+
+class LatencyHistory(object):
+    """Fixed-size ring buffer of latency samples stored in a single file.
+
+    The header keeps the EWMA and the last sample so that ``summary()`` reads
+    a constant number of bytes. The file never grows past ``capacity``
+    records; the oldest sample is overwritten first.
+    """
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY, alpha=DEFAULT_ALPHA):
+        self.path = path
+        self.capacity = capacity
+        self.alpha = alpha
+
+    def _read_header(self, f):
+        data = f.read(HEADER.size)
+        if len(data) < HEADER.size:
+            return None
+        magic, version, capacity, count, head, ewma, last_latency, last_at = HEADER.unpack(data)
+        if magic != MAGIC or version != VERSION:
+            return None
+        return [capacity, count, head, ewma, last_latency, last_at]
+
+    def record(self, latency, timestamp=None):
+        """Append one sample. ``latency`` is None for a failed probe."""
+        timestamp = time.time() if timestamp is None else timestamp
+        value = float('nan') if latency is None else float(latency)
+        makedirs(os.path.dirname(self.path))
+        with file_lock(self.path + '.lock'):
+            if not os.path.exists(self.path):
+                open(self.path, 'wb').close()
+            with open(self.path, 'r+b') as f:
+                header = self._read_header(f)
+                if header is None:
+                    header = [self.capacity, 0, 0, float('nan'), float('nan'), 0.0]
+                    f.seek(0)
+                    f.truncate()
+                capacity, count, head, ewma, last_latency, last_at = header
+
+                # Write the record before the header so that a reader never
+                # sees a header pointing to a record that is not written yet.
+                f.seek(HEADER.size + head * RECORD.size)
+                f.write(RECORD.pack(timestamp, value))
+                if latency is not None:
+                    ewma = value if math.isnan(ewma) else self.alpha * value + (1 - self.alpha) * ewma
+                f.seek(0)
+                f.write(HEADER.pack(MAGIC, VERSION, capacity, min(count + 1, capacity),
+                                    (head + 1) % capacity, ewma, value, timestamp))
+
+    def summary(self):
+        """Return the header ``Summary`` or None when there is no history."""
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            header = self._read_header(f)
+        if header is None or not header[1]:
+            return None
+        _, count, _, ewma, last_latency, last_at = header
+        return Summary(
+            count=count,
+            ewma=None if math.isnan(ewma) else ewma,
+            last_latency=None if math.isnan(last_latency) else last_latency,
+            last_at=last_at,
+        )
+
+    def samples(self):
+        """Return all ``(timestamp, latency)`` samples, oldest first."""
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'rb') as f:
+            header = self._read_header(f)
+            if header is None:
+                return []
+            capacity, count, head = header[:3]
+            data = f.read(count * RECORD.size)
+        records = [RECORD.unpack_from(data, i * RECORD.size) for i in range(len(data) // RECORD.size)]
+        if count == capacity:
+            records = records[head:] + records[:head]
+        return [(ts, None if math.isnan(latency) else latency) for ts, latency in records]
+
+    def stats(self, name):
+        summary = self.summary()
+        samples = self.samples()
+        latencies = [latency for _, latency in samples if latency is not None]
+        errors = len(samples) - len(latencies)
+        return Stats(
+            name=name,
+            samples=len(samples),
+            errors=errors,
+            error_rate=float(errors) / len(samples) if samples else 0.0,
+            ewma=summary.ewma if summary else None,
+            p50=percentile(latencies, 50),
+            p95=percentile(latencies, 95),
+            first_at=samples[0][0] if samples else None,
+            last_at=samples[-1][0] if samples else None,
+        )
+
+
+def format_stats(stats, as_json=False):
+    if as_json:
+        return json.dumps([s._asdict() for s in stats], indent=2)
+
+    def format_time(value):
+        return '-' if value is None else time.strftime('%Y-%m-%d %H:%M', time.localtime(value))
+
+    rows = [('name', 'ewma(ms)', 'p50(ms)', 'p95(ms)', 'errors', 'samples', 'since')]
+    for s in stats:
+        rows.append((
+            s.name, format_ms(s.ewma), format_ms(s.p50), format_ms(s.p95),
+            '{:.0%}'.format(s.error_rate), str(s.samples), format_time(s.first_at),
+        ))
+    return format_table(rows)
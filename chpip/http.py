@@ -0,0 +1,27 @@
+from chpip.trace import trace_response
+
+DEFAULT_POOL_SIZE = 10
+
+
+def new_session(pool_size=DEFAULT_POOL_SIZE, retries=0, backoff_factor=0):
+    import requests
+    from chpip.transport import TimedAdapter
+
+    session = requests.Session()
+    max_retries = 0
+    if retries:
+        from urllib3.util.retry import Retry
+
+        # Retry connection errors and 5xx answers, but hand the last answer
+        # back instead of raising so that callers can fall back gracefully.
+        max_retries = Retry(total=retries, backoff_factor=backoff_factor,
+                            status_forcelist=(500, 502, 503, 504), raise_on_status=False)
+    adapter = TimedAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=max_retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.hooks['response'].append(trace_response)
+    return session
+
+
+def project_url(index_url, project):
+    return '{}/{}/'.format(index_url.rstrip('/'), project)
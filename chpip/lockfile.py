@@ -0,0 +1,144 @@
+import re
+from collections import OrderedDict, namedtuple
+
+from chpip import exception
+from chpip.utils import atomic_open
+
+DEFAULT_CHECK_WORKERS = 16
+DEFAULT_CHECK_TIMEOUT = 10.0
+SIMPLE_SUFFIX = '/simple'
+PACKAGES_DIRNAME = 'packages/'
+PYPI_URL = 'https://pypi.org/simple'
+# PyPI serves the files of its index from another host.
+PYPI_FILES_URL = 'https://files.pythonhosted.org/'
+# Characters that cannot continue a URL embedded in a requirements line.
+URL_END = br'''[\s'"#;,]'''
+
+RewriteResult = namedtuple('RewriteResult', ['path', 'lines', 'rewritten_lines', 'rewritten_urls', 'checked_urls'])
+
+
+def index_root(index_url):
+    """Return the URL prefix under which ``index_url`` serves its files or None if it cannot be told.
+
+    Mirrors keep the PyPI layout, so the files of ``.../simple`` live under
+    ``.../packages/``.
+    """
+    index_url = index_url.rstrip('/')
+    if index_url == PYPI_URL:
+        return PYPI_FILES_URL
+    if index_url.endswith(SIMPLE_SUFFIX):
+        return index_url[:-len(SIMPLE_SUFFIX)] + '/'
+    return None
+
+
+def build_mapping(source_urls, target_url):
+    """Return an ``OrderedDict`` of URL prefixes of ``source_urls`` to those of ``target_url``, as bytes.
+
+    Index URLs map to the target index URL and the ``packages/`` directory
+    holding their files to that of the target, when both are known.
+    """
+    target_url = target_url.rstrip('/')
+    target_root = index_root(target_url)
+    mapping = OrderedDict()
+    for source_url in source_urls:
+        source_url = source_url.rstrip('/')
+        if source_url == target_url:
+            continue
+        mapping[source_url.encode('utf-8')] = target_url.encode('utf-8')
+        source_root = index_root(source_url)
+        if source_root and target_root and source_root != target_root:
+            source_packages, target_packages = source_root + PACKAGES_DIRNAME, target_root + PACKAGES_DIRNAME
+            mapping[source_packages.encode('utf-8')] = target_packages.encode('utf-8')
+    return mapping
+
+
+class Rewriter(object):
+    """Replace the URL prefixes of ``mapping`` in lines of bytes with a single regular expression."""
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+        # Longest first so that a prefix never shadows a longer one starting with it.
+        prefixes = sorted(mapping, key=len, reverse=True)
+        self._pattern = re.compile(b'|'.join(
+            re.escape(prefix) + (b'' if prefix.endswith(b'/') else br'(?=/|' + URL_END + b'|$)')
+            for prefix in prefixes)) if prefixes else None
+        targets = sorted(set(mapping.values()), key=len, reverse=True)
+        self._target_pattern = re.compile(b'(?:' + b'|'.join(re.escape(t) for t in targets) + b')[^' +
+                                          URL_END[1:-1] + b']*') if targets else None
+
+    def rewrite(self, line):
+        """Return ``line`` rewritten and the number of URLs replaced in it."""
+        if self._pattern is None:
+            return line, 0
+        return self._pattern.subn(lambda match: self.mapping[match.group(0)], line)
+
+    def target_urls(self, line):
+        """Return the URLs of ``line`` pointing at a target of the mapping."""
+        if self._target_pattern is None:
+            return []
+        return [url.decode('utf-8', 'replace') for url in self._target_pattern.findall(line)]
+
+
+def check_urls(urls, workers=DEFAULT_CHECK_WORKERS, timeout=DEFAULT_CHECK_TIMEOUT):
+    """Send a HEAD request to every URL concurrently and return ``(url, reason)`` for those failing."""
+    from multiprocessing.pool import ThreadPool
+
+    import requests
+    from chpip.http import new_session
+
+    session = new_session(pool_size=workers)
+
+    def check(url):
+        # Index URLs are checked through their root page.
+        target = url if '/' + PACKAGES_DIRNAME in url else url.rstrip('/') + '/'
+        try:
+            resp = session.head(target, timeout=timeout, allow_redirects=True)
+        except requests.RequestException as e:
+            return url, str(e)
+        return url, None if resp.status_code < 400 else 'HTTP {}'.format(resp.status_code)
+
+    if not urls:
+        return []
+    pool = ThreadPool(min(len(urls), workers))
+    try:
+        return [(url, reason) for url, reason in pool.map(check, urls) if reason]
+    finally:
+        pool.close()
+        pool.join()
+        session.close()
+
+
+def rewrite_file(path, mapping, output=None, check=False, workers=DEFAULT_CHECK_WORKERS,
+                 timeout=DEFAULT_CHECK_TIMEOUT):
+    """Rewrite the URL prefixes of ``mapping`` in the file ``path`` into ``output``, by default in place.
+
+    The file is streamed line by line as bytes, so memory does not grow with
+    its size and its encoding and line endings are kept. ``output`` is
+    replaced atomically. With ``check``, every rewritten URL is resolved
+    with a HEAD request first and nothing is replaced if any of them fails.
+    """
+    rewriter = Rewriter(mapping)
+    lines = rewritten_lines = rewritten_urls = 0
+    urls = OrderedDict()
+    try:
+        source = open(path, 'rb')
+    except (IOError, OSError) as e:
+        raise exception.InvalidLockFile(path=path, reason=e.strerror or e)
+    with source, atomic_open(output or path, 'wb') as f:
+        for line in source:
+            lines += 1
+            line, count = rewriter.rewrite(line)
+            if count:
+                rewritten_lines += 1
+                rewritten_urls += count
+                if check:
+                    for url in rewriter.target_urls(line):
+                        urls[url.split('#', 1)[0]] = None
+            f.write(line)
+        if check:
+            failures = check_urls(list(urls), workers=workers, timeout=timeout)
+            if failures:
+                # Raising discards the rewritten copy.
+                raise exception.UnresolvedURLs(count=len(failures), path=output or path, details='\n'.join(
+                    '  {} ({})'.format(url, reason) for url, reason in failures[:10]))
+    return RewriteResult(path, lines, rewritten_lines, rewritten_urls, len(urls))
@@ -0,0 +1,117 @@
+import json
+import re
+import socket
+from collections import namedtuple
+
+try:
+    from http.client import HTTPException
+except ImportError:
+    from httplib import HTTPException
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+from urllib3.exceptions import HTTPError
+
+from chpip.bench import DEFAULT_PROJECT, format_table
+from chpip.http import project_url
+from chpip.transport import (FAMILIES, TimedHTTPConnection, TimedHTTPSConnection, create_resuming_context,
+                             resolver as default_resolver)
+from chpip.utils import timer
+
+DEFAULT_TIMEOUT = 10.0
+# Such as ``<...HTTPConnection object at 0x...>: `` or ``HTTPConnection(host='...', port=443): ``.
+CONNECTION_PREFIX_RE = re.compile(r'^(<[^>]*>|\w+\([^)]*\)): ')
+PHASES = ('dns_ms', 'connect_ms', 'tls_ms', 'ttfb_ms')
+
+ProbeResult = namedtuple('ProbeResult', ['family', 'run', 'address'] + list(PHASES) +
+                         ['total_ms', 'status', 'reused', 'tls_resumed', 'error'])
+
+
+def _describe(error):
+    # urllib3 prefixes its connection errors with the repr of the connection.
+    return CONNECTION_PREFIX_RE.sub('', str(error))
+
+
+def probe_index(index_url, families=tuple(FAMILIES), project=DEFAULT_PROJECT, timeout=DEFAULT_TIMEOUT,
+                cafile=None, resolver=default_resolver):
+    """Time the phases of requests for the page of ``project`` on ``index_url`` over each address family.
+
+    Each family gets three runs: ``cold`` looks the host up afresh and opens
+    a new connection, ``keep-alive`` sends a second request on it and
+    ``resumed`` opens another connection with the cached addresses and the
+    TLS session of the first one. Proxies are not used, so that the direct
+    path to the index is measured.
+    """
+    url = urlparse(project_url(index_url, project))
+    https = url.scheme == 'https'
+    port = url.port or (443 if https else 80)
+    path = url.path + ('?' + url.query if url.query else '')
+    results = []
+
+    for family in families:
+        context = create_resuming_context(cafile) if https else None
+        # The cold run must see the resolver, later ones its cache.
+        resolver.forget(url.hostname)
+
+        def connect():
+            if https:
+                conn = TimedHTTPSConnection(url.hostname, port, timeout=timeout, ssl_context=context)
+            else:
+                conn = TimedHTTPConnection(url.hostname, port, timeout=timeout)
+            conn.family = FAMILIES[family]
+            conn.resolver = resolver
+            return conn
+
+        def request(conn, run):
+            start = timer()
+            try:
+                conn.request('GET', path, headers={'Accept': 'text/html', 'User-Agent': 'chpip'})
+                resp = conn.getresponse()
+                resp.read()
+            except (socket.error, HTTPError, HTTPException) as e:
+                return ProbeResult(family, run, None, None, None, None, None, None, None, None, None, _describe(e))
+            total_ms = round((timer() - start) * 1000, 3)
+            timings = resp.chpip_timings
+            return ProbeResult(family, run, conn.sock.getpeername()[0] if conn.sock else timings.get('address'),
+                               *[timings.get(phase) for phase in PHASES],
+                               total_ms=total_ms, status=resp.status, reused=timings['reused'],
+                               tls_resumed=timings.get('tls_resumed'),
+                               error=None if resp.status < 400 else 'HTTP {}'.format(resp.status))
+
+        conn = connect()
+        try:
+            cold = request(conn, 'cold')
+            results.append(cold)
+            if cold.status is None:
+                continue
+            results.append(request(conn, 'keep-alive'))
+        finally:
+            conn.close()
+        conn = connect()
+        try:
+            results.append(request(conn, 'resumed'))
+        finally:
+            conn.close()
+    return results
+
+
+def format_probe(results, as_json=False):
+    if as_json:
+        return json.dumps([r._asdict() for r in results], indent=2)
+
+    def ms(value):
+        return '-' if value is None else '{:.1f}'.format(value)
+
+    rows = [('family', 'run', 'address', 'dns', 'connect', 'tls', 'ttfb', 'total', 'result')]
+    for r in results:
+        result = r.error or 'HTTP {}'.format(r.status)
+        if r.tls_resumed:
+            result += ', TLS resumed'
+        if r.run == 'keep-alive' and r.reused is False:
+            result += ', reconnected'
+        rows.append((r.family, r.run, r.address or '-', ms(r.dns_ms), ms(r.connect_ms), ms(r.tls_ms), ms(r.ttfb_ms),
+                     ms(r.total_ms), result))
+    return format_table(rows) + '\nTimes are in milliseconds.'
@@ -0,0 +1,231 @@
+import json
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+from chpip import trace
+from chpip.bench import format_table
+from chpip.utils import atomic_write, makedirs, safe_filename
+
+MAGIC = b'CHPN'
+VERSION = 1
+DEFAULT_TIMEOUT = 60.0
+MAX_WORKERS = 8
+
+# magic, version, size of the JSON metadata, number of names
+HEADER = struct.Struct('<4sHII')
+OFFSET = struct.Struct('<I')
+
+RefreshResult = namedtuple('RefreshResult', ['name', 'index_url', 'status', 'count', 'error'])
+Availability = namedtuple('Availability', ['project', 'serving', 'missing', 'unknown'])
+
+
+class ProjectIndex(object):
+    """Sorted list of the projects an index serves, stored in a single file.
+
+    The file holds a header, JSON metadata (the index URL and the validators
+    of its root page), ``count + 1`` offsets and the UTF-8 names sorted
+    bytewise. Lookups map the file and binary search the offsets, so they
+    only touch a few pages however many projects the index has.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _read_header(self, buf):
+        if len(buf) < HEADER.size:
+            return None
+        magic, version, metadata_size, count = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or version != VERSION:
+            return None
+        return metadata_size, count
+
+    def metadata(self):
+        """Return the metadata dict or None when there is no valid index file."""
+        try:
+            with open(self.path, 'rb') as f:
+                header = self._read_header(f.read(HEADER.size))
+                if header is None:
+                    return None
+                metadata = json.loads(f.read(header[0]).decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return None
+        metadata['count'] = header[1]
+        return metadata
+
+    def write(self, names, metadata):
+        """Replace the index with the normalized ``names`` and return how many distinct names it holds."""
+        names = sorted(set(name.encode('utf-8') for name in names))
+        offsets = [0]
+        for name in names:
+            offsets.append(offsets[-1] + len(name))
+        metadata = json.dumps(metadata, sort_keys=True).encode('utf-8')
+        makedirs(os.path.dirname(self.path))
+        atomic_write(self.path, b''.join([
+            HEADER.pack(MAGIC, VERSION, len(metadata), len(names)),
+            metadata,
+            struct.pack('<{}I'.format(len(offsets)), *offsets),
+        ] + names), binary=True)
+        return len(names)
+
+    def touch(self):
+        """Mark the index as checked now; its mtime is the time of the last check."""
+        os.utime(self.path, None)
+
+    def contains(self, project, index_url=None):
+        """Tell whether the index lists ``project``.
+
+        Returns None when there is no valid index file or, with
+        ``index_url``, when the file was built for another URL.
+        """
+        from chpip.simple import normalize_name
+
+        key = normalize_name(project).encode('utf-8')
+        try:
+            f = open(self.path, 'rb')
+        except (IOError, OSError):
+            return None
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            f.close()
+            return None
+        try:
+            header = self._read_header(buf)
+            if header is None:
+                return None
+            metadata_size, count = header
+            if index_url is not None:
+                metadata = json.loads(buf[HEADER.size:HEADER.size + metadata_size].decode('utf-8'))
+                if metadata.get('index_url') != index_url:
+                    return None
+            offsets_start = HEADER.size + metadata_size
+            names_start = offsets_start + (count + 1) * OFFSET.size
+            low, high = 0, count
+            while low < high:
+                middle = (low + high) // 2
+                start, end = struct.unpack_from('<II', buf, offsets_start + middle * OFFSET.size)
+                name = buf[names_start + start:names_start + end]
+                if name < key:
+                    low = middle + 1
+                elif name > key:
+                    high = middle
+                else:
+                    return True
+            return False
+        finally:
+            buf.close()
+            f.close()
+
+
+def index_path(dirname, name):
+    return os.path.join(dirname, safe_filename(name) + '.idx')
+
+
+def refresh_index(project_index, index_url, session, timeout=DEFAULT_TIMEOUT):
+    """Download the root page of ``index_url`` into ``project_index`` unless it is unchanged.
+
+    The stored validators make the request conditional, so an unchanged
+    listing costs one round trip. A changed one is streamed and scanned
+    without keeping the page in memory. Returns the status and the number of
+    projects.
+    """
+    from chpip.simple import CHUNK_SIZE, iter_project_names, normalize_name
+
+    metadata = project_index.metadata()
+    if metadata and metadata.get('index_url') != index_url:
+        metadata = None
+    headers = {'Accept': 'text/html'}
+    if metadata and metadata.get('etag'):
+        headers['If-None-Match'] = metadata['etag']
+    if metadata and metadata.get('last_modified'):
+        headers['If-Modified-Since'] = metadata['last_modified']
+
+    resp = session.get(index_url.rstrip('/') + '/', headers=headers, timeout=timeout, stream=True)
+    try:
+        if resp.status_code == 304 and metadata:
+            project_index.touch()
+            return 'unchanged', metadata['count']
+        resp.raise_for_status()
+        if 'json' in resp.headers.get('Content-Type', ''):
+            # Indexes ignoring the Accept header may answer with PEP 691 JSON.
+            names = [normalize_name(p['name']) for p in json.loads(resp.content.decode('utf-8'))['projects']]
+        else:
+            names = iter_project_names(resp.iter_content(CHUNK_SIZE))
+        with trace.span('index_projects', index_url=index_url) as span:
+            count = project_index.write(names, {
+                'index_url': index_url,
+                'etag': resp.headers.get('ETag'),
+                'last_modified': resp.headers.get('Last-Modified'),
+            })
+            span.set(count=count)
+    finally:
+        resp.close()
+    return 'updated', count
+
+
+def refresh_indexes(dirname, indexes, timeout=DEFAULT_TIMEOUT):
+    """Refresh the project index of every ``name -> index_url`` in ``indexes`` concurrently."""
+    from multiprocessing.pool import ThreadPool
+
+    import requests
+    from chpip.http import new_session
+
+    def run(name):
+        session = new_session(pool_size=1)
+        try:
+            status, count = refresh_index(ProjectIndex(index_path(dirname, name)), indexes[name], session,
+                                          timeout=timeout)
+            return RefreshResult(name, indexes[name], status, count, None)
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            return RefreshResult(name, indexes[name], 'error', None, str(e))
+        finally:
+            session.close()
+
+    if not indexes:
+        return []
+    pool = ThreadPool(min(len(indexes), MAX_WORKERS))
+    try:
+        return pool.map(run, list(indexes))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def find_project(dirname, indexes, project):
+    """Return the ``Availability`` of ``project`` on ``indexes`` from the local project indexes only."""
+    from chpip.simple import normalize_name
+
+    serving, missing, unknown = [], [], []
+    for name in indexes:
+        found = ProjectIndex(index_path(dirname, name)).contains(project, index_url=indexes[name])
+        (unknown if found is None else serving if found else missing).append(name)
+    return Availability(normalize_name(project), serving, missing, unknown)
+
+
+def format_refresh(results, as_json=False):
+    if as_json:
+        return json.dumps([r._asdict() for r in results], indent=2)
+
+    rows = [('name', 'status', 'projects', 'index_url')]
+    for r in results:
+        rows.append((r.name, r.error or r.status, '-' if r.count is None else str(r.count), r.index_url))
+    return format_table(rows)
+
+
+def format_availability(availability, as_json=False):
+    if as_json:
+        return json.dumps(availability._asdict(), indent=2)
+
+    lines = []
+    if availability.serving:
+        lines.append('`{}` is served by: {}'.format(availability.project, ', '.join(availability.serving)))
+    else:
+        lines.append('`{}` is not served by any index.'.format(availability.project))
+    if availability.missing and availability.serving:
+        lines.append('Not served by: {}'.format(', '.join(availability.missing)))
+    if availability.unknown:
+        lines.append('No project list for: {} (run `chpip which --refresh`)'.format(
+            ', '.join(availability.unknown)))
+    return '\n'.join(lines)
@@ -0,0 +1,442 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    from html import escape
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import quote, unquote, urlparse
+except ImportError:
+    from cgi import escape
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import quote, unquote
+    from urlparse import urlparse
+
+from chpip import exception
+from chpip.simple import LinkParser, normalize_name, parse_hashes
+from chpip.utils import atomic_write, makedirs, safe_filename
+
+DEFAULT_TIMEOUT = 30
+CHUNK_SIZE = 64 * 1024
+# Connections kept per upstream host, shared by the threads serving pip.
+POOL_SIZE = 32
+
+_replace = getattr(os, 'replace', os.rename)
+_KEY_RE = re.compile(r'^(sha256|url)-[0-9a-f]{64}$')
+# Anchor attributes announcing the core metadata of a file (PEP 658, PEP 714).
+METADATA_ATTRS = ('data-core-metadata', 'data-dist-info-metadata')
+METADATA_SUFFIX = '.metadata'
+
+PAGE_TEMPLATE = '''<!DOCTYPE html>
+<html>
+  <head>
+    <meta name="pypi:repository-version" content="1.0">
+    <title>Links for {name}</title>
+  </head>
+  <body>
+    <h1>Links for {name}</h1>
+{links}
+  </body>
+</html>
+'''
+LINK_TEMPLATE = '    <a href="{href}"{attrs}>{text}</a><br/>'
+
+
+def artifact_key(url, hashes):
+    """Return the store key of a file: its sha256 when known, else a digest of its URL."""
+    if hashes.get('sha256'):
+        return 'sha256-' + hashes['sha256'].lower()
+    return 'url-' + hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+class ArtifactStore(object):
+    """Content-addressed file store with size-based LRU eviction.
+
+    Every hit bumps the mtime of the file, and the least recently used files
+    are removed once the store grows past ``max_size`` bytes.
+    """
+
+    def __init__(self, dirname, max_size):
+        self.dirname = dirname
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._size = None
+
+    def path(self, key):
+        return os.path.join(self.dirname, key.split('-', 1)[1][:2], key)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key, chunks):
+        """Store the data of ``chunks`` under ``key``, verifying sha256 keys."""
+        path = self.path(key)
+        dirname = os.path.dirname(path)
+        makedirs(dirname)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            if key.startswith('sha256-') and digest.hexdigest() != key[len('sha256-'):]:
+                raise exception.ChecksumMismatch(key=key)
+            _replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._size = (self._scan_size() if self._size is None else self._size) + size
+            if self._size > self.max_size:
+                self._evict(keep=path)
+        return path
+
+    def _files(self):
+        for dirpath, _, filenames in os.walk(self.dirname):
+            for filename in filenames:
+                if not filename.endswith('.tmp'):
+                    yield os.path.join(dirpath, filename)
+
+    def _scan_size(self):
+        return sum(os.path.getsize(path) for path in self._files())
+
+    def _evict(self, keep):
+        entries = []
+        for path in self._files():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= self.max_size:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+
+
+class Coalescer(object):
+    """Run one call per key at a time; concurrent callers wait for it instead and share its error."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def run(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'error': None}
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return
+        try:
+            func()
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+
+class CachingProxy(object):
+    """Simple repository API served from ``upstreams``, tried in order.
+
+    Project pages are cached on disk and revalidated after ``page_max_age``
+    seconds; their file links are rewritten to point at the proxy, which
+    downloads each file once into the ``ArtifactStore``.
+    """
+
+    def __init__(self, upstreams, cache_dirname, max_size, page_max_age, timeout=DEFAULT_TIMEOUT):
+        self.upstreams = upstreams
+        self.pages_dirname = os.path.join(cache_dirname, 'pages')
+        self.store = ArtifactStore(os.path.join(cache_dirname, 'files'), max_size=max_size)
+        self.page_max_age = page_max_age
+        self.timeout = timeout
+        self.file_urls = {}
+        self.metadata_keys = {}
+        self._coalescer = Coalescer()
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        # One pooled session for all the threads, so that connections to the
+        # upstreams outlive the pip connections they were opened for.
+        with self._session_lock:
+            if self._session is None:
+                from chpip.http import new_session
+
+                self._session = new_session(pool_size=POOL_SIZE)
+            return self._session
+
+    def close(self):
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _page_path(self, name):
+        return os.path.join(self.pages_dirname, safe_filename(name) + '.json')
+
+    def _load_page(self, name):
+        try:
+            with open(self._page_path(name), 'r') as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        # Pages cached before metadata files were served announce files the proxy cannot serve.
+        return entry if 'metadata' in entry else None
+
+    def _save_page(self, name, entry):
+        makedirs(self.pages_dirname)
+        atomic_write(self._page_path(name), json.dumps(entry))
+
+    def rewrite_page(self, name, base_url, html):
+        """Return the page of ``name`` with file links pointing at the proxy, the files it links and their metadata.
+
+        The metadata maps the key of a file to the key and URL of its core
+        metadata file, which pip requests at the file URL plus ``.metadata``.
+        """
+        parser = LinkParser(base_url)
+        parser.feed(html)
+        parser.close()
+        links = []
+        files = {}
+        metadata = {}
+        for link in parser.links:
+            url, hashes = parse_hashes(link.url)
+            key = artifact_key(url, hashes)
+            filename = unquote(urlparse(url).path.rsplit('/', 1)[-1]) or link.text
+            files[key] = url
+            value = next((link.attrs[attr] for attr in METADATA_ATTRS if link.attrs.get(attr)), None)
+            if value and value != 'false':
+                metadata_url = url + METADATA_SUFFIX
+                _, metadata_hashes = parse_hashes('#' + value)
+                metadata[key] = [artifact_key(metadata_url, metadata_hashes), metadata_url]
+            href = '/files/{}/{}'.format(key, quote(filename))
+            if hashes:
+                algorithm = 'sha256' if 'sha256' in hashes else sorted(hashes)[0]
+                href += '#{}={}'.format(algorithm, hashes[algorithm])
+            attrs = ''.join(
+                ' {}="{}"'.format(attr, escape(value or '', True))
+                for attr, value in sorted(link.attrs.items())
+            )
+            links.append(LINK_TEMPLATE.format(href=escape(href, True), attrs=attrs,
+                                              text=escape(link.text or filename)))
+        page = PAGE_TEMPLATE.format(name=escape(name), links='\n'.join(links))
+        return page, files, metadata
+
+    def _fetch_page(self, name, entry):
+        import requests
+        from chpip.http import project_url
+
+        upstreams = list(self.upstreams)
+        errors = []
+        if entry and entry['upstream'] in upstreams:
+            upstreams.remove(entry['upstream'])
+            upstreams.insert(0, entry['upstream'])
+        for upstream in upstreams:
+            headers = {'Accept': 'text/html'}
+            if entry and entry['upstream'] == upstream:
+                if entry.get('etag'):
+                    headers['If-None-Match'] = entry['etag']
+                if entry.get('last_modified'):
+                    headers['If-Modified-Since'] = entry['last_modified']
+            try:
+                resp = self.session.get(project_url(upstream, name), headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                errors.append(e)
+                continue
+            if resp.status_code == 304 and entry:
+                entry['fetched_at'] = time.time()
+            elif resp.status_code == 200:
+                body, files, metadata = self.rewrite_page(name, resp.url, resp.text)
+                entry = {
+                    'upstream': upstream,
+                    'etag': resp.headers.get('ETag'),
+                    'last_modified': resp.headers.get('Last-Modified'),
+                    'fetched_at': time.time(),
+                    'body': body,
+                    'files': files,
+                    'metadata': metadata,
+                }
+            else:
+                if resp.status_code >= 500:
+                    errors.append('HTTP {} from {}'.format(resp.status_code, upstream))
+                continue
+            self._save_page(name, entry)
+            return
+        if len(errors) == len(upstreams):
+            # No upstream told whether it has the project.
+            raise exception.UpstreamUnavailable(name=name, reason=errors[-1])
+
+    def _get_entry(self, project):
+        name = normalize_name(project)
+        entry = self._load_page(name)
+        if not entry or time.time() - entry['fetched_at'] >= self.page_max_age:
+            try:
+                self._coalescer.run('page:' + name, lambda: self._fetch_page(name, entry))
+            except exception.UpstreamUnavailable:
+                # Fall back to the stale page when every upstream failed.
+                if not entry:
+                    raise
+            entry = self._load_page(name) or entry
+        if entry:
+            self.file_urls.update(entry['files'])
+            for key, (metadata_key, metadata_url) in entry['metadata'].items():
+                self.file_urls[metadata_key] = metadata_url
+                self.metadata_keys[key] = metadata_key
+        return entry
+
+    def get_page(self, project):
+        """Return the rewritten simple page of ``project`` or None if no upstream has it.
+
+        Raises ``UpstreamUnavailable`` when no upstream could be reached and
+        the page is not cached.
+        """
+        entry = self._get_entry(project)
+        return entry['body'] if entry else None
+
+    def get_files(self, project):
+        """Return the store key -> upstream URL of every file of ``project`` or None if no upstream has it.
+
+        Raises ``UpstreamUnavailable`` like ``get_page``.
+        """
+        entry = self._get_entry(project)
+        return entry['files'] if entry else None
+
+    def get_file(self, key):
+        """Return the path of the stored file ``key``, downloading it once if needed.
+
+        Raises KeyError for a file that no served page links to.
+        """
+        path = self.store.get(key)
+        if path:
+            return path
+        url = self.file_urls[key]
+
+        def download():
+            if self.store.get(key):
+                return
+            resp = self.session.get(url, stream=True, timeout=self.timeout)
+            try:
+                resp.raise_for_status()
+                self.store.put(key, resp.iter_content(CHUNK_SIZE))
+            finally:
+                resp.close()
+
+        import requests
+
+        try:
+            self._coalescer.run(key, download)
+        except (requests.RequestException, exception.ChecksumMismatch):
+            return None
+        return self.store.get(key)
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status, body=b'', content_type='text/plain', headers=None):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _send_file(self, path):
+        try:
+            f = open(path, 'rb')
+        except (IOError, OSError):
+            return self._send(502, 'Bad Gateway')
+        with f:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            if self.command != 'HEAD':
+                shutil.copyfileobj(f, self.wfile, CHUNK_SIZE)
+
+    def do_GET(self):
+        proxy = self.server.proxy
+        parts = [part for part in urlparse(self.path).path.split('/') if part]
+        if parts == ['simple']:
+            location = proxy.upstreams[0].rstrip('/') + '/'
+            return self._send(302, headers={'Location': location})
+        if len(parts) == 2 and parts[0] == 'simple':
+            try:
+                page = proxy.get_page(unquote(parts[1]))
+            except exception.UpstreamUnavailable as e:
+                # Unlike a 404, pip reports the failure instead of a missing project.
+                return self._send(502, str(e))
+            if page is None:
+                return self._send(404, 'Not Found')
+            return self._send(200, page, content_type='text/html; charset=utf-8')
+        if len(parts) == 3 and parts[0] == 'files' and _KEY_RE.match(parts[1]):
+            key = parts[1]
+            if parts[2].endswith(METADATA_SUFFIX):
+                key = proxy.metadata_keys.get(key)
+                if key is None:
+                    return self._send(404, 'Not Found')
+            try:
+                path = proxy.get_file(key)
+            except KeyError:
+                return self._send(404, 'Not Found')
+            if path is None:
+                return self._send(502, 'Bad Gateway')
+            return self._send_file(path)
+        self._send(404, 'Not Found')
+
+    do_HEAD = do_GET
+
+
+class ProxyServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, proxy, host, port):
+        HTTPServer.__init__(self, (host, port), ProxyHandler)
+        self.proxy = proxy
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.proxy.close()
+
+    @property
+    def index_url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}/simple'.format(host, port)
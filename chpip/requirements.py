@@ -0,0 +1,176 @@
+import json
+import os
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+from chpip import exception
+
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_PER_HOST = 8
+MAX_WORKERS = 64
+INCLUDE_OPTIONS = ('-r', '--requirement', '-c', '--constraint')
+
+_REQUIREMENT_RE = re.compile(r'^([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:\[[^\]]*\])?\s*(.*)$')
+_PIN_RE = re.compile(r'^===?\s*([^\s,;*]+)\s*(?:;.*)?$')
+_COMMENT_RE = re.compile(r'(^|\s+)#.*$')
+_TRAILING_ZEROS_RE = re.compile(r'(\.0+)+$')
+
+Requirement = namedtuple('Requirement', ['name', 'version'])
+RequirementResult = namedtuple('RequirementResult', ['name', 'index_url', 'missing', 'errors'])
+
+
+def format_requirement(requirement):
+    if requirement.version is None:
+        return requirement.name
+    return '{}=={}'.format(requirement.name, requirement.version)
+
+
+def canonical_version(version):
+    """Return ``version`` in a form where equal versions compare equal, e.g. ``1.0`` and ``1``."""
+    return _TRAILING_ZEROS_RE.sub('', version.strip().lower().lstrip('v'))
+
+
+def _logical_lines(text):
+    line = ''
+    for physical in text.splitlines():
+        if physical.endswith('\\'):
+            line += physical[:-1]
+            continue
+        yield _COMMENT_RE.sub('', line + physical).strip()
+        line = ''
+    if line:
+        yield _COMMENT_RE.sub('', line).strip()
+
+
+def parse_requirements(text, dirname='.', seen=None):
+    """Return the ``Requirement`` of every project named in the requirements file ``text``.
+
+    Only ``==`` pins count as versions; other specifiers just require the
+    project. Nested ``-r``/``-c`` files are read relative to ``dirname``,
+    while editables, URLs, paths and other options are skipped.
+    """
+    from chpip.simple import normalize_name
+
+    seen = set() if seen is None else seen
+    requirements = []
+    for line in _logical_lines(text):
+        if not line:
+            continue
+        if line.startswith('-'):
+            option, _, value = line.replace('=', ' ', 1).partition(' ')
+            if option in INCLUDE_OPTIONS and value.strip():
+                requirements.extend(read_requirements(os.path.join(dirname, value.strip()), seen=seen))
+            continue
+        if '://' in line or line.startswith(('.', '/')):
+            continue
+        match = _REQUIREMENT_RE.match(line)
+        if not match:
+            continue
+        # Per-requirement options such as --hash follow the specifier.
+        specifier = match.group(2).split(' --', 1)[0].strip()
+        pin = _PIN_RE.match(specifier)
+        requirements.append(Requirement(normalize_name(match.group(1)), pin.group(1) if pin else None))
+    return requirements
+
+
+def parse_pipfile_lock(text):
+    """Return the pinned ``Requirement`` of every package of a ``Pipfile.lock``."""
+    from chpip.simple import normalize_name
+
+    data = json.loads(text, object_pairs_hook=OrderedDict)
+    requirements = []
+    for section in ('default', 'develop'):
+        for name, package in (data.get(section) or {}).items():
+            pin = _PIN_RE.match(package.get('version') or '')
+            requirements.append(Requirement(normalize_name(name), pin.group(1) if pin else None))
+    return requirements
+
+
+def read_requirements(path, seen=None):
+    """Read a requirements file, such as the output of ``pip-compile``, or a ``Pipfile.lock``."""
+    path = os.path.abspath(os.path.expanduser(path))
+    seen = set() if seen is None else seen
+    if path in seen:
+        return []
+    seen.add(path)
+    try:
+        with open(path, 'r') as f:
+            text = f.read()
+    except (IOError, OSError) as e:
+        raise exception.InvalidRequirements(path=path, reason=e.strerror or e)
+    if path.endswith('.lock') and text.lstrip().startswith('{'):
+        try:
+            return parse_pipfile_lock(text)
+        except (ValueError, AttributeError) as e:
+            raise exception.InvalidRequirements(path=path, reason=e)
+    return parse_requirements(text, dirname=os.path.dirname(path), seen=seen)
+
+
+def check_requirements(indexes, requirements, per_host=DEFAULT_PER_HOST, timeout=DEFAULT_TIMEOUT):
+    """Check which of ``requirements`` every ``name -> index_url`` in ``indexes`` serves.
+
+    Each project is fetched once per index, all indexes at the same time.
+    At most ``per_host`` requests run against one host at once, over a
+    session per index whose connections are reused. Returns a
+    ``RequirementResult`` per index listing the missing requirements and the
+    projects that could not be fetched.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    import requests
+    from chpip.http import new_session
+    from chpip.simple import fetch_project, parse_version
+
+    projects = OrderedDict()
+    for requirement in requirements:
+        projects.setdefault(requirement.name, []).append(requirement)
+    hosts = {}
+    limits = dict((name, hosts.setdefault(urlparse(indexes[name]).netloc, threading.BoundedSemaphore(per_host)))
+                  for name in indexes)
+    sessions = dict((name, new_session(pool_size=per_host)) for name in indexes)
+
+    def check(job):
+        name, project = job
+        with limits[name]:
+            try:
+                found = fetch_project(sessions[name], indexes[name], project, timeout=timeout)
+            except (requests.RequestException, ValueError):
+                return job, None
+        if found is None:
+            return job, set()
+        return job, set(canonical_version(version) for version in
+                        (parse_version(f.filename) for f in found.files) if version)
+
+    # Interleave the indexes so that every host gets work from the start.
+    jobs = [(name, project) for project in projects for name in indexes]
+    if not jobs:
+        return [RequirementResult(name, indexes[name], [], []) for name in indexes]
+    pool = ThreadPool(min(len(jobs), per_host * len(hosts), MAX_WORKERS))
+    try:
+        versions = dict(pool.map(check, jobs))
+    finally:
+        pool.close()
+        pool.join()
+        for session in sessions.values():
+            session.close()
+
+    results = []
+    for name in indexes:
+        missing, errors = [], []
+        for project in projects:
+            found = versions[(name, project)]
+            if found is None:
+                errors.append(project)
+                continue
+            for requirement in projects[project]:
+                if not found or (requirement.version is not None and
+                                 canonical_version(requirement.version) not in found):
+                    missing.append(format_requirement(requirement))
+        results.append(RequirementResult(name, indexes[name], missing, errors))
+    return results
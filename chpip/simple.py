@@ -0,0 +1,147 @@
+import codecs
+import json
+import re
+from collections import namedtuple
+
+try:
+    from html.parser import HTMLParser
+    from urllib.parse import urljoin, urldefrag
+except ImportError:
+    from HTMLParser import HTMLParser
+    from urlparse import urljoin, urldefrag
+
+from chpip.http import project_url
+
+PEP691_CONTENT_TYPE = 'application/vnd.pypi.simple.v1+json'
+ACCEPT = '{}, application/vnd.pypi.simple.v1+html;q=0.2, text/html;q=0.01'.format(PEP691_CONTENT_TYPE)
+SERIAL_HEADER = 'X-PyPI-Last-Serial'
+CHUNK_SIZE = 64 * 1024
+SDIST_EXTENSIONS = ('.tar.gz', '.tar.bz2', '.tar.xz', '.tgz', '.zip')
+
+_NORMALIZE_RE = re.compile(r'[-_.]+')
+# Anchors of the root page hold nothing but the project name.
+_ROOT_ANCHOR_RE = re.compile(br'<a\b[^>]*>([^<]*)</a\s*>', re.IGNORECASE)
+
+Link = namedtuple('Link', ['url', 'text', 'attrs'])
+File = namedtuple('File', ['filename', 'url', 'hashes'])
+Project = namedtuple('Project', ['name', 'files', 'serial'])
+
+
+def normalize_name(name):
+    """Normalize a project name as defined by PEP 503."""
+    return _NORMALIZE_RE.sub('-', name).lower()
+
+
+def parse_version(filename):
+    """Return the version part of a wheel, egg or sdist file name or None."""
+    if filename.endswith(('.whl', '.egg')):
+        parts = filename.split('-')
+        return parts[1] if len(parts) > 2 else None
+    for extension in SDIST_EXTENSIONS:
+        if filename.endswith(extension):
+            stem = filename[:-len(extension)]
+            return stem.rsplit('-', 1)[1] if '-' in stem else None
+    return None
+
+
+def parse_hashes(url):
+    """Split the ``#<algorithm>=<digest>`` fragment off a file URL."""
+    url, fragment = urldefrag(url)
+    hashes = {}
+    if '=' in fragment:
+        algorithm, digest = fragment.split('=', 1)
+        hashes[algorithm] = digest
+    return url, hashes
+
+
+class LinkParser(HTMLParser):
+    """Incremental parser collecting the anchors of a simple repository page.
+
+    Data can be fed in chunks as it arrives; only the ``Link`` of every
+    anchor is kept, no document tree is built.
+    """
+
+    def __init__(self, base_url):
+        HTMLParser.__init__(self)
+        self.base_url = base_url
+        self.links = []
+        self._href = None
+        self._attrs = None
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'base':
+            href = dict(attrs).get('href')
+            if href:
+                self.base_url = urljoin(self.base_url, href)
+        elif tag == 'a':
+            self._attrs = dict(attrs)
+            self._href = self._attrs.pop('href', None)
+            self._text = []
+
+    def handle_data(self, data):
+        if self._href is not None:
+            self._text.append(data)
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self._href is not None:
+            self.links.append(Link(urljoin(self.base_url, self._href), ''.join(self._text).strip(), self._attrs))
+            self._href = None
+
+
+def iter_project_names(chunks):
+    """Yield the normalized project names of a simple repository root page arriving in ``chunks`` of bytes.
+
+    The root page of a large index has hundreds of thousands of anchors, so
+    it is scanned with a regular expression, which is much faster than
+    ``LinkParser``, and only the unfinished tail of a chunk is kept.
+    """
+    buf = b''
+    for chunk in chunks:
+        buf += chunk
+        end = 0
+        for match in _ROOT_ANCHOR_RE.finditer(buf):
+            yield normalize_name(match.group(1).strip().decode('utf-8', 'replace'))
+            end = match.end()
+        # An anchor can only start at the last `<a` or in the next chunk.
+        start = max(buf.rfind(b'<a', end), buf.rfind(b'<A', end))
+        buf = buf[start:] if start != -1 else buf[-1:]
+
+
+def fetch_project(session, index_url, project, timeout=None):
+    """Fetch the file list of ``project`` from ``index_url``.
+
+    The PEP 691 JSON form is requested and the HTML form is parsed
+    incrementally when the index does not support it. Returns None when the
+    index does not have the project.
+    """
+    url = project_url(index_url, normalize_name(project))
+    resp = session.get(url, headers={'Accept': ACCEPT}, timeout=timeout, stream=True)
+    try:
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        serial = resp.headers.get(SERIAL_HEADER)
+        content_type = resp.headers.get('Content-Type', '')
+        if content_type.startswith(PEP691_CONTENT_TYPE):
+            data = json.loads(resp.content.decode('utf-8'))
+            files = []
+            for f in data.get('files', []):
+                file_url, hashes = parse_hashes(urljoin(resp.url, f['url']))
+                hashes.update(f.get('hashes') or {})
+                files.append(File(f['filename'], file_url, hashes))
+            serial = serial or data.get('meta', {}).get('_last-serial')
+        else:
+            parser = LinkParser(resp.url)
+            decoder = codecs.getincrementaldecoder(resp.encoding or 'utf-8')('replace')
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                parser.feed(decoder.decode(chunk))
+            parser.feed(decoder.decode(b'', final=True))
+            parser.close()
+            files = []
+            for link in parser.links:
+                file_url, hashes = parse_hashes(link.url)
+                files.append(File(link.text or file_url.rsplit('/', 1)[-1], file_url, hashes))
+    finally:
+        resp.close()
+    return Project(project, files, int(serial) if serial is not None else None)
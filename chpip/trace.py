@@ -0,0 +1,190 @@
+"""Timing spans of chpip operations, delivered to registered hooks.
+
+Nothing is measured while no hook is registered: ``span()`` then returns a
+shared no-op span, so instrumented code costs one function call.
+"""
+import functools
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+TRACE_ENV = 'CHPIP_TRACE'
+
+# chpip.utils records its own spans, so its timer cannot be imported here.
+timer = getattr(time, 'perf_counter', time.time)
+
+_hooks = []
+_ids = itertools.count(1)
+_local = threading.local()
+
+
+def add_hook(hook):
+    """Call ``hook`` with the dict of every finished span."""
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def enabled():
+    return bool(_hooks)
+
+
+class Span(object):
+    """A timed phase; ``set()`` adds attributes such as byte counts before it finishes."""
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.id = next(_ids)
+        # Spans started in worker threads pass the id of their parent.
+        self.parent_id = attrs.pop('parent_id', None) or _current_id()
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self.started_at = time.time()
+        self._start = timer()
+        stack.append(self)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self, error=None):
+        duration = timer() - self._start
+        stack = _local.stack
+        if self in stack:
+            stack.remove(self)
+        data = {
+            'name': self.name,
+            'id': self.id,
+            'parent_id': self.parent_id,
+            'started_at': self.started_at,
+            'duration_ms': duration * 1000,
+        }
+        if error is not None:
+            data['error'] = type(error).__name__
+        data.update(self.attrs)
+        emit(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.finish(exc_value)
+
+
+class _NullSpan(object):
+    def set(self, **attrs):
+        pass
+
+    def finish(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+def current_id():
+    """Return the id of the innermost span of this thread, to pass as ``parent_id`` to other threads."""
+    return _current_id()
+
+
+def span(name, **attrs):
+    """Start a span, usually as a context manager; nested spans record their parent."""
+    if not _hooks:
+        return NULL_SPAN
+    return Span(name, attrs)
+
+
+def _current_id():
+    stack = getattr(_local, 'stack', None)
+    return stack[-1].id if stack else None
+
+
+def record(name, duration, **attrs):
+    """Emit a span called ``name`` that took ``duration`` seconds and just finished."""
+    if not _hooks:
+        return
+    data = {
+        'name': name,
+        'id': next(_ids),
+        'parent_id': _current_id(),
+        'started_at': time.time() - duration,
+        'duration_ms': duration * 1000,
+    }
+    data.update(attrs)
+    emit(data)
+
+
+def emit(data):
+    """Deliver the span ``data`` to the hooks; a failing hook never breaks the traced operation."""
+    for hook in list(_hooks):
+        try:
+            hook(data)
+        except Exception:
+            pass
+
+
+def traced(name):
+    """Decorate a function so that every call is a span called ``name``."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _hooks:
+                return func(*args, **kwargs)
+            with Span(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_response(resp, *args, **kwargs):
+    """requests response hook recording an ``http`` span ending when the headers arrived.
+
+    Responses of the timed transport add the phases of their connection.
+    """
+    if not _hooks:
+        return
+    content_length = resp.headers.get('Content-Length')
+    attrs = getattr(resp.raw, 'chpip_timings', None) or {}
+    record('http', resp.elapsed.total_seconds(), method=resp.request.method, url=resp.url,
+           status=resp.status_code, bytes=int(content_length) if content_length else None,
+           redirects=len(resp.history), **attrs)
+
+
+class JsonLinesHook(object):
+    """Hook writing every span as a line of JSON to ``stream``."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def __call__(self, data):
+        line = json.dumps(data, sort_keys=True) + '\n'
+        with self._lock:
+            self.stream.write(line)
+            self.stream.flush()
+
+
+def hook_from_env(value=None):
+    """Return the ``JsonLinesHook`` asked for by ``CHPIP_TRACE`` or None.
+
+    ``1`` or ``stderr`` writes to stderr, any other value is a file to
+    append to.
+    """
+    value = os.getenv(TRACE_ENV) if value is None else value
+    if not value or value == '0':
+        return None
+    if value in ('1', 'stderr'):
+        return JsonLinesHook(sys.stderr)
+    return JsonLinesHook(open(os.path.expanduser(value), 'a'))
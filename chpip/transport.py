@@ -0,0 +1,205 @@
+"""An instrumented urllib3 transport timing DNS, TCP connect, TLS handshake and time to first byte.
+
+Every session of ``chpip.http.new_session`` sends its requests through it,
+so traced HTTP spans carry the phases of the connection that served them.
+Lookups go through a small resolver cache, so that repeated requests and
+probes measure the servers rather than the resolver.
+"""
+import os
+import socket
+import ssl
+import threading
+import time
+from collections import OrderedDict
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+from chpip.utils import timer
+
+DEFAULT_DNS_TTL = 60
+DEFAULT_DNS_CACHE_SIZE = 256
+FAMILIES = OrderedDict([('ipv4', socket.AF_INET), ('ipv6', socket.AF_INET6)])
+# Offering a previous TLS session when connecting needs Python 3.6+.
+SESSION_RESUMPTION = hasattr(ssl, 'PROTOCOL_TLS_CLIENT') and hasattr(ssl, 'SSLSession')
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+class Resolver(object):
+    """Cache ``getaddrinfo`` answers for ``ttl`` seconds, keeping at most ``size`` of them."""
+
+    def __init__(self, ttl=DEFAULT_DNS_TTL, size=DEFAULT_DNS_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port, family=socket.AF_UNSPEC):
+        """Return the addresses of ``host`` and whether they came from the cache."""
+        key = (host, port, family)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                return entry[1], True
+        infos = socket.getaddrinfo(host, port, family, socket.SOCK_STREAM)
+        addresses = list(OrderedDict((info[4][0], None) for info in infos))
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (now + self.ttl, addresses)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return addresses, False
+
+    def forget(self, host=None):
+        """Drop the cached answers for ``host``, or all of them."""
+        with self._lock:
+            for key in list(self._entries):
+                if host is None or key[0] == host:
+                    del self._entries[key]
+
+
+resolver = Resolver()
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """An ``SSLContext`` offering the last TLS session of a server when connecting to it again."""
+
+    def __new__(cls, protocol=None, *args, **kwargs):
+        return super(ResumingSSLContext, cls).__new__(cls, protocol or ssl.PROTOCOL_TLS_CLIENT)
+
+    def __init__(self, *args, **kwargs):
+        super(ResumingSSLContext, self).__init__()
+        self.sessions = {}
+
+    def wrap_socket(self, sock, *args, **kwargs):
+        if kwargs.get('session') is None:
+            kwargs['session'] = self.sessions.get((kwargs.get('server_hostname'), sock.getpeername()[1]))
+        return super(ResumingSSLContext, self).wrap_socket(sock, *args, **kwargs)
+
+    def remember(self, sock, server_hostname, port):
+        # TLS 1.3 tickets arrive after the handshake, so this is called once a response was read.
+        session = getattr(sock, 'session', None)
+        if session is not None:
+            self.sessions[(server_hostname, port)] = session
+
+
+def create_resuming_context(cafile=None):
+    """Return a verifying ``ResumingSSLContext`` trusting ``cafile``, by default the CA bundle of requests.
+
+    Without session resumption, a plain verifying ``SSLContext`` is returned.
+    """
+    if cafile is None:
+        from requests.utils import DEFAULT_CA_BUNDLE_PATH
+
+        cafile = os.getenv('REQUESTS_CA_BUNDLE') or os.getenv('CURL_CA_BUNDLE') or DEFAULT_CA_BUNDLE_PATH
+    if not SESSION_RESUMPTION:
+        return ssl.create_default_context(cafile=cafile)
+    context = ResumingSSLContext()
+    context.load_verify_locations(cafile)
+    return context
+
+
+class TimedConnectionMixin(object):
+    """Record the phases of a connection in ``timings`` and attach them to its responses.
+
+    ``family`` restricts the addresses connected to, ``AF_UNSPEC`` by default.
+    Responses after the first one of a connection only carry their time to
+    first byte and ``reused``.
+    """
+    resolver = resolver
+    family = socket.AF_UNSPEC
+
+    def _new_conn(self):
+        host = self._dns_host
+        self.timings = timings = OrderedDict()
+        start = timer()
+        try:
+            addresses, timings['dns_cached'] = self.resolver.resolve(host, self.port, self.family)
+        except socket.gaierror as e:
+            raise NewConnectionError(self, 'Failed to resolve {}: {}'.format(host, e))
+        timings['dns_ms'] = _ms(timer() - start)
+        start = timer()
+        # The parent connects to ``_dns_host``, which is pointed at each address in turn.
+        try:
+            for i, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    sock = super(TimedConnectionMixin, self)._new_conn()
+                except (ConnectTimeoutError, NewConnectionError):
+                    if i == len(addresses) - 1:
+                        raise
+                else:
+                    timings['address'] = address
+                    timings['connect_ms'] = _ms(timer() - start)
+                    return sock
+            raise NewConnectionError(self, 'No address found for {}'.format(host))
+        finally:
+            self._dns_host = host
+
+    def getresponse(self, *args, **kwargs):
+        start = timer()
+        response = super(TimedConnectionMixin, self).getresponse(*args, **kwargs)
+        timings = getattr(self, 'timings', None)
+        reused = timings is None
+        timings = OrderedDict() if reused else timings
+        timings['ttfb_ms'] = _ms(timer() - start)
+        timings['reused'] = reused
+        # Later responses of this connection reuse it.
+        self.timings = None
+        response.chpip_timings = timings
+        self._remember_session()
+        return response
+
+    def close(self):
+        # Responses closing the connection close it before ``getresponse`` returns.
+        self._remember_session()
+        super(TimedConnectionMixin, self).close()
+
+    def _remember_session(self):
+        context = getattr(self, 'ssl_context', None)
+        if isinstance(context, ResumingSSLContext) and self.sock is not None:
+            context.remember(self.sock, self.host, self.port)
+
+
+class TimedHTTPConnection(TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(TimedConnectionMixin, HTTPSConnection):
+    def connect(self):
+        start = timer()
+        super(TimedHTTPSConnection, self).connect()
+        timings = self.timings
+        timings['tls_ms'] = _ms(timer() - start - (timings['dns_ms'] + timings['connect_ms']) / 1000.0)
+        timings['tls_version'] = self.sock.version() if hasattr(self.sock, 'version') else None
+        timings['tls_resumed'] = getattr(self.sock, 'session_reused', None)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+POOL_CLASSES = {'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+
+
+class TimedAdapter(HTTPAdapter):
+    """A requests adapter whose connections are timed connections."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(TimedAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = POOL_CLASSES
+
+    def proxy_manager_for(self, *args, **kwargs):
+        manager = super(TimedAdapter, self).proxy_manager_for(*args, **kwargs)
+        manager.pool_classes_by_scheme = POOL_CLASSES
+        return manager
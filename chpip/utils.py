@@ -1,31 +1,219 @@
-import yaml
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import time
 from collections import OrderedDict
+from contextlib import contextmanager
 
+from chpip import trace
 
-def ordered_load(stream, Loader=yaml.SafeLoader, object_pairs_hook=OrderedDict):
-    class OrderedLoader(Loader):
-        pass
+try:
+    from shlex import quote as shell_quote
+except ImportError:
+    from pipes import quote as shell_quote
 
-    def construct_mapping(loader, node):
-        loader.flatten_mapping(node)
-        return object_pairs_hook(loader.construct_pairs(node))
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
 
-    OrderedLoader.add_constructor(
-        yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,
-        construct_mapping
-    )
-    return yaml.load(stream, OrderedLoader)
+timer = getattr(time, 'perf_counter', time.time)
 
+DEFAULT_FILE_MODE = 0o644
+# Windows refuses to replace a file while another process has it open, as
+# readers do for a moment; the replacement is retried after these delays.
+REPLACE_RETRY_DELAYS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+# ERROR_ACCESS_DENIED and ERROR_SHARING_VIOLATION.
+_SHARING_ERRORS = (5, 32)
 
-def ordered_dump(data, stream=None, Dumper=yaml.SafeDumper, **kwds):
-    class OrderedDumper(Dumper):
-        pass
+_UNSAFE_FILENAME_RE = re.compile(r'[^A-Za-z0-9._-]')
 
-    def dict_representer(dumper, data):
-        return dumper.represent_mapping(
+_ordered_loaders = {}
+_ordered_dumpers = {}
+
+
+def _get_ordered_loader(Loader, object_pairs_hook):
+    import yaml
+
+    key = (Loader, object_pairs_hook)
+    if key not in _ordered_loaders:
+        class OrderedLoader(Loader):
+            pass
+
+        def construct_mapping(loader, node):
+            loader.flatten_mapping(node)
+            return object_pairs_hook(loader.construct_pairs(node))
+
+        OrderedLoader.add_constructor(
             yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,
-            data.items()
+            construct_mapping
         )
+        _ordered_loaders[key] = OrderedLoader
+    return _ordered_loaders[key]
+
+
+def _get_ordered_dumper(Dumper):
+    import yaml
+
+    if Dumper not in _ordered_dumpers:
+        class OrderedDumper(Dumper):
+            pass
+
+        def dict_representer(dumper, data):
+            return dumper.represent_mapping(
+                yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,
+                data.items()
+            )
+
+        OrderedDumper.add_representer(OrderedDict, dict_representer)
+        _ordered_dumpers[Dumper] = OrderedDumper
+    return _ordered_dumpers[Dumper]
+
+
+def ordered_load(stream, Loader=None, object_pairs_hook=OrderedDict):
+    import yaml
+
+    if Loader is None:
+        Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    return yaml.load(stream, _get_ordered_loader(Loader, object_pairs_hook))
+
+
+def ordered_dump(data, stream=None, Dumper=None, **kwds):
+    import yaml
+
+    if Dumper is None:
+        Dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+    return yaml.dump(data, stream, _get_ordered_dumper(Dumper), **kwds)
+
+
+class YamlStateFormat(object):
+    extension = '.yml'
+
+    def loads(self, text):
+        return ordered_load(text) or {}
+
+    def dumps(self, data):
+        return ordered_dump(data)
+
+
+class JsonStateFormat(object):
+    extension = '.json'
+
+    def loads(self, text):
+        if not text.strip():
+            return {}
+        return json.loads(text, object_pairs_hook=OrderedDict)
+
+    def dumps(self, data):
+        return json.dumps(data, separators=(',', ':'))
+
+
+STATE_FORMATS = OrderedDict([
+    ('yaml', YamlStateFormat()),
+    ('json', JsonStateFormat()),
+])
+
+
+def safe_filename(name):
+    """Escape ``name`` so that it can be used as a file name on every platform."""
+    return _UNSAFE_FILENAME_RE.sub(lambda m: '%{:02X}'.format(ord(m.group(0))), name)
+
+
+def makedirs(dirname):
+    """Create ``dirname`` and its parents unless it exists, tolerating concurrent creation."""
+    try:
+        os.makedirs(dirname)
+    except OSError:
+        if not os.path.isdir(dirname):
+            raise
+
+
+if os.name == 'nt':
+    import ctypes
+
+    _MOVEFILE_REPLACE_EXISTING = 0x1
+    _MOVEFILE_WRITE_THROUGH = 0x8
+
+    def _move_file(src, dst):
+        # os.rename does not overwrite on Windows and Python 2 has no os.replace.
+        if isinstance(src, bytes):
+            src, dst = src.decode(sys.getfilesystemencoding()), dst.decode(sys.getfilesystemencoding())
+        if not ctypes.windll.kernel32.MoveFileExW(src, dst, _MOVEFILE_REPLACE_EXISTING | _MOVEFILE_WRITE_THROUGH):
+            raise ctypes.WinError()
+else:
+    _move_file = os.rename
+
+
+def _replace(src, dst):
+    """Move ``src`` over ``dst`` atomically, waiting for readers of ``dst`` on Windows."""
+    for delay in REPLACE_RETRY_DELAYS:
+        try:
+            return _move_file(src, dst)
+        except OSError as e:
+            if getattr(e, 'winerror', None) not in _SHARING_ERRORS:
+                raise
+        time.sleep(delay)
+    _move_file(src, dst)
+
+
+@contextmanager
+def atomic_open(path, mode='w'):
+    """Open a temporary file that replaces ``path`` when the block completes.
+
+    Readers see either the old or the new content and never wait; on
+    Windows the rename waits for the readers holding ``path`` open instead.
+    The file is flushed to disk before the rename, and it is discarded when
+    the block raises. A symbolic link is written through, replacing its
+    target. Text is encoded as UTF-8.
+    """
+    path = os.path.realpath(path)
+    dirname, basename = os.path.split(path)
+    file_mode = os.stat(path).st_mode & 0o777 if os.path.exists(path) else DEFAULT_FILE_MODE
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.{}.'.format(basename), suffix='.tmp')
+    try:
+        with io.open(fd, mode, encoding=None if 'b' in mode else 'utf-8') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, file_mode)
+        _replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write(path, data, binary=False):
+    """Write ``data`` to ``path`` so that readers see either the old or the new content.
+
+    ``data`` is bytes when ``binary`` is set.
+    """
+    if not binary and isinstance(data, bytes):
+        # Dumps of Python 2 are byte strings.
+        data = data.decode('utf-8')
+    with trace.span('write', path=path, bytes=len(data)):
+        with atomic_open(path, 'wb' if binary else 'w') as f:
+            f.write(data)
+
 
-    OrderedDumper.add_representer(OrderedDict, dict_representer)
-    return yaml.dump(data, stream, OrderedDumper, **kwds)
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive advisory lock on ``path`` while the block runs."""
+    with open(path, 'a') as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,137 @@
+import json
+import os
+import sys
+import sysconfig
+from collections import namedtuple
+
+try:
+    from urllib.parse import unquote, urlparse
+except ImportError:
+    from urllib import unquote
+    from urlparse import urlparse
+
+from chpip import exception
+from chpip.bench import format_table
+from chpip.requirements import canonical_version, format_requirement
+
+DEFAULT_WORKERS = 8
+
+WarmResult = namedtuple('WarmResult', ['requirement', 'status', 'downloaded', 'cached', 'bytes', 'error'])
+
+
+def is_compatible_wheel(filename, platform=None, version_info=None):
+    """Tell whether the wheel ``filename`` probably installs on this interpreter and platform.
+
+    ``platform`` is in the form of ``sysconfig.get_platform()``, such as
+    ``linux-x86_64``. This is a heuristic on the python, ABI and platform
+    tags that accepts manylinux/musllinux wheels of the current architecture;
+    pip remains the judge of what it installs.
+    """
+    parts = filename[:-len('.whl')].split('-')
+    if len(parts) < 5:
+        return False
+    pythons, abis, platforms = (set(tag.split('.')) for tag in parts[-3:])
+    major, minor = (version_info or sys.version_info)[:2]
+    cpython = 'cp{}{}'.format(major, minor)
+    if not pythons & set(['py{}'.format(major), 'py{}{}'.format(major, minor), cpython]):
+        return False
+    if not abis & set(['none', 'abi3', cpython, cpython + 'm', cpython + 'mu']):
+        return False
+    if 'any' in platforms:
+        return True
+
+    platform = platform or sysconfig.get_platform()
+    system, arch = platform.split('-')[0], platform.split('-')[-1]
+    for tag in platforms:
+        if system == 'linux':
+            if tag.startswith(('manylinux', 'musllinux', 'linux')) and tag.endswith('_' + arch):
+                return True
+        elif system == 'macosx':
+            if tag.startswith('macosx') and tag.endswith(('_' + arch, '_universal2')):
+                return True
+        elif tag in (platform, 'win_' + arch):
+            return True
+    return False
+
+
+def select_files(files, version, platform=None):
+    """Return the keys of the ``files`` (store key -> URL) pip would choose from for ``version``.
+
+    These are the compatible wheels of that version, or its source
+    distributions when there is no such wheel.
+    """
+    from chpip.simple import parse_version
+
+    wheels, sdists = [], []
+    for key, url in sorted(files.items(), key=lambda item: item[1]):
+        filename = unquote(urlparse(url).path.rsplit('/', 1)[-1])
+        file_version = parse_version(filename)
+        if not file_version or canonical_version(file_version) != canonical_version(version):
+            continue
+        if filename.endswith('.whl'):
+            if is_compatible_wheel(filename, platform=platform):
+                wheels.append(key)
+        elif not filename.endswith('.egg'):
+            sdists.append(key)
+    return wheels or sdists
+
+
+def warm_cache(proxy, requirements, workers=DEFAULT_WORKERS, platform=None):
+    """Prefetch the simple pages and matching files of ``requirements`` into the cache of ``proxy``.
+
+    Requirements are warmed concurrently by ``workers`` threads. Pages still
+    fresh in the cache and files already in the store are not downloaded
+    again, and files stream to disk as they arrive. Only pinned
+    requirements have their files prefetched.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    def warm(requirement):
+        name = format_requirement(requirement)
+        try:
+            files = proxy.get_files(requirement.name)
+        except exception.UpstreamUnavailable as e:
+            return WarmResult(name, 'error', 0, 0, 0, str(e))
+        if files is None:
+            return WarmResult(name, 'missing', 0, 0, 0, 'No index serves `{}`'.format(requirement.name))
+        if requirement.version is None:
+            return WarmResult(name, 'page only', 0, 0, 0, None)
+        keys = select_files(files, requirement.version, platform=platform)
+        if not keys:
+            return WarmResult(name, 'missing', 0, 0, 0, 'No file for this platform')
+        downloaded = cached = size = 0
+        for key in keys:
+            if proxy.store.get(key):
+                cached += 1
+                continue
+            path = proxy.get_file(key)
+            if path is None:
+                return WarmResult(name, 'error', downloaded, cached, size, 'Download of `{}` failed'.format(
+                    files[key]))
+            downloaded += 1
+            size += os.path.getsize(path)
+        return WarmResult(name, 'downloaded' if downloaded else 'cached', downloaded, cached, size, None)
+
+    if not requirements:
+        return []
+    pool = ThreadPool(min(len(requirements), workers))
+    try:
+        return pool.map(warm, requirements)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def format_results(results, as_json=False):
+    if as_json:
+        return json.dumps([r._asdict() for r in results], indent=2)
+
+    rows = [('requirement', 'status', 'files', 'MiB', 'error')]
+    for r in results:
+        rows.append((r.requirement, r.status, '{}/{}'.format(r.downloaded, r.downloaded + r.cached),
+                     '{:.1f}'.format(r.bytes / 1048576.0), r.error or ''))
+    lines = [format_table(rows)]
+    lines.append('{} files downloaded ({:.1f} MiB), {} already cached.'.format(
+        sum(r.downloaded for r in results), sum(r.bytes for r in results) / 1048576.0,
+        sum(r.cached for r in results)))
+    return '\n'.join(lines)
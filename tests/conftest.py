@@ -1,9 +1,14 @@
 import sys
+import threading
+import time
 
 import pytest
 
 from chpip.core import PY2, ChpipManager
 
+# chpip.aio needs asyncio and the async syntax of Python 3.5+.
+collect_ignore = ['test_aio.py'] if PY2 else []
+
 if PY2:
     import shutil
     import itertools
@@ -219,9 +224,111 @@ if PY2:
 else:
     from tempfile import TemporaryDirectory
 
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+# Simple page of the project probed by the benchmarks.
+SIMPLE_PAGE = (200, {'Content-Type': 'text/html'}, '<a href="pip-23.0.tar.gz">pip-23.0.tar.gz</a>')
+CATALOG = 'indexes:\n  ustc: https://mirrors.ustc.edu.cn/pypi/web/simple\n  pypi: https://pypi.org/simple\n'
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """Local HTTP server standing in for a package index.
+
+    ``routes`` maps a path to ``(status, headers, body)`` or to a callable
+    taking the request handler and returning such a tuple. ``delay`` seconds
+    are slept before answering, bodies are sent at ``rate`` bytes per second
+    per connection when given and every request is recorded in ``requests``.
+    """
+    daemon_threads = True
+    CHUNK_SIZE = 16 * 1024
+
+    def __init__(self, routes=None, delay=0, rate=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.routes = routes or {}
+        self.delay = delay
+        self.rate = rate
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self, send_body=True):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.command, self.path, dict(self.headers)))
+        if server.delay:
+            time.sleep(server.delay)
+        route = server.routes.get(self.path.split('?')[0])
+        if route is None:
+            status, headers, body = 404, {}, b'Not Found'
+        elif callable(route):
+            status, headers, body = route(self)
+        else:
+            status, headers, body = route
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not send_body:
+            return
+        if not server.rate:
+            self.wfile.write(body)
+            return
+        try:
+            for start in range(0, len(body), server.CHUNK_SIZE):
+                chunk = body[start:start + server.CHUNK_SIZE]
+                self.wfile.write(chunk)
+                time.sleep(len(chunk) / float(server.rate))
+        except (IOError, OSError):
+            # The client stopped reading, e.g. after enough bytes.
+            pass
+
+    def do_GET(self):
+        self._handle()
+
+    def do_HEAD(self):
+        self._handle(send_body=False)
+
 
 @pytest.fixture(scope='function')
 def chpip_manager():
     with TemporaryDirectory() as tmp_dirname:
-        chpip = ChpipManager(pip_dirname=tmp_dirname)
+        # Keep results independent of the network the tests run on.
+        chpip = ChpipManager(pip_dirname=tmp_dirname, fingerprint=lambda: None)
         yield chpip
+
+
+@pytest.fixture(scope='function')
+def http_server():
+    servers = []
+
+    def start(routes=None, delay=0, rate=None):
+        server = StandInServer(routes=routes, delay=delay, rate=rate)
+        thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+import pytest
+
+from chpip import core, exception, trace
+from chpip.aio import AsyncChpipManager
+from tests.conftest import CATALOG, SIMPLE_PAGE
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+async def max_lag(task, interval=0.005):
+    """Return the longest delay of a ticker running on the loop while ``task`` runs, in seconds."""
+    lag = 0
+    while not task.done():
+        start = time.time()
+        await asyncio.sleep(interval)
+        lag = max(lag, time.time() - start - interval)
+    await task
+    return lag
+
+
+class TestAsyncChpipManager(object):
+    def test_updates(self, chpip_manager):
+        async def main():
+            async with AsyncChpipManager(manager=chpip_manager) as manager:
+                await asyncio.gather(*[
+                    manager.set_index('index{}'.format(i), 'https://mirror{}.test/simple'.format(i))
+                    for i in range(50)])
+                await manager.change_index('index7')
+                current, indexes = await asyncio.gather(manager.current_index(), manager.indexes())
+                with pytest.raises(exception.IndexNameNotFound):
+                    await manager.change_index('missing')
+                return current, indexes
+
+        current, indexes = run(main())
+        assert current == core.Index('index7', 'https://mirror7.test/simple')
+        assert sorted(index.name for index in indexes) == sorted(['default'] + ['index{}'.format(i) for i in range(50)])
+
+    def test_queries_share_a_run(self, chpip_manager, monkeypatch, http_server):
+        server = http_server({'/pip.yml': (200, {}, CATALOG)}, delay=0.3)
+        monkeypatch.setattr(core, 'SOURCE_PIP_CONFIG_URL', server.url + '/pip.yml')
+
+        async def main():
+            async with AsyncChpipManager(manager=chpip_manager) as manager:
+                task = asyncio.ensure_future(asyncio.gather(*[manager.list() for _ in range(200)]))
+                lag = await max_lag(task)
+                return task.result(), lag
+
+        results, lag = run(main())
+        assert set(results) == {
+            '  ustc (https://mirrors.ustc.edu.cn/pypi/web/simple)\n  pypi (https://pypi.org/simple)'}
+        assert len(server.requests) == 1
+        assert lag < 0.1
+
+    def test_reads_follow_updates(self, chpip_manager):
+        async def main():
+            async with AsyncChpipManager(manager=chpip_manager) as manager:
+                await manager.set_index('a', 'https://a.test/simple')
+                before = asyncio.ensure_future(manager.indexes())
+                await manager.set_index('b', 'https://b.test/simple')
+                return await before, await manager.indexes()
+
+        _, after = run(main())
+        assert 'b' in [index.name for index in after]
+
+    def test_connections_are_reused(self, chpip_manager, http_server):
+        server = http_server({'/simple/pip/': SIMPLE_PAGE})
+        chpip_manager.set_index('local', server.url + '/simple')
+        spans = []
+
+        async def main():
+            async with AsyncChpipManager(manager=chpip_manager) as manager:
+                for _ in range(3):
+                    await manager.bench(samples=2)
+
+        trace.add_hook(spans.append)
+        try:
+            run(main())
+        finally:
+            trace.remove_hook(spans.append)
+        reused = [span['reused'] for span in spans if span['name'] == 'http']
+        assert len(reused) == 6 and reused.count(False) == 1
@@ -0,0 +1,68 @@
+import threading
+import time
+
+import pytest
+
+from chpip import core, exception
+from chpip.core import AUTO_INDEX_NAME, DEFAULT_INDEX_NAME
+from tests.conftest import SIMPLE_PAGE
+
+
+class TestAutoIndex(object):
+    @pytest.fixture(autouse=True)
+    def unreachable_default(self, monkeypatch, http_server):
+        monkeypatch.setattr(core, 'DEFAULT_INDEX_URL', http_server({}).url + '/simple')
+
+    def test_set_auto_index_name(self, chpip_manager):
+        with pytest.raises(exception.InvalidIndexName):
+            chpip_manager.set_index(AUTO_INDEX_NAME, 'https://test.com')
+
+    def test_change_to_fastest(self, chpip_manager, http_server):
+        slow = http_server({'/simple/pip/': SIMPLE_PAGE}, delay=0.2)
+        fast = http_server({'/simple/pip/': SIMPLE_PAGE})
+        chpip_manager.set_index('slow', slow.url + '/simple')
+        chpip_manager.set_index('fast', fast.url + '/simple')
+
+        name = chpip_manager.change_index(AUTO_INDEX_NAME)
+        assert name == 'fast'
+        pip_conf = chpip_manager.get_pip_config()
+        assert pip_conf['global']['index-url'] == fast.url + '/simple'
+        ranking = chpip_manager.get_chpip_data()['latency']['ranking']
+        assert list(ranking) == ['fast', 'slow', DEFAULT_INDEX_NAME]
+        assert ranking[DEFAULT_INDEX_NAME] is None
+
+    def test_ranking_is_cached(self, chpip_manager, http_server):
+        server = http_server({'/simple/pip/': SIMPLE_PAGE})
+        chpip_manager.set_index('test', server.url + '/simple')
+
+        chpip_manager.change_index(AUTO_INDEX_NAME)
+        probes = len(server.requests)
+        assert probes > 0
+        chpip_manager.change_index(DEFAULT_INDEX_NAME)
+        assert chpip_manager.change_index(AUTO_INDEX_NAME) == 'test'
+        assert len(server.requests) == probes
+
+        chpip_manager.change_index(AUTO_INDEX_NAME, ttl=0)
+        assert len(server.requests) == 2 * probes
+        chpip_manager.change_index(AUTO_INDEX_NAME, refresh=True)
+        assert len(server.requests) == 3 * probes
+
+    def test_no_reachable_index(self, chpip_manager, http_server):
+        chpip_manager.set_index('test', http_server({}).url + '/simple')
+        with pytest.raises(exception.NoReachableIndex):
+            chpip_manager.change_index(AUTO_INDEX_NAME)
+
+    def test_probes_do_not_hold_the_lock(self, chpip_manager, http_server):
+        server = http_server({'/simple/pip/': SIMPLE_PAGE}, delay=0.3)
+        chpip_manager.set_index('slow', server.url + '/simple')
+        thread = threading.Thread(target=chpip_manager.change_index, args=(AUTO_INDEX_NAME,), kwargs={'failover': 1})
+        thread.start()
+        while not server.requests:
+            time.sleep(0.01)
+        start = time.time()
+        chpip_manager.set_index('other', 'https://other.test/simple')
+        assert time.time() - start < 0.2
+        thread.join()
+        chpip_data = chpip_manager.get_chpip_data()
+        assert chpip_data['current_index_name'] == 'slow'
+        assert 'other' in chpip_data['indexes']
@@ -0,0 +1,110 @@
+import functools
+import json
+
+import pytest
+
+from chpip import core, exception
+from chpip.bench import bench_indexes, bench_throughput, format_results, format_throughput, percentile
+from chpip.utils import timer
+from tests.conftest import SIMPLE_PAGE
+
+
+class TestBench(object):
+    def test_percentile(self):
+        assert percentile([], 50) is None
+        assert percentile([3, 1, 2], 50) == 2
+        assert percentile(list(range(1, 101)), 95) == 95
+
+    def test_bench_no_available_indexes(self, chpip_manager):
+        with pytest.raises(exception.NoAvailableIndex):
+            chpip_manager.bench()
+
+    def test_bench_indexes(self, chpip_manager, http_server):
+        good = http_server({'/simple/pip/': SIMPLE_PAGE})
+        bad = http_server({})
+        chpip_manager.set_index('good', good.url + '/simple')
+        chpip_manager.set_index('bad', bad.url + '/simple')
+
+        results = chpip_manager.bench(samples=3, timeout=2)
+        assert [r.name for r in results] == ['good', 'bad']
+        good_result, bad_result = results
+        assert good_result.errors == 0
+        assert good_result.p50 is not None and good_result.ttfb_p50 <= good_result.p95
+        assert bad_result.errors == 3 and bad_result.error_rate == 1.0
+        assert bad_result.p50 is None
+        assert len(good.requests) == 3
+        assert all(path == '/simple/pip/' for _, path, _ in good.requests)
+
+        table = format_results(results)
+        assert table.splitlines()[0].startswith('name')
+        assert json.loads(format_results(results, as_json=True))[1]['error_rate'] == 1.0
+
+    def test_bench_runs_concurrently(self, http_server):
+        indexes = {}
+        for i in range(6):
+            server = http_server({'/simple/pip/': SIMPLE_PAGE}, delay=0.3)
+            indexes['s{}'.format(i)] = server.url + '/simple'
+        start = timer()
+        results = bench_indexes(indexes, samples=2, timeout=2)
+        assert timer() - start < 6 * 2 * 0.3
+        assert all(r.errors == 0 for r in results)
+
+    def test_bench_deadline(self, http_server):
+        server = http_server({'/simple/pip/': SIMPLE_PAGE}, delay=0.5)
+        start = timer()
+        result, = bench_indexes({'slow': server.url + '/simple'}, samples=10, timeout=2, deadline=0.8)
+        assert timer() - start < 3
+        assert result.errors >= 8
+
+
+ARTIFACT = bytes(bytearray(range(256))) * 4096  # 1 MiB
+
+
+def artifact_route(handler):
+    start, end = handler.headers['Range'].split('=')[1].split('-')
+    body = ARTIFACT[int(start):int(end) + 1]
+    return 206, {'Content-Range': 'bytes {}-{}/{}'.format(start, end, len(ARTIFACT))}, body
+
+
+def throughput_routes(path='/files/numpy-2.0-py3-none-any.whl'):
+    page = ('<a href="{}">numpy-2.0.tar.gz</a>'
+            '<a href="{}">numpy-2.0-py3-none-any.whl</a>').format('/files/numpy-2.0.tar.gz', path)
+    return {'/simple/numpy/': (200, {'Content-Type': 'text/html'}, page), path: artifact_route}
+
+
+class TestThroughput(object):
+    def test_bench_throughput(self, chpip_manager, http_server):
+        fast = http_server(throughput_routes(), rate=4 * 1024 * 1024)
+        slow = http_server(throughput_routes(), rate=1024 * 1024)
+        empty = http_server({'/simple/numpy/': (200, {}, '')})
+        chpip_manager.set_index('fast', fast.url + '/simple')
+        chpip_manager.set_index('slow', slow.url + '/simple')
+        chpip_manager.set_index('empty', empty.url + '/simple')
+
+        results = chpip_manager.bench(throughput=True, window=512 * 1024, streams=2, timeout=5)
+        fast_result, slow_result, empty_result = results
+        assert fast_result.bytes == slow_result.bytes == 512 * 1024
+        assert fast_result.artifact_url.endswith('.whl')
+        assert fast_result.mbps > slow_result.mbps * 2
+        assert empty_result.mbps is None and empty_result.error
+        ranges = sorted(headers['Range'] for _, path, headers in fast.requests if path.startswith('/files/'))
+        assert ranges == ['bytes=0-262143', 'bytes=262144-524287']
+        assert 'MB/s' in format_throughput(results)
+
+    def test_auto_by_throughput(self, chpip_manager, http_server, monkeypatch):
+        monkeypatch.setattr(core, 'DEFAULT_INDEX_URL', http_server().url + '/simple')
+        fast = http_server(throughput_routes(), rate=8 * 1024 * 1024)
+        slow = http_server(throughput_routes(), rate=1024 * 1024)
+        chpip_manager.set_index('slow', slow.url + '/simple')
+        chpip_manager.set_index('fast', fast.url + '/simple')
+        monkeypatch.setattr(core, 'bench_throughput', functools.partial(
+            bench_throughput, window=256 * 1024, streams=2, timeout=5))
+
+        assert chpip_manager.change_index('auto', by='throughput') == 'fast'
+        ranking = chpip_manager.get_chpip_data()['throughput']['ranking']
+        assert list(ranking) == ['fast', 'slow', 'default'] and ranking['default'] is None
+        requests = len(fast.requests)
+        assert chpip_manager.change_index('auto', by='throughput') == 'fast'
+        assert len(fast.requests) == requests
+        with pytest.raises(exception.InvalidRankBy):
+            chpip_manager.change_index('auto', by='size')
@@ -0,0 +1,54 @@
+import os
+
+from chpip.core import DEFAULT_INDEX_NAME, Index, ChpipManager
+
+
+class TestCache(object):
+    def _manager(self, chpip_manager):
+        return ChpipManager(pip_dirname=chpip_manager.pip_dirname, cache=True)
+
+    def test_typed_reads(self, chpip_manager):
+        assert chpip_manager.current_index() is None
+        assert chpip_manager.indexes() == []
+        chpip_manager.set_index('t1', 'https://test1.com')
+        chpip_manager.change_index('t1')
+        assert chpip_manager.current_index() == Index('t1', 'https://test1.com')
+        assert [index.name for index in chpip_manager.indexes()] == ['t1', DEFAULT_INDEX_NAME]
+
+    def test_reuses_parsed_files(self, chpip_manager):
+        manager = self._manager(chpip_manager)
+        manager.set_index('t1', 'https://test1.com')
+        manager.change_index('t1')
+        chpip_data = manager._load_chpip_data()
+        config = manager._load_pip_config()
+        assert manager._load_chpip_data() is chpip_data
+        assert manager._load_pip_config() is config
+
+        # Callers get copies they are free to modify.
+        manager.get_chpip_data()['current_index_name'] = 'changed'
+        manager.get_pip_config().set('global', 'index-url', 'https://changed.com')
+        assert manager.current_index() == Index('t1', 'https://test1.com')
+        assert manager.get_pip_config().get('global', 'index-url') == 'https://test1.com'
+
+    def test_updated_by_own_writes(self, chpip_manager):
+        manager = self._manager(chpip_manager)
+        manager.set_index('t1', 'https://test1.com')
+        assert manager.indexes() == [Index('t1', 'https://test1.com')]
+        manager.set_index('t2', 'https://test2.com')
+        assert [index.name for index in manager.indexes()] == ['t1', 't2']
+        manager.change_index('t2')
+        assert manager.current_index() == Index('t2', 'https://test2.com')
+
+    def test_invalidated_by_external_edits(self, chpip_manager):
+        manager = self._manager(chpip_manager)
+        manager.set_index('t1', 'https://test1.com')
+        assert len(manager.indexes()) == 1
+
+        other = ChpipManager(pip_dirname=chpip_manager.pip_dirname)
+        other.set_index('t2', 'https://test2.com')
+        other.change_index('t2')
+        assert [index.name for index in manager.indexes()] == ['t1', 't2', DEFAULT_INDEX_NAME]
+        assert manager.get_pip_config().get('global', 'index-url') == 'https://test2.com'
+
+        os.remove(manager.chpip_path)
+        assert manager.indexes() == []
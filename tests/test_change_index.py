@@ -1,3 +1,5 @@
+import os
+
 import pytest
 
 from chpip import exception
@@ -50,3 +52,17 @@ class TestChangeIndex(object):
         assert name == DEFAULT_INDEX_NAME
         pip_conf = chpip_manager.get_pip_config()
         assert pip_conf['global']['index-url'] == DEFAULT_INDEX_URL
+
+    def test_change_index_through_symlink(self, chpip_manager, tmp_path):
+        target = tmp_path / 'pip.conf'
+        target.write_text(u'[global]\nindex-url = https://old.com\n')
+        os.symlink(str(target), chpip_manager.pip_path)
+        chpip_manager.set_index(self.TEST_INDEX_NAME, self.TEST_INDEX_URL)
+        chpip_manager.change_index(self.TEST_INDEX_NAME)
+        assert os.path.islink(chpip_manager.pip_path)
+        assert self.TEST_INDEX_URL in target.read_text()
+
+    def test_change_index_non_ascii_name(self, chpip_manager):
+        chpip_manager.set_index(u'镜像', self.TEST_INDEX_URL)
+        assert chpip_manager.change_index(u'镜像') == u'镜像'
+        assert chpip_manager.current_index().name == u'镜像'
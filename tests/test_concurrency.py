@@ -0,0 +1,68 @@
+import os
+from multiprocessing import Pool
+
+from chpip import utils
+from chpip.core import ChpipManager
+
+PROCESSES = 16
+OPERATIONS = 300
+SWITCH_NAMES = ['s0', 's1', 's2']
+TIMEOUT = 120
+
+
+def run_operation(args):
+    pip_dirname, i = args
+    manager = ChpipManager(pip_dirname=pip_dirname)
+    if i % 2:
+        manager.set_index('n{}'.format(i), 'https://n{}.example.com/simple'.format(i))
+    else:
+        manager.change_index(SWITCH_NAMES[i % len(SWITCH_NAMES)])
+    data = manager.get_chpip_data()
+    assert data['indexes']
+    return i
+
+
+class TestConcurrency(object):
+    def test_concurrent_set_and_change(self, chpip_manager):
+        for name in SWITCH_NAMES:
+            chpip_manager.set_index(name, 'https://{}.example.com/simple'.format(name))
+
+        pool = Pool(PROCESSES)
+        try:
+            jobs = [(chpip_manager.pip_dirname, i) for i in range(OPERATIONS)]
+            done = pool.map_async(run_operation, jobs).get(TIMEOUT)
+        finally:
+            pool.terminate()
+            pool.join()
+        assert sorted(done) == list(range(OPERATIONS))
+
+        chpip_data = chpip_manager.get_chpip_data()
+        indexes = chpip_data['indexes']
+        for i in range(1, OPERATIONS, 2):
+            assert indexes['n{}'.format(i)] == {'index_url': 'https://n{}.example.com/simple'.format(i)}
+        current_index_name = chpip_data['current_index_name']
+        assert current_index_name in SWITCH_NAMES
+        pip_conf = chpip_manager.get_pip_config()
+        assert pip_conf['global']['index-url'] == indexes[current_index_name]['index_url']
+        assert not [f for f in os.listdir(chpip_manager.pip_dirname) if f.endswith('.tmp')]
+
+    def test_replace_waits_for_readers(self, tmp_path, monkeypatch):
+        path = str(tmp_path / 'pip.conf')
+        attempts = []
+        move_file = utils._move_file
+
+        def sharing_violation(src, dst):
+            # What Windows answers while a reader has ``dst`` open.
+            attempts.append(dst)
+            if len(attempts) < 3:
+                error = OSError(13, 'Permission denied')
+                error.winerror = 32
+                raise error
+            move_file(src, dst)
+
+        monkeypatch.setattr(utils, '_move_file', sharing_violation)
+        utils.atomic_write(path, u'[global]\n')
+        assert len(attempts) == 3
+        with open(path) as f:
+            assert f.read() == '[global]\n'
+        assert os.listdir(str(tmp_path)) == ['pip.conf']
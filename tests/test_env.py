@@ -0,0 +1,47 @@
+import os
+import subprocess
+
+import pytest
+
+from chpip import exception
+from chpip.core import SHELL_HOOK
+
+
+class TestEnv(object):
+    def test_env(self, chpip_manager):
+        chpip_manager.set_index('t1', 'https://test1.com')
+        chpip_manager.set_index('t2', "https://test2.com/it's")
+        pip_config = chpip_manager.get_pip_config()
+
+        assert chpip_manager.env('t1') == 'export PIP_INDEX_URL=https://test1.com\nunset PIP_EXTRA_INDEX_URL'
+        assert chpip_manager.env('t1', extra_names=('t2', 'default')) == (
+            'export PIP_INDEX_URL=https://test1.com\n'
+            "export PIP_EXTRA_INDEX_URL='https://test2.com/it'\"'\"'s https://pypi.org/simple'"
+        )
+        assert chpip_manager.env(None, unset=True) == 'unset PIP_INDEX_URL PIP_EXTRA_INDEX_URL'
+        with pytest.raises(exception.IndexNameNotFound):
+            chpip_manager.env('t3')
+        assert not os.path.exists(chpip_manager.pip_path)
+        assert chpip_manager.get_pip_config().sections() == pip_config.sections()
+
+    def test_env_lookup_regenerated(self, chpip_manager):
+        chpip_manager.set_index('t1', 'https://test1.com')
+        os.remove(chpip_manager.env_path)
+        assert 'https://test1.com' in chpip_manager.env('t1')
+        chpip_manager.set_index('t1', 'https://test2.com')
+        assert 'https://test2.com' in chpip_manager.env('t1')
+
+    def test_env_non_ascii_name(self, chpip_manager):
+        chpip_manager.set_index(u'镜像', 'https://test1.com')
+        assert chpip_manager.env(u'镜像') == 'export PIP_INDEX_URL=https://test1.com\nunset PIP_EXTRA_INDEX_URL'
+
+    def test_shell_hook(self, chpip_manager, tmp_path):
+        chpip_manager.set_index('t1', 'https://test1.com')
+        script = (
+            SHELL_HOOK.replace('command chpip env', 'env_stub') +
+            '\nenv_stub() { printf "%s\\n" "$ENV_OUTPUT"; }\n'
+            'chpip use -n t1\necho "$PIP_INDEX_URL"'
+        )
+        env = dict(os.environ, ENV_OUTPUT=chpip_manager.env('t1'))
+        output = subprocess.check_output(['sh', '-c', script], env=env)
+        assert output.decode('utf-8').strip() == 'https://test1.com'
@@ -0,0 +1,60 @@
+import pytest
+
+from chpip import core
+from chpip.core import AUTO_INDEX_NAME, derive_timeouts
+from tests.conftest import SIMPLE_PAGE
+
+
+class TestFailover(object):
+    @pytest.fixture(autouse=True)
+    def indexes(self, monkeypatch, http_server, chpip_manager):
+        monkeypatch.setattr(core, 'DEFAULT_INDEX_URL', http_server({}).url + '/simple')
+        self.urls = {}
+        for name, delay in [('fast', 0), ('medium', 0.05), ('slow', 0.1)]:
+            server = http_server({'/simple/pip/': SIMPLE_PAGE}, delay=delay)
+            self.urls[name] = server.url + '/simple'
+            chpip_manager.set_index(name, self.urls[name])
+
+    def test_derive_timeouts(self):
+        assert derive_timeouts(None) == (60, 1)
+        assert derive_timeouts(10) == (3, 5)
+        assert derive_timeouts(1000) == (10, 2)
+
+    def test_failover(self, chpip_manager):
+        chpip_manager.change_index('slow', failover=2)
+        global_conf = chpip_manager.get_pip_config()['global']
+        assert global_conf['index-url'] == self.urls['slow']
+        assert global_conf['extra-index-url'].split() == [self.urls['fast'], self.urls['medium']]
+        assert int(global_conf['timeout']) >= 3 and int(global_conf['retries']) >= 1
+        assert chpip_manager.show().splitlines() == [
+            '1 fast ({})'.format(self.urls['fast']),
+            '2 medium ({})'.format(self.urls['medium']),
+            '* slow ({})'.format(self.urls['slow']),
+            '  default ({})'.format(core.DEFAULT_INDEX_URL),
+        ]
+
+        # The setting is kept for later switches.
+        chpip_manager.change_index(AUTO_INDEX_NAME)
+        global_conf = chpip_manager.get_pip_config()['global']
+        assert global_conf['index-url'] == self.urls['fast']
+        assert global_conf['extra-index-url'].split() == [self.urls['medium'], self.urls['slow']]
+
+        chpip_manager.change_index('medium', failover=0)
+        global_conf = chpip_manager.get_pip_config()['global']
+        assert global_conf['index-url'] == self.urls['medium']
+        for option in core.FAILOVER_OPTIONS:
+            assert option not in global_conf
+        assert 'fallback_index_names' not in chpip_manager.get_chpip_data()
+
+    def test_monitor_updates_failover(self, chpip_manager):
+        chpip_manager.change_index('fast', failover=1)
+        data = chpip_manager.get_chpip_data()
+        data['latency']['ranking'] = dict.fromkeys(data['latency']['ranking'])
+        chpip_manager._write_chpip_data(data)
+        chpip_manager.change_index('default')
+        assert 'extra-index-url' not in chpip_manager.get_pip_config()['global']
+
+        chpip_manager.monitor(samples=1, iterations=1)
+        global_conf = chpip_manager.get_pip_config()['global']
+        assert global_conf['extra-index-url'] == self.urls['fast']
+        assert chpip_manager.get_chpip_data()['latency']['ranking']['fast'] is not None
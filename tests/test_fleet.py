@@ -0,0 +1,56 @@
+import os
+
+from chpip.core import ChpipManager
+from chpip.fleet import apply_to_roots, discover_roots, format_results, read_roots
+
+INDEX_URL = 'https://test.com/simple'
+
+
+class TestFleet(object):
+    def _make_roots(self, tmp_path, count=5):
+        roots = []
+        for i in range(count):
+            root = tmp_path / 'venv{}'.format(i)
+            root.mkdir()
+            (root / 'pyvenv.cfg').write_text(u'home = /usr/bin\n')
+            roots.append(str(root))
+        return roots
+
+    def test_discover_and_read_roots(self, tmp_path):
+        roots = self._make_roots(tmp_path, 2)
+        home = tmp_path / 'home' / '.config' / 'pip'
+        home.mkdir(parents=True)
+        (home / 'pip.conf').write_text(u'[global]\n')
+        (tmp_path / 'other').mkdir()
+        assert discover_roots([str(tmp_path / 'venv*'), str(tmp_path / '*' / '.config' / 'pip' / 'pip.conf'),
+                               str(tmp_path / 'other')]) == roots + [str(home)]
+
+        roots_file = tmp_path / 'roots.txt'
+        roots_file.write_text(u'# venvs\n{}\n\n{}\n'.format(*roots))
+        assert read_roots(str(roots_file)) == roots
+
+    def test_apply(self, tmp_path):
+        roots = self._make_roots(tmp_path)
+        results = apply_to_roots(roots + [str(tmp_path / 'missing')], 'test', index_url=INDEX_URL)
+        assert [r.status for r in results] == ['ok'] * 5 + ['error']
+        for root in roots:
+            manager = ChpipManager(pip_dirname=root)
+            assert manager.get_pip_config()['global']['index-url'] == INDEX_URL
+        assert format_results(results).splitlines()[-1] == '1 error, 5 ok'
+
+    def test_apply_dry_run(self, tmp_path):
+        roots = self._make_roots(tmp_path, 2)
+        results = apply_to_roots(roots, 'test', index_url=INDEX_URL, dry_run=True)
+        assert [r.status for r in results] == ['changed', 'changed']
+        assert '+index-url = {}'.format(INDEX_URL) in results[0].diff
+        for root in roots:
+            assert sorted(os.listdir(root)) == ['pyvenv.cfg']
+
+        apply_to_roots(roots[:1], 'test', index_url=INDEX_URL)
+        results = apply_to_roots(roots, 'test', dry_run=True)
+        assert [r.status for r in results] == ['unchanged', 'error']
+
+    def test_apply_fail_fast(self, tmp_path):
+        roots = [str(tmp_path / 'missing')] + self._make_roots(tmp_path, 3)
+        results = apply_to_roots(roots, 'test', index_url=INDEX_URL, workers=1, continue_on_error=False)
+        assert [r.status for r in results] == ['error', 'skipped', 'skipped', 'skipped']
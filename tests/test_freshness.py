@@ -0,0 +1,90 @@
+import json
+from collections import OrderedDict
+
+import pytest
+
+from chpip import core, exception
+from chpip.core import AUTO_INDEX_NAME
+from chpip.freshness import is_stale
+from chpip.simple import PEP691_CONTENT_TYPE, parse_version
+
+
+def json_page(files, serial):
+    body = json.dumps({
+        'meta': {'api-version': '1.0'},
+        'name': 'pip',
+        'files': [{'filename': f, 'url': '../../packages/' + f, 'hashes': {}} for f in files],
+    })
+    return 200, {'Content-Type': PEP691_CONTENT_TYPE, 'X-PyPI-Last-Serial': str(serial)}, body
+
+
+def html_page(files):
+    links = ''.join('<a href="../../packages/{0}#sha256=00">{0}</a><br/>'.format(f) for f in files)
+    return 200, {'Content-Type': 'text/html'}, '<html><body>{}</body></html>'.format(links)
+
+
+FILES = ['pip-23.0.tar.gz', 'pip-23.0-py3-none-any.whl', 'pip-23.1.tar.gz']
+
+
+class TestFreshness(object):
+    @pytest.fixture(autouse=True)
+    def indexes(self, monkeypatch, http_server, chpip_manager):
+        canonical = http_server({'/simple/pip/': json_page(FILES, 100)})
+        monkeypatch.setattr(core, 'DEFAULT_INDEX_URL', canonical.url + '/simple')
+        self.servers = {
+            'synced': http_server({'/simple/pip/': json_page(FILES, 100)}),
+            'behind': http_server({'/simple/pip/': json_page(FILES[:2], 90)}),
+            'html': http_server({'/simple/pip/': html_page(FILES[:2])}),
+            'broken': http_server({'/simple/pip/': (500, {}, '')}),
+        }
+        for name, server in self.servers.items():
+            chpip_manager.set_index(name, server.url + '/simple')
+
+    def test_parse_version(self):
+        assert parse_version('pip-23.0.tar.gz') == '23.0'
+        assert parse_version('zope.interface-5.0-cp39-cp39-manylinux1_x86_64.whl') == '5.0'
+        assert parse_version('python-dateutil-2.8.2.zip') == '2.8.2'
+        assert parse_version('README.txt') is None
+
+    def test_freshness(self, chpip_manager):
+        results = dict((r.name, r) for r in chpip_manager.freshness(sentinels=['pip']))
+        assert results['synced'].serial_lag == 0 and not is_stale(results['synced'])
+        assert results['behind'].serial_lag == 10 and results['behind'].missing_files == 1
+        assert is_stale(results['behind']) and not is_stale(results['behind'], max_lag=10)
+        assert results['html'].serial_lag is None and results['html'].missing_files == 1
+        assert is_stale(results['html'])
+        assert results['broken'].errors == 1 and is_stale(results['broken'])
+        for server in self.servers.values():
+            assert len(server.requests) == 1
+
+    def test_auto_skips_stale(self, chpip_manager):
+        data = chpip_manager.get_chpip_data()
+        data['latency'] = {'measured_at': 4102444800, 'ranking': OrderedDict([
+            ('behind', 1.0), ('html', 2.0), ('synced', 3.0), ('broken', 4.0), ('default', 5.0),
+        ])}
+        chpip_manager._write_chpip_data(data)
+        assert chpip_manager.change_index(AUTO_INDEX_NAME) == 'behind'
+        assert chpip_manager.change_index(AUTO_INDEX_NAME, max_lag=0) == 'synced'
+        assert chpip_manager.change_index(AUTO_INDEX_NAME, max_lag=10) == 'behind'
+
+    def test_no_fresh_index(self, chpip_manager):
+        data = chpip_manager.get_chpip_data()
+        data['latency'] = {'measured_at': 4102444800, 'ranking': OrderedDict([
+            ('behind', 1.0), ('html', 2.0), ('synced', None), ('broken', None), ('default', None),
+        ])}
+        chpip_manager._write_chpip_data(data)
+        with pytest.raises(exception.NoFreshIndex):
+            chpip_manager.change_index(AUTO_INDEX_NAME, max_lag=0)
+
+    def test_canonical_unreachable(self, chpip_manager, monkeypatch):
+        monkeypatch.setattr(core, 'DEFAULT_INDEX_URL', 'http://127.0.0.1:1/simple')
+        with pytest.raises(exception.CanonicalIndexError):
+            chpip_manager.freshness(sentinels=['pip'])
+        data = chpip_manager.get_chpip_data()
+        data['latency'] = {'measured_at': 4102444800, 'ranking': OrderedDict([
+            ('behind', 1.0), ('html', 2.0), ('synced', 3.0), ('broken', 4.0), ('default', None),
+        ])}
+        chpip_manager._write_chpip_data(data)
+        with pytest.raises(exception.CanonicalIndexError):
+            chpip_manager.change_index(AUTO_INDEX_NAME, max_lag=0)
+        assert chpip_manager.current_index() is None
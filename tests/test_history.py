@@ -0,0 +1,59 @@
+import os
+
+from chpip import core
+from chpip.history import HEADER, RECORD, LatencyHistory, format_stats
+from tests.conftest import SIMPLE_PAGE
+
+
+class TestHistory(object):
+    def test_ring_buffer(self, tmp_path):
+        history = LatencyHistory(str(tmp_path / 'h' / 'test.ring'), capacity=4, alpha=0.5)
+        assert history.summary() is None
+        assert history.samples() == []
+
+        for i, latency in enumerate([10, None, 30, 40, 50, 60]):
+            history.record(latency, timestamp=i)
+        assert history.samples() == [(2, 30), (3, 40), (4, 50), (5, 60)]
+        assert os.path.getsize(history.path) == HEADER.size + 4 * RECORD.size
+
+        summary = history.summary()
+        assert summary.count == 4
+        assert summary.last_latency == 60 and summary.last_at == 5
+        assert summary.ewma == ((((10 + 30) / 2.0 + 40) / 2 + 50) / 2 + 60) / 2
+
+    def test_stats(self, tmp_path):
+        history = LatencyHistory(str(tmp_path / 'test.ring'))
+        for latency in [10, 20, None, 40]:
+            history.record(latency)
+        stats = history.stats('test')
+        assert stats.samples == 4 and stats.errors == 1 and stats.error_rate == 0.25
+        assert stats.p50 == 20 and stats.p95 == 40
+        assert format_stats([stats]).splitlines()[1].startswith('test')
+
+    def test_monitor(self, chpip_manager, http_server, monkeypatch):
+        server = http_server({'/simple/pip/': SIMPLE_PAGE})
+        monkeypatch.setattr(core, 'DEFAULT_INDEX_URL', server.url + '/simple')
+        chpip_manager.set_index('good', server.url + '/simple')
+        bad_url = http_server({}).url + '/simple'
+        chpip_manager.set_index('bad', bad_url)
+        rounds = []
+
+        chpip_manager.monitor(interval=0, samples=2, iterations=3, callback=rounds.append)
+        assert len(rounds) == 3
+        good, bad = chpip_manager.stats()
+        assert good.samples == 3 and good.errors == 0 and good.ewma is not None
+        assert bad.samples == 3 and bad.errors == 3 and bad.ewma is None
+
+        lines = chpip_manager.show().splitlines()
+        assert lines[0].startswith('  good ({}/simple) ~'.format(server.url))
+        assert lines[1] == '  bad ({})'.format(bad_url)
+
+    def test_monitor_stores_ranking(self, chpip_manager, http_server, monkeypatch):
+        monkeypatch.setattr(core, 'DEFAULT_INDEX_URL', http_server({'/simple/pip/': SIMPLE_PAGE}).url + '/simple')
+        chpip_manager.set_index('bad', http_server({}).url + '/simple')
+
+        # A fresh state: no index was ever changed to.
+        chpip_manager.monitor(interval=0, samples=1, iterations=1)
+        ranking = chpip_manager.get_chpip_data()['latency']['ranking']
+        assert list(ranking) == ['default', 'bad']
+        assert ranking['bad'] is None
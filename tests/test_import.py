@@ -0,0 +1,107 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from chpip import exception, http
+from chpip.__main__ import cli
+from chpip.catalog import CatalogCache, parse_catalog, read_catalog
+
+CATALOG = '''
+indexes:
+  t1: https://test1.com
+  t2: https://test2.com
+'''
+
+
+class TestImport(object):
+    def test_parse_catalog(self):
+        assert list(parse_catalog(CATALOG).items()) == [('t1', 'https://test1.com'), ('t2', 'https://test2.com')]
+        assert parse_catalog('{"indexes": {"t1": {"index_url": "https://test1.com"}}}') == {'t1': 'https://test1.com'}
+        for text in ('[]', 'indexes: [a]', 'indexes: {t1: 1}', 'indexes: {'):
+            with pytest.raises(exception.InvalidCatalog):
+                parse_catalog(text)
+
+    def test_set_indexes_single_write(self, chpip_manager, monkeypatch):
+        writes = []
+        original = chpip_manager._write_chpip_data
+        monkeypatch.setattr(chpip_manager, '_write_chpip_data', lambda data: writes.append(1) or original(data))
+        indexes = dict(('t{}'.format(i), 'https://test{}.com'.format(i)) for i in range(500))
+        results = chpip_manager.set_indexes(indexes)
+        assert len(writes) == 1
+        assert set(action for _, action in results.values()) == {'added'}
+        assert len(chpip_manager.indexes()) == 500
+
+        chpip_manager.set_indexes(indexes)
+        assert len(writes) == 1
+
+    def test_set_indexes_validates_first(self, chpip_manager):
+        chpip_manager.set_index('t1', 'https://test1.com')
+        with pytest.raises(exception.InvalidIndexURL):
+            chpip_manager.set_indexes({'t2': 'https://test2.com', 't3': 'ftp://test3.com'})
+        with pytest.raises(exception.InvalidIndexName):
+            chpip_manager.set_indexes({'default': 'https://test2.com'})
+        with pytest.raises(exception.InvalidConflictPolicy):
+            chpip_manager.set_indexes({'t2': 'https://test2.com'}, on_conflict='merge')
+        assert [index.name for index in chpip_manager.indexes()] == ['t1']
+
+    @pytest.mark.parametrize('on_conflict, expected, stored', [
+        ('skip', ('t1', 'skipped'), {'t1': 'https://test1.com'}),
+        ('overwrite', ('t1', 'overwritten'), {'t1': 'https://new.com'}),
+        ('rename', ('t1-3', 'renamed'), {'t1': 'https://test1.com', 't1-2': 'https://other.com',
+                                         't1-3': 'https://new.com'}),
+    ])
+    def test_conflict_policies(self, chpip_manager, on_conflict, expected, stored):
+        chpip_manager.set_indexes({'t1': 'https://test1.com', 't1-2': 'https://other.com'})
+        results = chpip_manager.set_indexes({'t1': 'https://new.com'}, on_conflict=on_conflict)
+        assert results['t1'] == expected
+        assert dict(chpip_manager.indexes()) == dict(stored, **{'t1-2': 'https://other.com'})
+        # Importing the same catalog again changes nothing.
+        assert chpip_manager.set_indexes({'t1': 'https://new.com'}, on_conflict=on_conflict)['t1'][1] in (
+            'skipped', 'unchanged')
+
+    def test_import_export(self, chpip_manager, tmp_path, http_server):
+        path = tmp_path / 'pip.yml'
+        path.write_text(CATALOG)
+        chpip_manager.import_indexes(str(path))
+        chpip_manager.change_index('t1')
+        assert parse_catalog(chpip_manager.export_indexes()) == parse_catalog(CATALOG)
+        assert json.loads(chpip_manager.export_indexes(format='json')) == {
+            'indexes': {'t1': 'https://test1.com', 't2': 'https://test2.com'}}
+
+        server = http_server({'/pip.json': (200, {}, '{"indexes": {"t3": "https://test3.com"}}')})
+        results = chpip_manager.import_indexes(server.url + '/pip.json')
+        assert results['t3'] == ('t3', 'added')
+        with pytest.raises(exception.RequestError):
+            chpip_manager.import_indexes(server.url + '/missing.json')
+        with pytest.raises(exception.InvalidCatalog):
+            chpip_manager.import_indexes(str(tmp_path / 'missing.yml'))
+
+    def test_sessions_are_closed(self, tmp_path, http_server, monkeypatch):
+        server = http_server({'/pip.json': (200, {}, '{"indexes": {"t3": "https://test3.com"}}')})
+        closed = []
+        new_session = http.new_session
+
+        def closing_session(*args, **kwargs):
+            session = new_session(*args, **kwargs)
+            session.close = lambda: closed.append(session)
+            return session
+
+        monkeypatch.setattr(http, 'new_session', closing_session)
+        assert read_catalog(server.url + '/pip.json') == {'t3': 'https://test3.com'}
+        with pytest.raises(exception.RequestError):
+            read_catalog(server.url + '/missing.json')
+        CatalogCache(str(tmp_path / 'catalog.json')).fetch(server.url + '/pip.json')
+        assert len(closed) == 3
+
+    def test_import_command(self, chpip_manager, monkeypatch, tmp_path):
+        monkeypatch.setattr('chpip.__main__.ChpipManager', lambda: chpip_manager)
+        chpip_manager.set_index('t1', 'https://old.com')
+        runner = CliRunner()
+        result = runner.invoke(cli, ['import', '-', '--on-conflict', 'rename'], input=CATALOG)
+        assert result.exit_code == 0, result.output
+        assert result.output.splitlines() == [
+            '  renamed t1 -> t1-2', 'Import 2 indexes successful: 1 added, 1 renamed.']
+        result = runner.invoke(cli, ['export'])
+        assert parse_catalog(result.output) == {
+            't1': 'https://old.com', 't1-2': 'https://test1.com', 't2': 'https://test2.com'}
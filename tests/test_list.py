@@ -0,0 +1,104 @@
+import json
+import time
+
+import pytest
+
+from chpip import core, exception
+from tests.conftest import CATALOG
+
+ETAG = '"v1"'
+
+
+def catalog_route(handler):
+    if handler.headers.get('If-None-Match') == ETAG:
+        return 304, {'ETag': ETAG}, b''
+    return 200, {'ETag': ETAG, 'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'}, CATALOG
+
+
+class TestList(object):
+    EXPECTED = '  ustc (https://mirrors.ustc.edu.cn/pypi/web/simple)\n  pypi (https://pypi.org/simple)'
+
+    def _serve_catalog(self, monkeypatch, http_server, routes=None):
+        server = http_server(routes or {'/pip.yml': catalog_route})
+        monkeypatch.setattr(core, 'SOURCE_PIP_CONFIG_URL', server.url + '/pip.yml')
+        return server
+
+    def test_list_warm_cache(self, chpip_manager, monkeypatch, http_server):
+        server = self._serve_catalog(monkeypatch, http_server)
+        assert chpip_manager.list() == self.EXPECTED
+        assert chpip_manager.list() == self.EXPECTED
+        assert len(server.requests) == 1
+
+    def test_list_revalidate(self, chpip_manager, monkeypatch, http_server):
+        server = self._serve_catalog(monkeypatch, http_server)
+        chpip_manager.list()
+        assert chpip_manager.list(max_age=0) == self.EXPECTED
+        assert chpip_manager.list(refresh=True) == self.EXPECTED
+        assert len(server.requests) == 3
+        for _, _, headers in server.requests[1:]:
+            assert headers['If-None-Match'] == ETAG
+            assert headers['If-Modified-Since'] == 'Mon, 01 Jan 2024 00:00:00 GMT'
+
+    @pytest.mark.parametrize('cache_control', ['max-age=0', 'no-cache', 'no-store', 'max-age=600, no-cache'])
+    def test_list_honors_server_max_age(self, chpip_manager, monkeypatch, http_server, cache_control):
+        server = self._serve_catalog(monkeypatch, http_server, {
+            '/pip.yml': (200, {'Cache-Control': cache_control}, CATALOG),
+        })
+        chpip_manager.list()
+        chpip_manager.list()
+        assert len(server.requests) == 2
+        with open(chpip_manager.catalog_path) as f:
+            assert json.load(f)[core.SOURCE_PIP_CONFIG_URL]['max_age'] == 0
+
+    def test_list_serves_stale_when_offline(self, chpip_manager, monkeypatch, http_server):
+        server = self._serve_catalog(monkeypatch, http_server)
+        chpip_manager.list()
+        server.routes.clear()
+        assert chpip_manager.list(refresh=True) == self.EXPECTED
+
+        monkeypatch.setattr(core, 'SOURCE_PIP_CONFIG_URL', 'http://127.0.0.1:1/pip.yml')
+        with open(chpip_manager.catalog_path) as f:
+            entries = json.load(f)
+        entries = {core.SOURCE_PIP_CONFIG_URL: entries[server.url + '/pip.yml']}
+        with open(chpip_manager.catalog_path, 'w') as f:
+            json.dump(entries, f)
+        assert chpip_manager.list(refresh=True) == self.EXPECTED
+
+    def test_list_offline_without_cache(self, chpip_manager, monkeypatch):
+        monkeypatch.setattr(core, 'SOURCE_PIP_CONFIG_URL', 'http://127.0.0.1:1/pip.yml')
+        with pytest.raises(exception.RequestError):
+            chpip_manager.list()
+
+
+class TestCatalogSources(object):
+    def test_first_success(self, chpip_manager, http_server, tmp_path):
+        slow = http_server({'/pip.yml': (200, {}, 'indexes:\n  slow: https://slow.com\n')}, delay=2)
+        fast = http_server({'/pip.yml': (200, {}, 'indexes:\n  fast: https://fast.com\n')})
+        start = time.time()
+        indexes = chpip_manager.fetch_catalog(sources=[slow.url + '/pip.yml', fast.url + '/pip.yml'])
+        assert list(indexes) == ['fast']
+        assert time.time() - start < 1.5
+
+    def test_merge(self, chpip_manager, http_server, tmp_path, monkeypatch):
+        path = tmp_path / 'pip.yml'
+        path.write_text(u'indexes:\n  local: https://local.com\n  shared: https://local-shared.com\n')
+        server = http_server({'/pip.yml': (200, {}, 'indexes:\n  remote: https://remote.com\n'
+                                                    '  shared: https://remote-shared.com\n')})
+        monkeypatch.setenv(core.CATALOG_SOURCES_ENV, '{},{}'.format(path, server.url + '/pip.yml'))
+        indexes = chpip_manager.fetch_catalog(merge=True)
+        assert list(indexes.items()) == [
+            ('local', 'https://local.com'), ('shared', 'https://local-shared.com'), ('remote', 'https://remote.com'),
+        ]
+
+    def test_deadline(self, chpip_manager, http_server):
+        hung = http_server({'/pip.yml': (200, {}, CATALOG)}, delay=5)
+        start = time.time()
+        with pytest.raises(exception.NoCatalogAvailable):
+            chpip_manager.fetch_catalog(sources=[hung.url + '/pip.yml', 'missing.yml'], deadline=0.5)
+        assert time.time() - start < 2
+
+    def test_retries(self, chpip_manager, http_server):
+        answers = [(503, {}, b'Unavailable'), (200, {}, CATALOG)]
+        server = http_server({'/pip.yml': lambda handler: answers.pop(0)})
+        assert list(chpip_manager.fetch_catalog(sources=[server.url + '/pip.yml'])) == ['ustc', 'pypi']
+        assert len(server.requests) == 2
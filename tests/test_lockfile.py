@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from chpip import core, exception
+from chpip.lockfile import Rewriter, build_mapping, index_root
+
+LOCK = (
+    '--index-url https://mirrors.aliyun.com/pypi/simple\r\n'
+    '--extra-index-url https://mirrors.aliyun.com/pypi/simple2\r\n'
+    'demo @ https://mirrors.aliyun.com/pypi/packages/ab/cd/demo-1.0-py3-none-any.whl#sha256=abc \\\r\n'
+    '    --hash=sha256:abc\r\n'
+    'six==1.16.0 --hash=sha256:def  # via https://mirrors.aliyun.com/pypi/simple/six/\r\n'
+    'other @ https://files.pythonhosted.org/packages/ef/other-2.0.tar.gz\r\n'
+)
+
+
+class TestLockfile(object):
+    def test_index_root(self):
+        assert index_root('https://pypi.org/simple/') == 'https://files.pythonhosted.org/'
+        assert index_root('https://mirrors.ustc.edu.cn/pypi/web/simple') == 'https://mirrors.ustc.edu.cn/pypi/web/'
+        assert index_root('https://devpi.example.com/root/pypi/+simple') is None
+
+    def test_rewriter(self):
+        rewriter = Rewriter(build_mapping(
+            ['https://mirrors.aliyun.com/pypi/simple', 'https://pypi.org/simple'], 'http://mirror.test/simple'))
+        lines = [rewriter.rewrite(line.encode('utf-8') + b'\n') for line in LOCK.split('\r\n')]
+        assert [count for _, count in lines] == [1, 0, 1, 0, 1, 1, 0]
+        assert lines[0][0] == b'--index-url http://mirror.test/simple\n'
+        assert lines[2][0].startswith(b'demo @ http://mirror.test/packages/ab/cd/demo-1.0-py3-none-any.whl#')
+        assert lines[4][0].endswith(b'# via http://mirror.test/simple/six/\n')
+        assert rewriter.target_urls(lines[2][0]) == ['http://mirror.test/packages/ab/cd/demo-1.0-py3-none-any.whl']
+
+    def test_rewrite_lock(self, chpip_manager, tmp_path):
+        path = tmp_path / 'requirements.txt'
+        path.write_bytes(LOCK.encode('utf-8'))
+        chpip_manager.set_index('aliyun', 'https://mirrors.aliyun.com/pypi/simple')
+        chpip_manager.set_index('tsinghua', 'https://pypi.tuna.tsinghua.edu.cn/simple')
+        chpip_manager.change_index('tsinghua')
+
+        result = chpip_manager.rewrite_lock(str(path))
+        assert tuple(result[1:]) == (6, 4, 4, 0)
+        text = path.read_bytes().decode('utf-8')
+        assert text == (
+            LOCK.replace('https://mirrors.aliyun.com/pypi/simple\r', 'https://pypi.tuna.tsinghua.edu.cn/simple\r')
+            .replace('https://mirrors.aliyun.com/pypi/packages/', 'https://pypi.tuna.tsinghua.edu.cn/packages/')
+            .replace('https://mirrors.aliyun.com/pypi/simple/six/', 'https://pypi.tuna.tsinghua.edu.cn/simple/six/')
+            .replace('https://files.pythonhosted.org/', 'https://pypi.tuna.tsinghua.edu.cn/')
+        )
+        assert [f for f in os.listdir(str(tmp_path))] == ['requirements.txt']
+
+        output = tmp_path / 'aliyun.txt'
+        result = chpip_manager.rewrite_lock(str(path), output=str(output), from_names=('tsinghua',),
+                                            to_name='aliyun')
+        assert result.rewritten_urls == 4
+        assert 'pypi.tuna' not in output.read_bytes().decode('utf-8')
+        with pytest.raises(exception.IndexNameNotFound):
+            chpip_manager.rewrite_lock(str(path), to_name='missing')
+        with pytest.raises(exception.InvalidLockFile):
+            chpip_manager.rewrite_lock(str(tmp_path / 'missing.txt'))
+
+    def test_check(self, chpip_manager, http_server, monkeypatch, tmp_path):
+        good = http_server({'/simple/': (200, {}, b''), '/packages/ab/demo-1.0.tar.gz': (200, {}, b'sdist')})
+        bad = http_server({'/simple/': (200, {}, b'')})
+        monkeypatch.setattr(core, 'DEFAULT_INDEX_URL', 'http://old.test/simple')
+        path = tmp_path / 'requirements.txt'
+        lock = b'--index-url http://old.test/simple\ndemo @ http://old.test/packages/ab/demo-1.0.tar.gz\n'
+        path.write_bytes(lock)
+
+        chpip_manager.set_index('bad', bad.url + '/simple')
+        with pytest.raises(exception.UnresolvedURLs) as excinfo:
+            chpip_manager.rewrite_lock(str(path), to_name='bad', check=True)
+        assert 'demo-1.0.tar.gz (HTTP 404)' in str(excinfo.value)
+        assert path.read_bytes() == lock
+
+        chpip_manager.set_index('good', good.url + '/simple')
+        result = chpip_manager.rewrite_lock(str(path), to_name='good', check=True)
+        assert (result.rewritten_urls, result.checked_urls) == (2, 2)
+        assert sorted((method, p) for method, p, _ in good.requests) == [
+            ('HEAD', '/packages/ab/demo-1.0.tar.gz'), ('HEAD', '/simple/')]
@@ -0,0 +1,120 @@
+import pytest
+
+from chpip import core, network
+from chpip.core import AUTO_INDEX_NAME, ChpipManager
+from tests.conftest import SIMPLE_PAGE
+
+ROUTE = '''Iface\tDestination\tGateway \tFlags\tRefCnt\tUse\tMetric\tMask\t\tMTU\tWindow\tIRTT
+eth0\t0000A8C0\t00000000\t0001\t0\t0\t0\t00FFFFFF\t0\t0\t0
+eth0\t00000000\t0100A8C0\t0003\t0\t0\t0\t00000000\t0\t0\t0
+'''
+ARP = '''IP address       HW type     Flags       HW address            Mask     Device
+192.168.0.1      0x1         0x2         aa:bb:cc:dd:ee:ff     *        eth0
+'''
+
+
+class TestFingerprint(object):
+    @pytest.fixture
+    def proc(self, tmp_path, monkeypatch):
+        files = {'route': ROUTE, 'arp': ARP, 'resolv.conf': '# comment\nnameserver 10.0.0.53\nsearch corp.example\n'}
+        for filename, content in files.items():
+            (tmp_path / filename).write_text(content)
+        monkeypatch.setattr(network, 'ROUTE_PATH', str(tmp_path / 'route'))
+        monkeypatch.setattr(network, 'ARP_PATH', str(tmp_path / 'arp'))
+        monkeypatch.setattr(network, 'RESOLV_CONF_PATH', str(tmp_path / 'resolv.conf'))
+        return tmp_path
+
+    def test_components(self, proc):
+        assert network.default_gateway() == '192.168.0.1'
+        assert network.gateway_mac('192.168.0.1') == 'aa:bb:cc:dd:ee:ff'
+        assert network.dns_settings() == ['nameserver 10.0.0.53', 'search corp.example']
+
+    def test_fingerprint(self, proc):
+        office = network.fingerprint()
+        assert len(office) == 16 and network.fingerprint() == office
+        (proc / 'arp').write_text(ARP.replace('aa:bb', '11:22'))
+        assert network.fingerprint() != office
+
+        for filename in ('route', 'arp', 'resolv.conf'):
+            (proc / filename).unlink()
+        assert network.fingerprint() is None
+
+    def test_hook(self, proc):
+        assert network.fingerprint(hook='echo office') == network.fingerprint(hook='echo office')
+        assert network.fingerprint(hook='echo office') != network.fingerprint(hook='echo home')
+        assert network.fingerprint(hook='exit 1') is None
+
+
+class TestNetworkMemory(object):
+    @pytest.fixture
+    def setup(self, chpip_manager, http_server, monkeypatch):
+        monkeypatch.setattr(core, 'DEFAULT_INDEX_URL', http_server({}).url + '/simple')
+        slow = http_server({'/simple/pip/': SIMPLE_PAGE}, delay=0.05)
+        fast = http_server({'/simple/pip/': SIMPLE_PAGE})
+        current = ['office']
+        manager = ChpipManager(pip_dirname=chpip_manager.pip_dirname, fingerprint=lambda: current[0])
+        manager.set_index('slow', slow.url + '/simple')
+        manager.set_index('fast', fast.url + '/simple')
+        return manager, current, slow, fast
+
+    def test_recall_per_network(self, setup):
+        manager, current, slow, fast = setup
+        assert manager.change_index(AUTO_INDEX_NAME) == 'fast'
+        probes = len(fast.requests)
+
+        # Manual choices are not remembered; the pick of ``auto`` is reused without probing.
+        manager.change_index('slow')
+        assert manager.change_index(AUTO_INDEX_NAME) == 'fast'
+        assert len(fast.requests) == probes
+
+        # A new network is probed again even though the ranking is fresh.
+        current[0] = 'vpn'
+        assert manager.change_index(AUTO_INDEX_NAME) == 'fast'
+        assert len(fast.requests) > probes
+        assert list(manager.get_chpip_data()['networks']) == ['office', 'vpn']
+
+    def test_memory_is_bypassed(self, setup):
+        manager, current, slow, fast = setup
+        manager.change_index(AUTO_INDEX_NAME)
+        data = manager.get_chpip_data()
+        data['networks']['office']['index_name'] = 'slow'
+        manager._write_chpip_data(data)
+        assert manager.change_index(AUTO_INDEX_NAME) == 'slow'
+
+        probes = len(fast.requests)
+        assert manager.change_index(AUTO_INDEX_NAME, ttl=0) == 'fast'
+        assert len(fast.requests) > probes
+        assert manager.get_chpip_data()['networks']['office']['index_name'] == 'fast'
+
+    def test_memory_expires(self, setup):
+        manager, current, slow, fast = setup
+        manager.change_index(AUTO_INDEX_NAME)
+        data = manager.get_chpip_data()
+        data['networks']['office']['index_name'] = 'slow'
+        manager._write_chpip_data(data)
+        assert manager.change_index(AUTO_INDEX_NAME, network_ttl=0) == 'fast'
+        assert manager.change_index(AUTO_INDEX_NAME, refresh=True) == 'fast'
+
+    def test_unknown_network(self, setup):
+        manager, current, slow, fast = setup
+        current[0] = None
+        manager.change_index(AUTO_INDEX_NAME)
+        assert 'networks' not in manager.get_chpip_data()
+        assert manager.change_index(AUTO_INDEX_NAME) == 'fast'
+
+    def test_fingerprint_only_for_auto(self, setup):
+        manager, current, slow, fast = setup
+        calls = []
+        manager._fingerprint = lambda: calls.append(1) or 'office'
+        manager.change_index('slow')
+        assert calls == [] and 'networks' not in manager.get_chpip_data()
+        manager.change_index(AUTO_INDEX_NAME)
+        assert calls == [1]
+
+    def test_memory_is_bounded(self, setup, monkeypatch):
+        manager, current, slow, fast = setup
+        monkeypatch.setattr(core, 'MAX_NETWORKS', 2)
+        for network_name in ('a', 'b', 'c'):
+            current[0] = network_name
+            manager.change_index(AUTO_INDEX_NAME)
+        assert list(manager.get_chpip_data()['networks']) == ['b', 'c']
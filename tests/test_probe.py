@@ -0,0 +1,127 @@
+import json
+import os
+import socket
+import ssl
+import subprocess
+
+import pytest
+from click.testing import CliRunner
+
+from chpip import trace, transport
+from chpip.__main__ import cli
+from chpip.bench import DEFAULT_PROJECT
+from chpip.http import new_session
+from chpip.probe import probe_index
+from chpip.transport import SESSION_RESUMPTION, Resolver, ResumingSSLContext, create_resuming_context
+
+PAGE_PATH = '/simple/{}/'.format(DEFAULT_PROJECT)
+
+
+@pytest.fixture
+def certificate(tmp_path):
+    if not SESSION_RESUMPTION:
+        pytest.skip('TLS session resumption needs Python 3.6+')
+    cert, key = str(tmp_path / 'cert.pem'), str(tmp_path / 'key.pem')
+    try:
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-keyout', key,
+                                   '-out', cert, '-days', '1', '-subj', '/CN=localhost',
+                                   '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1'],
+                                  stdout=devnull, stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        pytest.skip('openssl cannot create a certificate')
+    return cert, key
+
+
+class TestProbe(object):
+    def test_resolver(self, monkeypatch):
+        calls = []
+        getaddrinfo = socket.getaddrinfo
+
+        def counting_getaddrinfo(*args):
+            calls.append(args[0])
+            return getaddrinfo(*args)
+
+        monkeypatch.setattr(socket, 'getaddrinfo', counting_getaddrinfo)
+        resolver = Resolver(size=2)
+        assert resolver.resolve('127.0.0.1', 80) == (['127.0.0.1'], False)
+        assert resolver.resolve('127.0.0.1', 80) == (['127.0.0.1'], True)
+        resolver.resolve('127.0.0.2', 80)
+        resolver.resolve('127.0.0.3', 80)
+        assert resolver.resolve('127.0.0.1', 80) == (['127.0.0.1'], False)
+        resolver.forget('127.0.0.1')
+        resolver.resolve('127.0.0.1', 80)
+        assert calls == ['127.0.0.1', '127.0.0.2', '127.0.0.3', '127.0.0.1', '127.0.0.1']
+        with pytest.raises(socket.gaierror):
+            resolver.resolve('127.0.0.1', 80, socket.AF_INET6)
+
+    def test_probe(self, chpip_manager, http_server):
+        server = http_server({PAGE_PATH: (200, {}, b'<a href="#">x</a>')})
+        chpip_manager.set_index('local', server.url + '/simple')
+
+        results = chpip_manager.probe('local')
+        assert [(r.family, r.run) for r in results] == [
+            ('ipv4', 'cold'), ('ipv4', 'keep-alive'), ('ipv4', 'resumed'), ('ipv6', 'cold')]
+        cold, keep_alive, resumed, ipv6 = results
+        assert cold.status == 200 and cold.address == '127.0.0.1' and not cold.reused
+        assert cold.dns_ms is not None and cold.connect_ms is not None and cold.tls_ms is None
+        assert keep_alive.reused and keep_alive.connect_ms is None and keep_alive.ttfb_ms is not None
+        assert not resumed.reused and resumed.connect_ms is not None
+        assert ipv6.status is None and 'Failed to resolve 127.0.0.1' in ipv6.error
+        assert len(server.requests) == 3
+
+    def test_probe_tls(self, http_server, certificate):
+        cert, key = certificate
+        server = http_server({PAGE_PATH: (200, {}, b'')})
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        # Connections are wrapped as they are accepted.
+        get_request = server.get_request
+        server.get_request = lambda: (lambda sock, address: (
+            context.wrap_socket(sock, server_side=True), address))(*get_request())
+
+        url = 'https://localhost:{}/simple'.format(server.server_address[1])
+        cold, keep_alive, resumed = probe_index(url, families=['ipv4'], cafile=cert)
+        assert (cold.status, keep_alive.status, resumed.status) == (200, 200, 200)
+        assert cold.tls_ms is not None and cold.tls_resumed is False
+        assert keep_alive.reused and keep_alive.tls_ms is None
+        assert resumed.tls_resumed is True
+
+    def test_context_without_resumption(self, monkeypatch):
+        assert isinstance(create_resuming_context(), ResumingSSLContext) == SESSION_RESUMPTION
+        monkeypatch.setattr(transport, 'SESSION_RESUMPTION', False)
+        context = create_resuming_context()
+        assert not isinstance(context, ResumingSSLContext)
+        assert context.verify_mode == ssl.CERT_REQUIRED
+
+    def test_traced_phases(self, http_server):
+        server = http_server({'/': (200, {}, b'ok')})
+        spans = []
+        trace.add_hook(spans.append)
+        session = new_session()
+        try:
+            session.get(server.url + '/')
+            session.get(server.url + '/')
+        finally:
+            trace.remove_hook(spans.append)
+            session.close()
+        first, second = [span for span in spans if span['name'] == 'http']
+        assert first['reused'] is False and first['address'] == '127.0.0.1'
+        assert set(['dns_ms', 'connect_ms', 'ttfb_ms']) <= set(first)
+        assert second['reused'] is True and 'connect_ms' not in second
+
+    def test_cli(self, chpip_manager, http_server, monkeypatch):
+        server = http_server({PAGE_PATH: (200, {}, b'')})
+        chpip_manager.set_index('local', server.url + '/simple')
+        chpip_manager.set_index('missing', server.url + '/missing')
+        monkeypatch.setattr('chpip.__main__.ChpipManager', lambda: chpip_manager)
+        runner = CliRunner()
+
+        result = runner.invoke(cli, ['probe', 'local', '-f', 'ipv4', '--json'])
+        assert result.exit_code == 0
+        assert [r['run'] for r in json.loads(result.output)] == ['cold', 'keep-alive', 'resumed']
+        result = runner.invoke(cli, ['probe', 'missing', '-f', 'ipv4'])
+        assert result.exit_code == 1
+        assert 'HTTP 404' in result.output
+        result = runner.invoke(cli, ['probe', 'nope'])
+        assert result.exit_code == 1
@@ -0,0 +1,184 @@
+import hashlib
+import os
+import threading
+
+import pytest
+import requests
+from click.testing import CliRunner
+
+from chpip import core, exception, trace
+from chpip.__main__ import cli
+from chpip.proxy import ArtifactStore, CachingProxy, ProxyServer, artifact_key
+from tests.conftest import SIMPLE_PAGE
+
+WHEEL = b'wheel-data' * 1000
+WHEEL_SHA256 = hashlib.sha256(WHEEL).hexdigest()
+METADATA = b'Metadata-Version: 2.1\nName: demo\nVersion: 1.0\n'
+METADATA_SHA256 = hashlib.sha256(METADATA).hexdigest()
+PAGE = (
+    '<html><body>'
+    '<a href="../../packages/demo-1.0-py3-none-any.whl#sha256={}" data-requires-python="&gt;=3.6" '
+    'data-core-metadata="sha256={}" data-dist-info-metadata="sha256={}">demo-1.0-py3-none-any.whl</a>'
+    '<a href="/packages/demo-1.0.tar.gz" data-yanked>demo-1.0.tar.gz</a>'
+    '</body></html>'
+).format(WHEEL_SHA256, METADATA_SHA256, METADATA_SHA256)
+
+
+@pytest.fixture
+def upstream(http_server):
+    return http_server({
+        '/simple/demo/': (200, {'Content-Type': 'text/html', 'ETag': '"p1"'}, PAGE),
+        '/packages/demo-1.0-py3-none-any.whl': (200, {}, WHEEL),
+        '/packages/demo-1.0-py3-none-any.whl.metadata': (200, {}, METADATA),
+        '/packages/demo-1.0.tar.gz': (200, {}, b'sdist'),
+    }, delay=0.05)
+
+
+@pytest.fixture
+def proxy_server(chpip_manager, http_server, upstream, monkeypatch):
+    monkeypatch.setattr(core, 'DEFAULT_INDEX_URL', http_server({}).url + '/simple')
+    chpip_manager.set_index('broken', http_server({}).url + '/simple')
+    chpip_manager.set_index('upstream', upstream.url + '/simple')
+    server = chpip_manager.create_proxy_server(port=0, max_size=1024 * 1024)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def upstream_paths(upstream):
+    return [path for _, path, _ in upstream.requests]
+
+
+class TestProxy(object):
+    def test_artifact_store_eviction(self, tmp_path):
+        store = ArtifactStore(str(tmp_path), max_size=25)
+        keys = [artifact_key('https://test.com/{}'.format(i), {}) for i in range(3)]
+        store.put(keys[0], [b'0' * 10])
+        store.put(keys[1], [b'1' * 10])
+        os.utime(store.path(keys[0]), (0, 0))
+        os.utime(store.path(keys[1]), (1, 1))
+        assert store.get(keys[0])
+        store.put(keys[2], [b'2' * 10])
+        assert store.get(keys[0]) and store.get(keys[2])
+        assert store.get(keys[1]) is None
+
+    def test_artifact_store_checksum(self, tmp_path):
+        store = ArtifactStore(str(tmp_path), max_size=1024)
+        with pytest.raises(exception.ChecksumMismatch):
+            store.put(artifact_key('https://test.com', {'sha256': '0' * 64}), [b'data'])
+        assert not os.listdir(os.path.dirname(store.path('sha256-' + '0' * 64)))
+
+    def test_simple_page(self, proxy_server, upstream):
+        page = requests.get(proxy_server.index_url + '/Demo/').text
+        assert '/files/sha256-{0}/demo-1.0-py3-none-any.whl#sha256={0}'.format(WHEEL_SHA256) in page
+        assert 'data-requires-python="&gt;=3.6"' in page
+        assert 'data-yanked=""' in page
+        assert requests.get(proxy_server.index_url + '/demo/').text == page
+        assert upstream_paths(upstream) == ['/simple/demo/']
+        assert requests.get(proxy_server.index_url + '/not-a-project/').status_code == 404
+
+    def test_upstream_unreachable(self, tmp_path):
+        proxy = CachingProxy(['http://127.0.0.1:1/simple'], str(tmp_path), max_size=1024, page_max_age=0)
+        server = ProxyServer(proxy, host='127.0.0.1', port=0)
+        thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        try:
+            resp = requests.get(server.index_url + '/demo/')
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert resp.status_code == 502
+        assert 'No upstream index could be reached for `demo`' in resp.text
+
+    def test_upstream_connections_are_shared(self, proxy_server, upstream):
+        proxy_server.proxy.page_max_age = 0
+        spans = []
+        trace.add_hook(spans.append)
+        try:
+            # Every request comes on its own connection, served by its own thread.
+            for _ in range(3):
+                requests.get(proxy_server.index_url + '/demo/', headers={'Connection': 'close'})
+        finally:
+            trace.remove_hook(spans.append)
+        reused = [span['reused'] for span in spans if span['name'] == 'http' and upstream.url in span['url']]
+        assert reused == [False, True, True]
+
+    def test_page_revalidation(self, proxy_server, upstream):
+        proxy_server.proxy.page_max_age = 0
+        requests.get(proxy_server.index_url + '/demo/')
+        requests.get(proxy_server.index_url + '/demo/')
+        assert len(upstream.requests) == 2
+        assert upstream.requests[1][2]['If-None-Match'] == '"p1"'
+
+    def test_coalesced_download(self, proxy_server, upstream):
+        requests.get(proxy_server.index_url + '/demo/')
+        url = proxy_server.index_url.replace('/simple', '/files/sha256-{}/demo-1.0-py3-none-any.whl'.format(
+            WHEEL_SHA256))
+        responses = []
+
+        def download():
+            responses.append(requests.get(url))
+
+        threads = [threading.Thread(target=download) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert [resp.content for resp in responses] == [WHEEL] * 8
+        assert upstream_paths(upstream).count('/packages/demo-1.0-py3-none-any.whl') == 1
+
+        unknown = url.replace(WHEEL_SHA256, '0' * 64)
+        assert requests.get(unknown).status_code == 404
+
+    def test_core_metadata(self, proxy_server, upstream):
+        page = requests.get(proxy_server.index_url + '/demo/').text
+        assert 'data-core-metadata="sha256={}"'.format(METADATA_SHA256) in page
+        # pip requests the metadata at the URL of the file plus ``.metadata``.
+        url = proxy_server.index_url.replace('/simple', '/files/sha256-{}/demo-1.0-py3-none-any.whl'.format(
+            WHEEL_SHA256))
+        resp = requests.get(url + '.metadata')
+        assert resp.status_code == 200
+        assert hashlib.sha256(resp.content).hexdigest() == METADATA_SHA256
+        assert '/packages/demo-1.0-py3-none-any.whl' not in upstream_paths(upstream)
+
+        sdist_key = artifact_key(upstream.url + '/packages/demo-1.0.tar.gz', {})
+        sdist_url = proxy_server.index_url.replace('/simple', '/files/{}/demo-1.0.tar.gz'.format(sdist_key))
+        assert requests.get(sdist_url + '.metadata').status_code == 404
+
+    def test_upstream_order(self, chpip_manager, proxy_server, upstream):
+        chpip_manager.change_index('upstream')
+        assert chpip_manager.get_upstream_urls()[0] == upstream.url + '/simple'
+
+    def test_serve_use(self, chpip_manager, http_server, monkeypatch):
+        monkeypatch.setattr(core, 'DEFAULT_INDEX_URL', http_server({}).url + '/simple')
+        for name in ('upstream', 'mirror'):
+            chpip_manager.set_index(name, http_server({'/simple/pip/': SIMPLE_PAGE}).url + '/simple')
+        chpip_manager.change_index('upstream', failover=1)
+        assert chpip_manager.get_pip_config().has_option('global', 'extra-index-url')
+        monkeypatch.setattr('chpip.__main__.ChpipManager', lambda: chpip_manager)
+        used = []
+
+        def serve_forever(server):
+            # pip must not go around the proxy.
+            used.append((chpip_manager.current_index().name,
+                         chpip_manager.get_pip_config().has_option('global', 'extra-index-url')))
+            raise KeyboardInterrupt
+
+        monkeypatch.setattr(ProxyServer, 'serve_forever', serve_forever)
+        result = CliRunner().invoke(cli, ['serve', '--port', '0', '--use'])
+        assert result.exit_code == 0
+        assert used == [(core.SERVE_INDEX_NAME, False)]
+        assert chpip_manager.current_index().name == 'upstream'
+        assert chpip_manager.get_pip_config().has_option('global', 'extra-index-url')
+        assert core.SERVE_INDEX_NAME not in [index.name for index in chpip_manager.indexes()]
+        assert chpip_manager.get_chpip_data().get('last_index_name') is None
+
+    def test_serve_index_is_no_candidate(self, chpip_manager):
+        chpip_manager.set_index(core.SERVE_INDEX_NAME, 'http://127.0.0.1:1/simple')
+        assert core.SERVE_INDEX_NAME not in chpip_manager._get_candidates(chpip_manager.get_chpip_data())
+        with pytest.raises(exception.IndexNameNotFound):
+            chpip_manager.remove_index('missing')
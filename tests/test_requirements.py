@@ -0,0 +1,102 @@
+import json
+import threading
+import time
+
+import pytest
+
+from chpip import core, exception
+from chpip.core import AUTO_INDEX_NAME
+from chpip.requirements import Requirement, check_requirements, parse_requirements, read_requirements
+
+REQUIREMENTS = '''# pinned by pip-compile
+--index-url https://example.com/simple
+Requests[socks]==2.31.0 \\
+    --hash=sha256:aaaa
+six>=1.0  # any version
+numpy==1.26.0 ; python_version >= "3.9"
+-e git+https://github.com/org/project.git#egg=project
+./local/package
+'''
+
+
+def page(*filenames):
+    return 200, {}, ''.join('<a href="{0}">{0}</a>'.format(filename) for filename in filenames)
+
+
+def json_page(*filenames):
+    files = [{'filename': filename, 'url': filename, 'hashes': {}} for filename in filenames]
+    return (200, {'Content-Type': 'application/vnd.pypi.simple.v1+json'},
+            json.dumps({'meta': {'api-version': '1.0'}, 'name': 'x', 'files': files}))
+
+
+class TestRequirements(object):
+    @pytest.fixture(autouse=True)
+    def unreachable_default(self, monkeypatch, http_server):
+        monkeypatch.setattr(core, 'DEFAULT_INDEX_URL', http_server({}).url + '/simple')
+
+    def test_parse(self, tmp_path):
+        assert parse_requirements(REQUIREMENTS) == [
+            Requirement('requests', '2.31.0'), Requirement('six', None), Requirement('numpy', '1.26.0'),
+        ]
+        (tmp_path / 'base.txt').write_text(u'six==1.16.0\n')
+        (tmp_path / 'dev.txt').write_text(u'-r base.txt\n-c dev.txt\npytest\n')
+        assert read_requirements(str(tmp_path / 'dev.txt')) == [
+            Requirement('six', '1.16.0'), Requirement('pytest', None),
+        ]
+        with pytest.raises(exception.InvalidRequirements):
+            read_requirements(str(tmp_path / 'missing.txt'))
+
+    def test_pipfile_lock(self, tmp_path):
+        path = tmp_path / 'Pipfile.lock'
+        path.write_text(u'{"default": {"Django": {"version": "==4.2"}}, "develop": {"pytest": {}}}')
+        assert read_requirements(str(path)) == [Requirement('django', '4.2'), Requirement('pytest', None)]
+
+    def test_check(self, http_server):
+        full = http_server({
+            '/simple/requests/': json_page('requests-2.31.0-py3-none-any.whl'),
+            '/simple/six/': page('six-1.16.0.tar.gz'),
+        })
+        partial = http_server({'/simple/requests/': page('requests-2.30.0.tar.gz')})
+        results = check_requirements({'full': full.url + '/simple', 'partial': partial.url + '/simple'},
+                                     [Requirement('requests', '2.31'), Requirement('six', None)])
+        results = dict((r.name, (r.missing, r.errors)) for r in results)
+        assert results == {'full': ([], []), 'partial': (['requests==2.31', 'six'], [])}
+
+    def test_per_host_limit(self, http_server):
+        lock = threading.Lock()
+        active = [0, 0]
+
+        def route(handler):
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+            return page('pkg-1.0.tar.gz')
+
+        requirements = [Requirement('pkg{}'.format(i), '1.0') for i in range(24)]
+        server = http_server(dict(('/simple/pkg{}/'.format(i), route) for i in range(24)))
+        start = time.time()
+        results = check_requirements({'test': server.url + '/simple'}, requirements, per_host=4)
+        assert results[0].missing == []
+        assert active[1] == 4
+        # Sequential requests would take 24 * 0.05 seconds.
+        assert time.time() - start < 24 * 0.05
+
+    def test_change_index(self, chpip_manager, http_server, tmp_path):
+        fast = http_server({'/simple/pip/': page('pip-23.0.tar.gz'), '/simple/six/': page('six-1.15.0.tar.gz')})
+        slow = http_server({'/simple/pip/': page('pip-23.0.tar.gz'), '/simple/six/': page('six-1.16.0.tar.gz')},
+                           delay=0.1)
+        chpip_manager.set_index('fast', fast.url + '/simple')
+        chpip_manager.set_index('slow', slow.url + '/simple')
+        path = tmp_path / 'requirements.txt'
+        path.write_text(u'six==1.16.0\n')
+
+        assert chpip_manager.change_index(AUTO_INDEX_NAME) == 'fast'
+        assert chpip_manager.change_index(AUTO_INDEX_NAME, requirements=str(path)) == 'slow'
+
+        path.write_text(u'six==1.17.0\n')
+        with pytest.raises(exception.NoSatisfyingIndex) as excinfo:
+            chpip_manager.change_index(AUTO_INDEX_NAME, requirements=str(path))
+        assert 'fast: misses six==1.17.0' in str(excinfo.value)
@@ -0,0 +1,81 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Budgets in milliseconds, excluding interpreter startup. They leave headroom
+# for slow CI machines and can be changed through the environment.
+IMPORT_BUDGET_MS = float(os.getenv('CHPIP_IMPORT_BUDGET_MS', 100))
+COMMAND_BUDGET_MS = float(os.getenv('CHPIP_COMMAND_BUDGET_MS', 150))
+RUNS = 3
+NETWORK_MODULES = ('requests', 'urllib3', 'idna', 'charset_normalizer', 'chardet',
+                   'multiprocessing.pool', 'http.server', 'BaseHTTPServer')
+
+COMMAND_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter() if hasattr(time, 'perf_counter') else time.time()
+from chpip.__main__ import cli
+try:
+    cli.main(sys.argv[1:], standalone_mode=False)
+except SystemExit:
+    pass
+now = time.perf_counter() if hasattr(time, 'perf_counter') else time.time()
+sys.stderr.write(json.dumps({'ms': (now - start) * 1000, 'modules': list(sys.modules)}))
+'''
+
+
+def run_python(args, home):
+    env = dict(os.environ, HOME=str(home), APPDATA=str(home))
+    proc = subprocess.Popen([sys.executable] + args, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, err = proc.communicate()
+    assert proc.returncode == 0, err
+    return err.decode('utf-8')
+
+
+def run_command(args, home):
+    return json.loads(run_python(['-c', COMMAND_SCRIPT] + args, home).splitlines()[-1])
+
+
+def import_time_ms(home):
+    for line in run_python(['-X', 'importtime', '-c', 'import chpip.__main__'], home).splitlines():
+        parts = [part.strip() for part in line.split('|')]
+        if len(parts) == 3 and parts[2] == 'chpip.__main__':
+            return int(parts[1]) / 1000.0
+    raise AssertionError('chpip.__main__ not found in import time output')
+
+
+@pytest.fixture(scope='module')
+def home(tmp_path_factory):
+    home = tmp_path_factory.mktemp('home')
+    run_command(['set', '-n', 'test', '-i', 'https://test.com'], home)
+    return home
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason='-X importtime requires Python 3.7')
+def test_import_time_budget(home):
+    elapsed = min(import_time_ms(home) for _ in range(RUNS))
+    assert elapsed < IMPORT_BUDGET_MS
+
+
+@pytest.mark.parametrize('args', [
+    ['--help'],
+    ['show'],
+    ['set', '-n', 'other', '-i', 'https://other.com'],
+    ['-n', 'test'],
+    [],
+])
+def test_command_startup(home, args):
+    results = [run_command(args, home) for _ in range(RUNS)]
+    loaded = set(results[0]['modules'])
+    assert not loaded.intersection(NETWORK_MODULES)
+    assert min(result['ms'] for result in results) < COMMAND_BUDGET_MS
+
+
+def test_env_startup(home):
+    results = [run_command(['env', '-n', 'test'], home) for _ in range(RUNS)]
+    loaded = set(results[0]['modules'])
+    assert not loaded.intersection(NETWORK_MODULES + ('yaml',))
+    assert min(result['ms'] for result in results) < COMMAND_BUDGET_MS
@@ -0,0 +1,49 @@
+import os
+from collections import OrderedDict
+
+import pytest
+
+from chpip import exception
+from chpip.core import ChpipManager
+from chpip.utils import STATE_FORMATS, ordered_dump, ordered_load
+
+
+class TestState(object):
+    def test_ordered_round_trip(self):
+        data = OrderedDict([('b', 1), ('a', OrderedDict([('z', None), ('y', 'x')]))])
+        loaded = ordered_load(ordered_dump(data))
+        assert isinstance(loaded, OrderedDict)
+        assert list(loaded) == ['b', 'a'] and list(loaded['a']) == ['z', 'y']
+        assert loaded == data
+
+        for state_format in STATE_FORMATS.values():
+            assert state_format.loads(state_format.dumps(data)) == data
+            assert state_format.loads('') == {}
+
+    def test_invalid_state_format(self, chpip_manager):
+        with pytest.raises(exception.InvalidStateFormat):
+            ChpipManager(pip_dirname=chpip_manager.pip_dirname, state_format='xml')
+
+    def test_json_state(self, chpip_manager):
+        manager = ChpipManager(pip_dirname=chpip_manager.pip_dirname, state_format='json')
+        manager.set_index('t1', 'https://test1.com')
+        assert manager.chpip_path.endswith('.chpip.json')
+        assert manager.get_chpip_data() == {'indexes': {'t1': {'index_url': 'https://test1.com'}}}
+        assert not os.path.exists(chpip_manager.chpip_path)
+
+    def test_migrate_state(self, chpip_manager):
+        chpip_manager.set_index('t1', 'https://test1.com')
+        chpip_manager.change_index('t1')
+        yaml_data = chpip_manager.get_chpip_data()
+
+        manager = ChpipManager(pip_dirname=chpip_manager.pip_dirname, state_format='json')
+        assert manager.get_chpip_data() == yaml_data
+        manager.set_index('t2', 'https://test2.com')
+        assert os.path.exists(manager.chpip_path)
+        assert not os.path.exists(chpip_manager.chpip_path)
+        assert list(manager.get_chpip_data()['indexes']) == ['t1', 'default', 't2']
+
+        assert chpip_manager.get_chpip_data() == manager.get_chpip_data()
+        chpip_manager.change_index('t2')
+        assert not os.path.exists(manager.chpip_path)
+        assert chpip_manager.get_chpip_data()['current_index_name'] == 't2'
@@ -0,0 +1,97 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from chpip import core, exception, trace
+from tests.conftest import CATALOG
+
+
+@pytest.fixture
+def spans():
+    spans = []
+    trace.add_hook(spans.append)
+    yield spans
+    trace.remove_hook(spans.append)
+
+
+def by_name(spans, name):
+    return [s for s in spans if s['name'] == name]
+
+
+def run_chpip(args, home, **extra_env):
+    env = dict(os.environ, HOME=str(home), APPDATA=str(home))
+    env.pop(trace.TRACE_ENV, None)
+    env.update(extra_env)
+    proc = subprocess.Popen([sys.executable, '-m', 'chpip'] + args, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    assert proc.returncode == 0, err
+    return out.decode('utf-8'), err.decode('utf-8')
+
+
+class TestTrace(object):
+    def test_disabled(self, chpip_manager):
+        assert not trace.enabled()
+        assert trace.span('read', path='x') is trace.NULL_SPAN
+        chpip_manager.set_index('t1', 'https://test1.com')
+        assert chpip_manager.change_index('t1') == 't1'
+
+    def test_spans(self, chpip_manager, spans):
+        chpip_manager.set_index('t1', 'https://test1.com')
+        chpip_manager.change_index('t1')
+
+        change = by_name(spans, 'change_index')[0]
+        writes = [s for s in by_name(spans, 'write') if s['parent_id'] == change['id']]
+        assert {s['path'] for s in writes} >= {chpip_manager.pip_path, chpip_manager.chpip_path}
+        assert all(s['bytes'] > 0 and s['duration_ms'] >= 0 for s in writes)
+        reads = [s for s in by_name(spans, 'read') if s['parent_id'] == change['id']]
+        assert any(s.get('bytes') for s in reads)
+        parse = by_name(spans, 'parse')[0]
+        assert parse['parent_id'] in [s['id'] for s in by_name(spans, 'read')]
+        assert by_name(spans, 'dump')
+
+    def test_http_spans(self, chpip_manager, spans, monkeypatch, http_server):
+        server = http_server({'/pip.yml': (200, {}, CATALOG)})
+        monkeypatch.setattr(core, 'SOURCE_PIP_CONFIG_URL', server.url + '/pip.yml')
+        chpip_manager.list()
+
+        http = by_name(spans, 'http')[0]
+        assert http['url'] == server.url + '/pip.yml'
+        assert (http['method'], http['status'], http['bytes'], http['redirects']) == ('GET', 200, len(CATALOG), 0)
+        source = by_name(spans, 'fetch_source')[0]
+        assert source['parent_id'] == by_name(spans, 'fetch_catalog')[0]['id']
+
+    def test_error(self, chpip_manager, spans):
+        with pytest.raises(exception.ChpipException) as excinfo:
+            chpip_manager.change_index('t1')
+        assert by_name(spans, 'change_index')[0]['error'] == excinfo.type.__name__
+
+    def test_failing_hook(self, chpip_manager):
+        def hook(data):
+            raise ValueError(data)
+
+        trace.add_hook(hook)
+        try:
+            chpip_manager.set_index('t1', 'https://test1.com')
+        finally:
+            trace.remove_hook(hook)
+        assert chpip_manager.indexes()[-1] == ('t1', 'https://test1.com')
+
+    def test_flag(self, tmp_path):
+        out, err = run_chpip(['--trace', 'set', '-n', 't1', '-i', 'https://test1.com'], tmp_path)
+        assert 'successful' in out
+        spans = [json.loads(line) for line in err.splitlines()]
+        assert [s['name'] for s in spans if s['parent_id'] is None] == ['import', 'command']
+        command = by_name(spans, 'command')[0]
+        assert command['command'] == 'set'
+        assert by_name(spans, 'set_index')[0]['parent_id'] == command['id']
+
+    def test_env_file(self, tmp_path):
+        path = tmp_path / 'trace.jsonl'
+        _, err = run_chpip(['show'], tmp_path, CHPIP_TRACE=str(path))
+        assert not err
+        with open(str(path)) as f:
+            assert 'show' in [json.loads(line)['name'] for line in f]
@@ -0,0 +1,80 @@
+import hashlib
+import threading
+
+import requests
+
+from chpip import core
+from chpip.warm import is_compatible_wheel, select_files
+
+WHEEL = b'wheel-data' * 1000
+PAGE = (
+    '<a href="/packages/demo-1.0-py2.py3-none-any.whl#sha256={}">demo-1.0-py2.py3-none-any.whl</a>'
+    '<a href="/packages/demo-1.0-cp27-cp27m-win32.whl">demo-1.0-cp27-cp27m-win32.whl</a>'
+    '<a href="/packages/demo-1.0.tar.gz">demo-1.0.tar.gz</a>'
+    '<a href="/packages/demo-0.9.tar.gz">demo-0.9.tar.gz</a>'
+).format(hashlib.sha256(WHEEL).hexdigest())
+
+
+class TestWarm(object):
+    def test_is_compatible_wheel(self):
+        linux = 'linux-x86_64'
+        assert is_compatible_wheel('numpy-1.26.0-cp311-cp311-manylinux_2_17_x86_64.manylinux2014_x86_64.whl',
+                                   platform=linux, version_info=(3, 11))
+        assert not is_compatible_wheel('numpy-1.26.0-cp311-cp311-manylinux_2_17_aarch64.whl',
+                                       platform=linux, version_info=(3, 11))
+        assert not is_compatible_wheel('numpy-1.26.0-cp310-cp310-manylinux_2_17_x86_64.whl',
+                                       platform=linux, version_info=(3, 11))
+        assert is_compatible_wheel('six-1.16.0-py2.py3-none-any.whl', version_info=(3, 11))
+        assert is_compatible_wheel('cryptography-42.0.0-cp39-abi3-macosx_10_12_universal2.whl',
+                                   platform='macosx-11.0-arm64', version_info=(3, 9))
+        assert is_compatible_wheel('pyyaml-6.0-cp311-cp311-win_amd64.whl', platform='win-amd64',
+                                   version_info=(3, 11))
+
+    def test_select_files(self):
+        files = {
+            'k1': 'https://test.com/demo-1.0-cp311-cp311-manylinux_2_17_x86_64.whl',
+            'k2': 'https://test.com/demo-1.0-cp311-cp311-win_amd64.whl',
+            'k3': 'https://test.com/demo-1.0.tar.gz',
+            'k4': 'https://test.com/demo-1.1.tar.gz',
+        }
+        assert select_files(files, '1.0', platform='linux-x86_64') == ['k1']
+        assert select_files(files, '1.0', platform='macosx-11.0-arm64') == ['k3']
+        assert select_files(files, '1.2', platform='linux-x86_64') == []
+
+    def test_warm(self, chpip_manager, http_server, monkeypatch, tmp_path):
+        upstream = http_server({
+            '/simple/demo/': (200, {'Content-Type': 'text/html'}, PAGE),
+            '/packages/demo-1.0-py2.py3-none-any.whl': (200, {}, WHEEL),
+        })
+        monkeypatch.setattr(core, 'DEFAULT_INDEX_URL', http_server({}).url + '/simple')
+        chpip_manager.set_index('upstream', upstream.url + '/simple')
+        chpip_manager.change_index('upstream')
+        path = tmp_path / 'requirements.txt'
+        path.write_text(u'demo==1.0\ndemo\nmissing==1.0\n')
+
+        results = chpip_manager.warm(str(path), platform='linux-x86_64')
+        assert [tuple(r[:4]) for r in results] == [
+            ('demo==1.0', 'downloaded', 1, 0), ('demo', 'page only', 0, 0), ('missing==1.0', 'missing', 0, 0),
+        ]
+        assert results[0].bytes == len(WHEEL)
+        downloads = [path for _, path, _ in upstream.requests if path.startswith('/packages/')]
+        assert downloads == ['/packages/demo-1.0-py2.py3-none-any.whl']
+
+        results = chpip_manager.warm(str(path), platform='linux-x86_64')
+        assert tuple(results[0][:4]) == ('demo==1.0', 'cached', 0, 1)
+        assert len([p for _, p, _ in upstream.requests if p.startswith('/packages/')]) == 1
+
+        # The proxy serves the warmed page and file without going upstream.
+        server = chpip_manager.create_proxy_server(port=0)
+        thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        try:
+            requests_before = len(upstream.requests)
+            page = requests.get(server.index_url + '/demo/').text
+            href = page.split('href="')[1].split('#')[0]
+            assert requests.get(server.index_url.rsplit('/', 1)[0] + href).content == WHEEL
+            assert len(upstream.requests) == requests_before
+        finally:
+            server.shutdown()
+            server.server_close()
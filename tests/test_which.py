@@ -0,0 +1,86 @@
+import json
+
+from click.testing import CliRunner
+
+from chpip.__main__ import cli
+from chpip.projects import ProjectIndex
+from chpip.simple import iter_project_names
+
+ROOT_PAGE = b'''<!DOCTYPE html>
+<html><body>
+<a href="/simple/numpy/">numpy</a>
+<a href="/simple/zope-interface/">zope.interface</a>
+<A HREF="/simple/requests/">Requests</A>
+</body></html>
+'''
+ETAG = '"root-v1"'
+
+
+def root_route(handler):
+    if handler.headers.get('If-None-Match') == ETAG:
+        return 304, {'ETag': ETAG}, b''
+    return 200, {'ETag': ETAG, 'Content-Type': 'text/html'}, ROOT_PAGE
+
+
+class TestWhich(object):
+    def test_iter_project_names(self):
+        chunks = [ROOT_PAGE[i:i + 7] for i in range(0, len(ROOT_PAGE), 7)]
+        assert list(iter_project_names(chunks)) == ['numpy', 'zope-interface', 'requests']
+
+    def test_project_index(self, tmp_path):
+        project_index = ProjectIndex(str(tmp_path / 'test.idx'))
+        assert project_index.contains('numpy') is None
+        names = ['project-{}'.format(i) for i in range(1000)]
+        assert project_index.write(names + ['project-1'], {'index_url': 'https://test.com'}) == 1000
+        assert all(project_index.contains(name) for name in names)
+        assert not project_index.contains('project-1000')
+        assert not project_index.contains('a')
+        assert project_index.contains('Project_1', index_url='https://test.com')
+        assert project_index.contains('project1', index_url='https://other.com') is None
+        assert project_index.metadata() == {'index_url': 'https://test.com', 'count': 1000}
+
+    def test_which(self, chpip_manager, http_server):
+        server = http_server({'/t1/': root_route, '/t2/': (200, {}, b'<a href="/t2/numpy/">numpy</a>')})
+        chpip_manager.set_index('t1', server.url + '/t1')
+        chpip_manager.set_index('t2', server.url + '/t2')
+        assert chpip_manager.which('numpy').unknown == ['t1', 't2']
+
+        results = chpip_manager.refresh_projects()
+        assert [(r.name, r.status, r.count) for r in results] == [('t1', 'updated', 3), ('t2', 'updated', 1)]
+        assert tuple(chpip_manager.which('NumPy')) == ('numpy', ['t1', 't2'], [], [])
+        assert tuple(chpip_manager.which('zope_interface')) == ('zope-interface', ['t1'], ['t2'], [])
+
+        results = chpip_manager.refresh_projects()
+        assert [(r.name, r.status, r.count) for r in results] == [('t1', 'unchanged', 3), ('t2', 'updated', 1)]
+        assert any(headers.get('If-None-Match') == ETAG for _, _, headers in server.requests)
+
+        chpip_manager.set_index('t1', server.url + '/t2')
+        assert chpip_manager.which('numpy').unknown == ['t1']
+
+    def test_refresh_error(self, chpip_manager, http_server):
+        server = http_server()
+        chpip_manager.set_index('t1', server.url + '/missing')
+        result = chpip_manager.refresh_projects()[0]
+        assert (result.status, result.count) == ('error', None)
+        assert '404' in result.error
+
+    def test_json_root(self, chpip_manager, http_server):
+        body = json.dumps({'meta': {'api-version': '1.0'}, 'projects': [{'name': 'Django'}]})
+        server = http_server({'/t1/': (200, {'Content-Type': 'application/vnd.pypi.simple.v1+json'}, body)})
+        chpip_manager.set_index('t1', server.url + '/t1')
+        chpip_manager.refresh_projects()
+        assert chpip_manager.which('django').serving == ['t1']
+
+    def test_cli(self, chpip_manager, http_server, monkeypatch):
+        server = http_server({'/t1/': root_route})
+        chpip_manager.set_index('t1', server.url + '/t1')
+        monkeypatch.setattr('chpip.__main__.ChpipManager', lambda: chpip_manager)
+        runner = CliRunner()
+
+        result = runner.invoke(cli, ['which', '--refresh', 'numpy'])
+        assert result.exit_code == 0
+        assert '`numpy` is served by: t1' in result.output
+        result = runner.invoke(cli, ['which', 'flask'])
+        assert result.exit_code == 1
+        assert '`flask` is not served by any index.' in result.output
+        assert runner.invoke(cli, ['which']).exit_code == 2